@@ -3,17 +3,22 @@ import streamlit as st
 import pandas as pd
 import logging
 import time
+import math
 from decimal import Decimal
 from datetime import date, datetime, timedelta
 from sqlalchemy.orm import Session
 from models import (
-    init_database, get_db, TipoContacto, Industria, IncotermCompra, 
-    IncotermVenta, EstadoOperacion, TipoMovimiento, EstadoPago, TipoPago,
-    Contacto, Operacion, PagoProgramado, MovimientoFinanciero, Factura
+    sesion_db, metricas_pool, obtener_versiones_datos, TipoContacto, Industria, IncotermCompra, 
+    IncotermVenta, EstadoOperacion, TipoMovimiento, EstadoPago, TipoPago, PagoProgramado
 )
 from database import (
     ContactoService, OperacionService, MovimientoFinancieroService, 
-    HSCodeService, FacturaService
+    HSCodeService, FacturaService, GRANULARIDADES_PROYECCION, DIMENSIONES_MARGEN
+)
+from migraciones import ejecutar_migraciones
+from plantilla_movimientos import (
+    generar_plantilla_excel, obtener_instrucciones, importar_plantilla, leer_extracto_bancario,
+    importar_nomenclatura
 )
 import logging
 
@@ -25,51 +30,8 @@ st.set_page_config(
     initial_sidebar_state="expanded"
 )
 
-# Inicializar base de datos
-init_database()
-
-# Migrar campos nuevos
-from database import migrate_database_fields
-migrate_database_fields()
-
-# Función para migrar la tabla pagos_programados
-def migrate_tipo_pagos():
-    """Migra la tabla pagos_programados para agregar y configurar el campo tipo"""
-    from sqlalchemy import text
-    from models import PagoProgramado
-    import streamlit as st
-    
-    db = next(get_db())
-    
-    try:
-        # Verificar si la columna ya existe
-        result = db.execute(text("PRAGMA table_info(pagos_programados)"))
-        columns = [row[1] for row in result.fetchall()]
-        
-        if "tipo" not in columns:
-            st.warning("Actualizando estructura de la base de datos...")
-            # Agregar la columna tipo
-            db.execute(text("ALTER TABLE pagos_programados ADD COLUMN tipo VARCHAR(10)"))
-            
-            # Actualizar valores basados en la descripción
-            pagos = db.query(PagoProgramado).all()
-            for pago in pagos:
-                if "Depósito" in pago.descripcion or "Compra" in pago.descripcion:
-                    db.execute(
-                        text(f"UPDATE pagos_programados SET tipo = '{TipoPago.PAGO.value}' WHERE id = {pago.id}")
-                    )
-                else:  # Cobro o Saldo
-                    db.execute(
-                        text(f"UPDATE pagos_programados SET tipo = '{TipoPago.COBRO.value}' WHERE id = {pago.id}")
-                    )
-            
-            db.commit()
-            st.success("Base de datos actualizada exitosamente.")
-            time.sleep(2)
-            st.rerun()
-    except Exception as e:
-        st.error(f"Error actualizando la base de datos: {str(e)}")
-        logging.error(f"Error en migración: {str(e)}")
+# Inicializar base de datos y aplicar migraciones pendientes (una sola vez por proceso)
+ejecutar_migraciones()
 
 # Configurar logging
 logging.basicConfig(
@@ -79,34 +41,149 @@ logging.basicConfig(
 )
 
 # Funciones de utilidad
-@st.cache_data(ttl=1)  # Cache solo por 1 segundo
-def load_operaciones():
-    """Carga operaciones desde la base de datos"""
-    db = next(get_db())
-    service = OperacionService(db)
-    operaciones = service.obtener_operaciones()
-    
-    data = []
-    for op in operaciones:
-        data.append({
-            "ID": op.id,
-            "Fecha": op.fecha_creacion.strftime("%Y-%m-%d"),
-            "Proveedor": op.proveedor.nombre if op.proveedor else "N/A",
-            "Cliente": op.cliente.nombre if op.cliente else "N/A",
-            "Agente": op.agente_logistico.nombre if op.agente_logistico else "N/A",
-            "HS Code": getattr(op.hs_code, 'codigo', 'N/A') if hasattr(op, 'hs_code') and op.hs_code else "N/A",
-            "Incoterm Compra": op.incoterm_compra.value,
-            "Valor Compra": f"${op.valor_compra:,.2f}",
-            "Incoterm Venta": op.incoterm_venta.value,
-            "Precio Venta": f"${op.precio_venta:,.2f}",
-            "Margen": f"${op.margen_calculado:,.2f}" if op.margen_calculado else "$0.00",
-            "Margen %": f"{op.margen_porcentaje:.1f}%" if op.margen_porcentaje else "0.0%",
-            "Estado": op.estado.value
-        })
-    
-    return pd.DataFrame(data)
+# Los DataFrames llegan con importes numéricos: el formato se aplica solo al mostrarlos
+COLUMNAS_MONEDA = (
+    "Valor Compra", "Precio Venta", "Margen", "Entrada", "Salida", "Subtotal FOB", "Total INCOTERM",
+    "Compras", "Ventas", "Margen Promedio", "Volumen"
+)
+
+def configurar_columnas(df: pd.DataFrame) -> dict:
+    """column_config de st.dataframe para las columnas de moneda, porcentaje y fecha"""
+    config = {}
+    for columna in df.columns:
+        if columna in COLUMNAS_MONEDA:
+            config[columna] = st.column_config.NumberColumn(columna, format="dollar")
+        elif "%" in columna:
+            config[columna] = st.column_config.NumberColumn(columna, format="%.1f%%")
+        elif columna == "Fecha":
+            config[columna] = st.column_config.DateColumn(columna, format="YYYY-MM-DD")
+    return config
+
+# Tablas de las que depende cada lectura cacheada: la caché se invalida cuando cambia su versión
+TABLAS_OPERACIONES = ("operaciones", "contactos", "hs_codes")
+TABLAS_SALDOS = ("movimientos_financieros", "saldos_diarios", "pagos_programados")
+TABLAS_RESUMENES = ("resumen_mensual_operaciones", "resumen_mensual_movimientos")
+
+TAMANO_PAGINA = 50
+MAXIMO_CANCELADAS = 20  # Canceladas listadas en la sección de borrado
+
+@st.cache_data(max_entries=100)
+def _load_pagina_operaciones(_db: Session, version: tuple, estado, despues_de, tamano: int):
+    """Página de operaciones y total del filtro (la sesión no forma parte de la clave de caché)"""
+    service = OperacionService(_db)
+    df, siguiente = service.pagina_operaciones(estado, despues_de, tamano)
+    return df, siguiente, service.contar_operaciones(estado)
+
+def load_pagina_operaciones(db: Session, estado=None, despues_de=None, tamano: int = TAMANO_PAGINA):
+    """Página de operaciones cacheada hasta el próximo commit que modifique sus tablas"""
+    return _load_pagina_operaciones(
+        db, obtener_versiones_datos(db, *TABLAS_OPERACIONES), estado, despues_de, tamano
+    )
+
+@st.cache_data(max_entries=100)
+def _load_pagina_movimientos(_db: Session, version: tuple, fecha_desde: date, fecha_hasta: date,
+                             despues_de, tamano: int):
+    """Página de movimientos y total del período"""
+    service = MovimientoFinancieroService(_db)
+    df, siguiente = service.pagina_movimientos(fecha_desde, fecha_hasta, despues_de, tamano)
+    return df, siguiente, service.contar_movimientos(fecha_desde, fecha_hasta)
+
+def load_pagina_movimientos(db: Session, fecha_desde: date, fecha_hasta: date, despues_de=None,
+                            tamano: int = TAMANO_PAGINA):
+    """Página de movimientos cacheada hasta el próximo commit que los modifique"""
+    return _load_pagina_movimientos(
+        db, obtener_versiones_datos(db, "movimientos_financieros"), fecha_desde, fecha_hasta, despues_de, tamano
+    )
+
+@st.cache_data(max_entries=100)
+def _load_pagina_hs_codes(_db: Session, version: tuple, prefijo: str, despues_de, tamano: int):
+    """Página de códigos HS con sus impuestos y total del filtro"""
+    service = HSCodeService(_db)
+    df, siguiente = service.pagina_hs_codes(prefijo, despues_de, tamano)
+    return df, siguiente, service.contar_hs_codes(prefijo)
+
+def load_pagina_hs_codes(db: Session, prefijo: str = None, despues_de=None, tamano: int = TAMANO_PAGINA):
+    """Página de códigos HS cacheada hasta el próximo commit que modifique códigos o impuestos"""
+    return _load_pagina_hs_codes(
+        db, obtener_versiones_datos(db, "hs_codes", "impuestos_hs"), prefijo, despues_de, tamano
+    )
+
+def pagina_actual(clave: str, filtros: tuple, cargar):
+    """Carga la página visible de un listado paginado por keyset.
+    
+    Guarda en session_state la pila de cursores de las páginas visitadas, que se
+    reinicia al cambiar los filtros o si la página quedó vacía tras un borrado.
+    `cargar(cursor)` devuelve (DataFrame, cursor siguiente, total).
+    """
+    estado = st.session_state.get(clave)
+    if estado is None or estado["filtros"] != filtros:
+        estado = {"filtros": filtros, "cursores": [None]}
+        st.session_state[clave] = estado
+    cursores = estado["cursores"]
+    
+    df, siguiente, total = cargar(cursores[-1])
+    if df.empty and len(cursores) > 1:
+        cursores[:] = [None]
+        df, siguiente, total = cargar(None)
+    return cursores, df, siguiente, total
+
+def controles_paginacion(clave: str, cursores: list, siguiente, total: int, tamano: int = TAMANO_PAGINA):
+    """Botones de página anterior/siguiente y posición actual"""
+    col1, col2, col3 = st.columns([1, 3, 1])
+    with col1:
+        if st.button("◀ Anterior", key=f"{clave}_anterior", disabled=len(cursores) == 1):
+            cursores.pop()
+            st.rerun()
+    with col2:
+        st.caption(f"Página {len(cursores)} de {max(1, math.ceil(total / tamano))} · {total} registros")
+    with col3:
+        if st.button("Siguiente ▶", key=f"{clave}_siguiente", disabled=siguiente is None):
+            cursores.append(siguiente)
+            st.rerun()
+
+@st.cache_data(max_entries=50)
+def _load_saldo(_db: Session, version: tuple, fecha_hasta: date, dias_proyeccion: int, granularidad: str):
+    """Saldo actual y proyectado"""
+    return MovimientoFinancieroService(_db).calcular_saldo(fecha_hasta, dias_proyeccion, granularidad)
+
+@st.cache_data(max_entries=50)
+def _load_analisis_margenes(_db: Session, version: tuple, agrupar_por: str, fecha_desde: date, fecha_hasta: date,
+                            prefijo_hs: str):
+    """Márgenes agrupados por una dimensión"""
+    return OperacionService(_db).analizar_margenes(agrupar_por, fecha_desde, fecha_hasta, prefijo_hs=prefijo_hs)
+
+def load_analisis_margenes(db: Session, agrupar_por: str, fecha_desde: date, fecha_hasta: date,
+                           prefijo_hs: str = None):
+    """Análisis de márgenes cacheado hasta el próximo commit que modifique operaciones"""
+    return _load_analisis_margenes(
+        db, obtener_versiones_datos(db, *TABLAS_OPERACIONES), agrupar_por, fecha_desde, fecha_hasta, prefijo_hs
+    )
+
+@st.cache_data(max_entries=10)
+def _load_resumenes_mensuales(_db: Session, version: tuple):
+    """Totales mensuales de operaciones activas y de movimientos"""
+    return (
+        OperacionService(_db).obtener_resumen_mensual(),
+        MovimientoFinancieroService(_db).obtener_resumen_mensual()
+    )
+
+def load_resumenes_mensuales(db: Session):
+    """Resúmenes mensuales cacheados hasta el próximo commit que los modifique"""
+    return _load_resumenes_mensuales(db, obtener_versiones_datos(db, *TABLAS_RESUMENES))
+
+def comparar_por_anio(df: pd.DataFrame, columna: str) -> pd.DataFrame:
+    """Tabla mes del año × año de una columna de un resumen mensual"""
+    return df.assign(Año=df["Mes"].dt.year.astype(str), Mes=df["Mes"].dt.month).pivot_table(
+        index="Mes", columns="Año", values=columna, aggfunc="sum"
+    )
 
-def show_dashboard():
+def load_saldo(db: Session, fecha_hasta: date, dias_proyeccion: int, granularidad: str):
+    """Saldo cacheado hasta el próximo commit que modifique movimientos o pagos"""
+    return _load_saldo(
+        db, obtener_versiones_datos(db, *TABLAS_SALDOS), fecha_hasta, dias_proyeccion, granularidad
+    )
+
+def show_dashboard(db: Session):
     """Muestra el dashboard principal - ACTUALIZADO"""
     st.header("📊 Dashboard Financiero")
     
@@ -131,14 +208,32 @@ def show_dashboard():
     with col3:
         aplicar_filtro = st.button("🔄 Actualizar Dashboard", use_container_width=True)
     
+    col1, col2 = st.columns(2)
+    
+    with col1:
+        dias_proyeccion = st.selectbox(
+            "Horizonte de proyección:",
+            options=[90, 180, 365, 730],
+            format_func=lambda x: f"{x} días",
+            help="Cantidad de días a proyectar desde la fecha de corte"
+        )
+    
+    with col2:
+        granularidad = st.selectbox(
+            "Granularidad:",
+            options=list(GRANULARIDADES_PROYECCION),
+            index=1,
+            format_func=lambda x: x.title(),
+            help="Intervalo entre los puntos de la proyección"
+        )
+    
     # Obtener servicios
-    db = next(get_db())
     operacion_service = OperacionService(db)
     movimiento_service = MovimientoFinancieroService(db)
     
     # Calcular métricas
     resumen_operaciones = operacion_service.obtener_resumen_margenes(fecha_desde, fecha_hasta)
-    saldo_financiero = movimiento_service.calcular_saldo(fecha_hasta)
+    saldo_financiero = load_saldo(db, fecha_hasta, dias_proyeccion, granularidad)
     
     st.markdown("---")
     
@@ -279,29 +374,68 @@ def show_dashboard():
     with col4:
         st.metric("Margen % Promedio", f"{resumen_operaciones['margen_porcentaje_promedio']:.1f}%")
     
+    # Desglose de márgenes por dimensión
+    st.markdown("---")
+    st.subheader("📈 Análisis de Márgenes")
+    
+    col1, col2 = st.columns(2)
+    with col1:
+        dimension = st.selectbox(
+            "Agrupar por:",
+            options=list(DIMENSIONES_MARGEN),
+            format_func=lambda x: DIMENSIONES_MARGEN[x],
+            key="margenes_dimension"
+        )
+    with col2:
+        prefijo_hs = st.text_input(
+            "Código HS (prefijo):",
+            placeholder="Ej: 84 para todo el capítulo",
+            key="margenes_prefijo_hs"
+        ).strip()
+    df_margenes = load_analisis_margenes(db, dimension, fecha_desde, fecha_hasta, prefijo_hs or None)
+    
+    if not df_margenes.empty:
+        st.bar_chart(df_margenes.set_index(DIMENSIONES_MARGEN[dimension])["Margen"])
+        st.dataframe(
+            df_margenes,
+            column_config=configurar_columnas(df_margenes),
+            hide_index=True,
+            use_container_width=True
+        )
+    else:
+        st.info("No hay operaciones activas en el período seleccionado.")
+    
+    # Comparativo interanual desde los resúmenes mensuales
+    st.markdown("---")
+    st.subheader("📅 Comparativo Interanual")
+    
+    resumen_operaciones_mensual, resumen_movimientos_mensual = load_resumenes_mensuales(db)
+    col1, col2 = st.columns(2)
+    with col1:
+        st.write("**Margen mensual por año**")
+        if not resumen_operaciones_mensual.empty:
+            st.line_chart(comparar_por_anio(resumen_operaciones_mensual, "Margen"))
+        else:
+            st.info("No hay operaciones activas registradas.")
+    with col2:
+        st.write("**Flujo neto mensual por año**")
+        if not resumen_movimientos_mensual.empty:
+            st.line_chart(comparar_por_anio(resumen_movimientos_mensual, "Neto"))
+        else:
+            st.info("No hay movimientos registrados.")
+    
     # Vista de movimientos recientes
     st.markdown("---")
     st.subheader("💸 Movimientos Recientes")
     
-    movimientos_recientes = movimiento_service.obtener_movimientos(
+    df_movimientos = movimiento_service.tabla_movimientos(
         fecha_desde=fecha_desde, 
-        fecha_hasta=fecha_hasta
-    )
+        fecha_hasta=fecha_hasta,
+        limite=10
+    ).drop(columns=["Observaciones"])
     
-    if movimientos_recientes:
-        data_movimientos = []
-        for mov in movimientos_recientes[:10]:
-            data_movimientos.append({
-                "Fecha": mov.fecha.strftime("%Y-%m-%d"),
-                "Tipo": mov.tipo.value.replace("_", " ").title(),
-                "Descripción": mov.descripcion,
-                "Entrada": f"${mov.monto_entrada:,.2f}" if mov.monto_entrada > 0 else "-",
-                "Salida": f"${mov.monto_salida:,.2f}" if mov.monto_salida > 0 else "-",
-                "Referencia": mov.referencia or "-"
-            })
-        
-        df_movimientos = pd.DataFrame(data_movimientos)
-        st.dataframe(df_movimientos, use_container_width=True)
+    if not df_movimientos.empty:
+        st.dataframe(df_movimientos, column_config=configurar_columnas(df_movimientos), use_container_width=True)
     else:
         st.info("No hay movimientos financieros en el período seleccionado.")
     
@@ -309,13 +443,13 @@ def show_dashboard():
     if resumen_operaciones["total_operaciones"] > 0:
         st.markdown("---")
         st.subheader("📋 Operaciones Recientes")
-        df = load_operaciones()
+        df, _, _ = load_pagina_operaciones(db, tamano=5)
         if not df.empty:
-            st.dataframe(df.head(), use_container_width=True)
+            st.dataframe(df, column_config=configurar_columnas(df), use_container_width=True)
     else:
         st.info("No hay operaciones registradas en el sistema.")
 
-def show_gestion_financiera():
+def show_gestion_financiera(db: Session):
     """Gestión de movimientos financieros"""
     st.header("💰 Gestión Financiera")
     
@@ -387,7 +521,6 @@ def show_gestion_financiera():
                 st.error("Solo puede ingresar entrada O salida, no ambas")
             else:
                 try:
-                    db = next(get_db())
                     movimiento_service = MovimientoFinancieroService(db)
                     movimiento_service.crear_movimiento(
                         fecha=fecha_movimiento,
@@ -406,11 +539,51 @@ def show_gestion_financiera():
                     # Agregar logging para debug
                     logging.error(f"Error en registro de movimiento: {str(e)}")
 
+    with st.expander("🏦 Importar extracto bancario (CSV)"):
+        st.write(
+            "Columnas: Fecha (YYYY-MM-DD), Descripcion, Referencia y Monto con signo "
+            "(o Entrada y Salida). Opcionales: Tipo y Operacion (ID). "
+            "Las líneas ya importadas se omiten automáticamente."
+        )
+        tipos_extracto = [TipoMovimiento.APORTE_INICIAL, TipoMovimiento.ADELANTO,
+                          TipoMovimiento.RETIRO, TipoMovimiento.PAGO_IMPUESTOS]
+        col1, col2 = st.columns(2)
+        with col1:
+            tipo_entrada = st.selectbox(
+                "Tipo para entradas sin operación:",
+                options=tipos_extracto,
+                index=1,
+                format_func=lambda x: x.value.replace("_", " ").title()
+            )
+        with col2:
+            tipo_salida = st.selectbox(
+                "Tipo para salidas sin operación:",
+                options=tipos_extracto,
+                index=2,
+                format_func=lambda x: x.value.replace("_", " ").title()
+            )
+        extracto = st.file_uploader("Extracto bancario:", type=["csv"], key="extracto_bancario")
+        
+        if extracto is not None and st.button("🚀 Importar extracto"):
+            try:
+                movimientos, errores = leer_extracto_bancario(extracto, tipo_entrada, tipo_salida)
+                resultado = MovimientoFinancieroService(db).importar_movimientos(movimientos)
+                st.success(
+                    f"✅ {resultado['importados']} movimientos importados, "
+                    f"{resultado['duplicados']} ya registrados omitidos"
+                )
+                if resultado["operaciones"]:
+                    st.info(f"Pagos reconciliados en {len(resultado['operaciones'])} operaciones")
+                if not errores.empty:
+                    st.warning(f"⚠️ {len(errores)} líneas rechazadas")
+                    st.dataframe(errores, use_container_width=True, hide_index=True)
+            except Exception as e:
+                st.error(f"Error al importar el extracto: {str(e)}")
+
     # Mostrar resumen de movimientos recientes
     st.markdown("---")
     st.subheader("📊 Movimientos Recientes")
     
-    db = next(get_db())
     movimiento_service = MovimientoFinancieroService(db)
     
     # Filtros para ver movimientos
@@ -428,41 +601,44 @@ def show_gestion_financiera():
             key="mov_hasta"
         )
     
-    # Obtener y mostrar movimientos
-    movimientos = movimiento_service.obtener_movimientos(fecha_desde, fecha_hasta)
-    
-    if movimientos:
-        data_movimientos = []
-        for mov in movimientos:
-            data_movimientos.append({
-                "Fecha": mov.fecha.strftime("%Y-%m-%d"),
-                "Tipo": mov.tipo.value.replace("_", " ").title(),
-                "Descripción": mov.descripcion,
-                "Entrada": f"${mov.monto_entrada:,.2f}" if mov.monto_entrada > 0 else "-",
-                "Salida": f"${mov.monto_salida:,.2f}" if mov.monto_salida > 0 else "-",
-                "Referencia": mov.referencia or "-",
-                "Observaciones": mov.observaciones or "-"
-            })
-        
-        df_movimientos = pd.DataFrame(data_movimientos)
-        st.dataframe(df_movimientos, use_container_width=True)
-        
-        # Botón para descargar
-        csv = df_movimientos.to_csv(index=False)
-        st.download_button(
-            label="📥 Descargar Movimientos CSV",
-            data=csv,
-            file_name=f"movimientos_{datetime.now().strftime('%Y%m%d')}.csv",
-            mime="text/csv"
-        )
+    # Obtener y mostrar la página visible de movimientos
+    cursores, df_movimientos, siguiente, total = pagina_actual(
+        "pagina_movimientos",
+        (fecha_desde, fecha_hasta),
+        lambda cursor: load_pagina_movimientos(db, fecha_desde, fecha_hasta, cursor)
+    )
+    
+    if not df_movimientos.empty:
+        st.dataframe(df_movimientos, column_config=configurar_columnas(df_movimientos), use_container_width=True)
+        controles_paginacion("pagina_movimientos", cursores, siguiente, total)
+        
+        # Botón para descargar: el período completo solo se lee si se pide
+        if st.checkbox("Preparar CSV con todos los movimientos del período", key="csv_movimientos"):
+            csv = movimiento_service.tabla_movimientos(fecha_desde, fecha_hasta).to_csv(index=False)
+            st.download_button(
+                label="📥 Descargar Movimientos CSV",
+                data=csv,
+                file_name=f"movimientos_{datetime.now().strftime('%Y%m%d')}.csv",
+                mime="text/csv"
+            )
     else:
         st.info("No hay movimientos en el período seleccionado.")
     
+    with st.expander("🧮 Reconstruir resúmenes mensuales"):
+        st.write("Recalcula desde cero los totales mensuales de operaciones y movimientos que usan los reportes.")
+        if st.button("Reconstruir resúmenes", key="reconstruir_resumenes"):
+            try:
+                filas_operaciones = OperacionService(db).reconstruir_resumen_mensual()
+                filas_movimientos = movimiento_service.reconstruir_resumen_mensual()
+                st.success(f"✅ Resúmenes reconstruidos: {filas_operaciones} filas de operaciones, {filas_movimientos} de movimientos")
+            except Exception as e:
+                st.error(f"Error al reconstruir resúmenes: {str(e)}")
+    
     # Mostrar saldo actual
     st.markdown("---")
     st.subheader("💳 Saldo Actual")
     
-    saldo = movimiento_service.calcular_saldo(fecha_hasta)
+    saldo = load_saldo(db, fecha_hasta, 90, "semanal")
     
     col1, col2, col3, col4 = st.columns(4)
     with col1:
@@ -473,7 +649,7 @@ def show_gestion_financiera():
         st.metric("Total Salidas", f"${saldo['total_salidas']:,.2f}")
     with col4:
         st.metric("Saldo Proyectado", f"${saldo['saldo_proyectado']:,.2f}")
-def show_nueva_operacion():
+def show_nueva_operacion(db: Session):
     """Formulario para crear nueva operación"""
     # Initialize session state for payments
     if 'cobros_programados' not in st.session_state:
@@ -484,7 +660,6 @@ def show_nueva_operacion():
     st.header("🆕 Nueva Operación")
     
     # Obtener contactos
-    db = next(get_db())
     contacto_service = ContactoService(db)
     
     proveedores = contacto_service.obtener_contactos(TipoContacto.PROVEEDOR)
@@ -786,14 +961,53 @@ def show_nueva_operacion():
                     - Precio Venta: ${precio_venta:,.2f}
                     - Margen: ${operacion.margen_calculado:,.2f} ({operacion.margen_porcentaje:.1f}%)
                     """)
-                    
-                    # Limpiar cache para actualizar la vista
-                    st.cache_data.clear()
+
                     
                 except Exception as e:
                     st.error(f"Error al crear operación: {str(e)}")
                     st.error(f"Detalles del error: {traceback.format_exc()}")
-def show_operaciones():
+def show_importar_operaciones(db: Session):
+    """Carga masiva de operaciones desde la plantilla CSV/Excel"""
+    st.header("📤 Importar Operaciones")
+    
+    col1, col2 = st.columns(2)
+    with col1:
+        st.download_button(
+            label="📥 Descargar plantilla de ejemplo (CSV)",
+            data=generar_plantilla_excel().to_csv(index=False),
+            file_name="plantilla_operaciones.csv",
+            mime="text/csv"
+        )
+    with col2:
+        with st.expander("📖 Instrucciones"):
+            st.text(obtener_instrucciones())
+    
+    archivo = st.file_uploader("Archivo de operaciones:", type=["csv", "xlsx"])
+    tamano_lote = st.number_input("Operaciones por transacción:", min_value=50, max_value=5000, value=500, step=50)
+    
+    if archivo is not None and st.button("🚀 Importar"):
+        try:
+            with st.spinner("Importando operaciones..."):
+                importadas, errores = importar_plantilla(db, archivo, archivo.name, int(tamano_lote))
+        except Exception as e:
+            st.error(f"Error al leer el archivo: {str(e)}")
+            return
+        
+        if importadas:
+            st.success(f"✅ {importadas} operaciones importadas")
+        if not errores.empty:
+            st.warning(f"⚠️ {len(errores)} filas rechazadas")
+            st.dataframe(errores, use_container_width=True, hide_index=True)
+            st.download_button(
+                label="📥 Descargar reporte de errores",
+                data=errores.to_csv(index=False),
+                file_name=f"errores_importacion_{datetime.now().strftime('%Y%m%d_%H%M')}.csv",
+                mime="text/csv"
+            )
+        elif not importadas:
+            st.info("El archivo no contiene operaciones")
+
+def show_operaciones(db: Session):
     """Muestra todas las operaciones"""
     st.header("📋 Lista de Operaciones")
     
@@ -806,24 +1020,27 @@ def show_operaciones():
             options=["Todos", "ACTIVA", "COMPLETADA", "CANCELADA"]
         )
     
-    # Cargar y mostrar datos
-    df = load_operaciones()
-    st.cache_data.clear()  # Limpiar caché antes de mostrar
+    # Cargar y mostrar la página visible, con el filtro aplicado en la consulta
+    estado = None if estado_filtro == "Todos" else EstadoOperacion(estado_filtro.lower())
+    cursores, df, siguiente, total = pagina_actual(
+        "pagina_operaciones",
+        (estado_filtro,),
+        lambda cursor: load_pagina_operaciones(db, estado, cursor)
+    )
     
     if df is not None and not df.empty:
-        if estado_filtro != "Todos":
-            df = df[df["Estado"] == estado_filtro.lower()]
+        st.dataframe(df, column_config=configurar_columnas(df), use_container_width=True)
+        controles_paginacion("pagina_operaciones", cursores, siguiente, total)
         
-        st.dataframe(df, use_container_width=True)
-        
-        # Botón para descargar CSV
-        csv = df.to_csv(index=False)
-        st.download_button(
-            label="📥 Descargar CSV",
-            data=csv,
-            file_name=f"operaciones_{datetime.now().strftime('%Y%m%d')}.csv",
-            mime="text/csv"
-        )
+        # Botón para descargar CSV: el listado completo solo se lee si se pide
+        if st.checkbox("Preparar CSV con todas las operaciones del filtro", key="csv_operaciones"):
+            csv = OperacionService(db).tabla_operaciones(estado).to_csv(index=False)
+            st.download_button(
+                label="📥 Descargar CSV",
+                data=csv,
+                file_name=f"operaciones_{datetime.now().strftime('%Y%m%d')}.csv",
+                mime="text/csv"
+            )
         
         # Mostrar detalle de pagos programados
         if not df.empty:
@@ -838,7 +1055,6 @@ def show_operaciones():
             if operacion_id:
                 # Obtener pagos programados
                 from models import PagoProgramado
-                db = next(get_db())
                 pagos = db.query(PagoProgramado).filter(PagoProgramado.operacion_id == operacion_id).all()
                 
                 if pagos:
@@ -857,208 +1073,211 @@ def show_operaciones():
                     st.dataframe(df_pagos, use_container_width=True)
                 else:
                     st.info("Esta operación no tiene pagos programados.")
+                
+                # Edición de costos: recalcula el margen, los montos de los pagos y su estado
+                with st.expander("✏️ Editar costos y precio"):
+                    from models import Operacion
+                    operacion = db.query(Operacion).filter(Operacion.id == operacion_id).first()
+                    
+                    if operacion:
+                        with st.form(f"editar_costos_{operacion_id}"):
+                            col1, col2 = st.columns(2)
+                            
+                            with col1:
+                                valor_compra = st.number_input(
+                                    "Valor de Compra (USD):",
+                                    min_value=0.0,
+                                    value=float(operacion.valor_compra),
+                                    step=100.0
+                                )
+                                costo_flete = st.number_input(
+                                    "Costo de Flete (USD):",
+                                    min_value=0.0,
+                                    value=float(operacion.costo_flete or 0.0),
+                                    step=50.0
+                                )
+                            
+                            with col2:
+                                precio_venta = st.number_input(
+                                    "Precio de Venta (USD):",
+                                    min_value=0.0,
+                                    value=float(operacion.precio_venta),
+                                    step=100.0
+                                )
+                                costo_despachante = st.number_input(
+                                    "Costo Despachante (USD):",
+                                    min_value=0.0,
+                                    value=float(operacion.costo_despachante or 0.0),
+                                    step=50.0
+                                )
+                            
+                            submitted = st.form_submit_button("💾 Guardar costos", use_container_width=True)
+                        
+                        if submitted:
+                            if precio_venta <= valor_compra:
+                                st.error("El precio de venta debe ser mayor al valor de compra")
+                            else:
+                                try:
+                                    OperacionService(db).actualizar_costos(
+                                        operacion_id,
+                                        valor_compra=valor_compra,
+                                        costo_flete=costo_flete,
+                                        costo_despachante=costo_despachante,
+                                        precio_venta=precio_venta
+                                    )
+                                    st.success(f"✅ Costos de la operación #{operacion_id} actualizados")
+                                    st.rerun()
+                                except Exception as e:
+                                    st.error(f"❌ Error al actualizar costos: {str(e)}")
         
         # Sección de borrado de operaciones
         st.markdown("---")
         st.subheader("🗑️ Borrar Operación")
         
-        # Obtener operaciones desde la base de datos
-        db = next(get_db())
+        # Cantidades por estado en una consulta agrupada; el selector usa la página visible
         operacion_service = OperacionService(db)
-        operaciones_todas = operacion_service.obtener_operaciones()
+        conteo_estados = operacion_service.contar_por_estado()
+        operaciones_pagina = df.set_index("ID")
+        
+        col1, col2 = st.columns(2)
         
-        if operaciones_todas:
-            # Separar operaciones por estado
-            operaciones_activas = [op for op in operaciones_todas if op.estado == EstadoOperacion.ACTIVA]
-            operaciones_completadas = [op for op in operaciones_todas if op.estado == EstadoOperacion.COMPLETADA]
-            operaciones_canceladas = [op for op in operaciones_todas if op.estado == EstadoOperacion.CANCELADA]
+        with col1:
+            st.info(f"📊 **Resumen de operaciones:**")
+            st.write(f"- Activas: {conteo_estados.get(EstadoOperacion.ACTIVA, 0)}")
+            st.write(f"- Completadas: {conteo_estados.get(EstadoOperacion.COMPLETADA, 0)}")
+            st.write(f"- Canceladas: {conteo_estados.get(EstadoOperacion.CANCELADA, 0)}")
             
-            col1, col2 = st.columns(2)
+            # Selector de operación a borrar
+            operacion_a_borrar = st.selectbox(
+                "Seleccionar operación a borrar (página actual):",
+                options=[None] + operaciones_pagina.index.tolist(),
+                format_func=lambda x: "Seleccionar..." if x is None else (
+                    f"#{x} - {operaciones_pagina.at[x, 'Cliente']} - "
+                    f"${operaciones_pagina.at[x, 'Precio Venta']:,.2f} ({operaciones_pagina.at[x, 'Estado']})"
+                ),
+                key="operacion_borrar"
+            )
             
-            with col1:
-                st.info(f"📊 **Resumen de operaciones:**")
-                st.write(f"- Activas: {len(operaciones_activas)}")
-                st.write(f"- Completadas: {len(operaciones_completadas)}")
-                st.write(f"- Canceladas: {len(operaciones_canceladas)}")
+            if operacion_a_borrar:
+                # Datos de la operación tomados de la fila de la página
+                operacion = operaciones_pagina.loc[operacion_a_borrar]
+                operacion_id = int(operacion_a_borrar)
+                cliente_nombre = operacion["Cliente"]
+                proveedor_nombre = operacion["Proveedor"]
+                precio_venta = operacion["Precio Venta"]
+                estado = EstadoOperacion(operacion["Estado"])
+                fecha_creacion = operacion["Fecha"]
                 
-                # Selector de operación a borrar
-                if operaciones_todas:
-                    operacion_a_borrar = st.selectbox(
-                        "Seleccionar operación a borrar:",
-                        options=[None] + operaciones_todas,
-                        format_func=lambda x: "Seleccionar..." if x is None else f"#{x.id} - {x.cliente.nombre} - ${x.precio_venta:,.2f} ({x.estado.value})",
-                        key="operacion_borrar"
-                    )
-                    
-                    if operacion_a_borrar:
-                        # Obtener información de la operación de forma segura
-                        operacion_id = operacion_a_borrar.id
-                        cliente_nombre = operacion_a_borrar.cliente.nombre
-                        proveedor_nombre = operacion_a_borrar.proveedor.nombre
-                        precio_venta = operacion_a_borrar.precio_venta
-                        estado = operacion_a_borrar.estado
-                        fecha_creacion = operacion_a_borrar.fecha_creacion
-                        
-                        # Contar registros relacionados usando la base de datos directamente
-                        movimientos_count = db.query(MovimientoFinanciero).filter(
-                            MovimientoFinanciero.operacion_id == operacion_id
-                        ).count()
-                        
-                        pagos_count = db.query(PagoProgramado).filter(
-                            PagoProgramado.operacion_id == operacion_id
-                        ).count()
-                        
-                        factura_exists = db.query(Factura).filter(
-                            Factura.operacion_id == operacion_id
-                        ).first() is not None
-                        
-                        # Mostrar información de la operación
-                        st.warning(f"⚠️ **Operación a borrar:**")
-                        st.write(f"- **ID:** #{operacion_id}")
-                        st.write(f"- **Cliente:** {cliente_nombre}")
-                        st.write(f"- **Proveedor:** {proveedor_nombre}")
-                        st.write(f"- **Valor:** ${precio_venta:,.2f}")
-                        st.write(f"- **Estado:** {estado.value.title()}")
-                        st.write(f"- **Fecha:** {fecha_creacion.strftime('%d/%m/%Y')}")
-                        
-                        st.write(f"- **Movimientos financieros:** {movimientos_count}")
-                        st.write(f"- **Pagos programados:** {pagos_count}")
-                        st.write(f"- **Factura:** {'Sí' if factura_exists else 'No'}")
-                        
-                        # Confirmación de borrado
-                        st.error("⚠️ **ADVERTENCIA:** Esta acción eliminará la operación y TODOS sus registros relacionados (movimientos, pagos, factura).")
-                        
-                        confirmar_texto = st.text_input(
-                            f"Para confirmar, escribe: **BORRAR {operacion_id}**",
-                            key="confirmar_operacion"
-                        )
-                        
-                        if st.button("🗑️ CONFIRMAR BORRADO", type="primary", key="confirmar_borrado_op"):
-                            if confirmar_texto == f"BORRAR {operacion_id}":
-                                try:
-                                    # Obtener la operación fresca de la base de datos
-                                    operacion_id = operacion_a_borrar.id
-                                    
-                                    # Crear una nueva sesión para evitar conflictos
-                                    db_fresh = next(get_db())
-                                    
-                                    operacion_fresh = db_fresh.query(Operacion).filter(Operacion.id == operacion_id).first()
-                                    
-                                    if operacion_fresh:
-                                        # Contar registros antes de borrar
-                                        movimientos_borrar = db_fresh.query(MovimientoFinanciero).filter(
-                                            MovimientoFinanciero.operacion_id == operacion_id
-                                        ).count()
-                                        
-                                        pagos_borrar = db_fresh.query(PagoProgramado).filter(
-                                            PagoProgramado.operacion_id == operacion_id
-                                        ).count()
-                                        
-                                        facturas_borrar = db_fresh.query(Factura).filter(
-                                            Factura.operacion_id == operacion_id
-                                        ).count()
-                                        
-                                        # Borrar registros relacionados
-                                        # 1. Movimientos financieros
-                                        db_fresh.query(MovimientoFinanciero).filter(
-                                            MovimientoFinanciero.operacion_id == operacion_id
-                                        ).delete()
-                                        
-                                        # 2. Pagos programados
-                                        db_fresh.query(PagoProgramado).filter(
-                                            PagoProgramado.operacion_id == operacion_id
-                                        ).delete()
-                                        
-                                        # 3. Facturas
-                                        db_fresh.query(Factura).filter(
-                                            Factura.operacion_id == operacion_id
-                                        ).delete()
-                                        
-                                        # 4. Finalmente, borrar la operación
-                                        db_fresh.delete(operacion_fresh)
-                                        
-                                        # Confirmar cambios
-                                        db_fresh.commit()
-                                        
-                                        st.success(f"""✅ **Operación #{operacion_id} borrada exitosamente!**
-                                        
-                                        **Registros eliminados:**
-                                        - Operación: 1
-                                        - Movimientos financieros: {movimientos_borrar}
-                                        - Pagos programados: {pagos_borrar}
-                                        - Facturas: {facturas_borrar}
-                                        """)
-                                        
-                                        db_fresh.close()
-                                        
-                                        # Limpiar caché y recargar
-                                        st.cache_data.clear()
-                                        time.sleep(2)
-                                        st.rerun()
-                                    else:
-                                        st.error("❌ La operación ya no existe")
-                                        
-                                except Exception as e:
-                                    if 'db_fresh' in locals():
-                                        db_fresh.rollback()
-                                        db_fresh.close()
-                                    st.error(f"❌ Error al borrar operación: {str(e)}")
-                            else:
-                                st.error(f"❌ Debes escribir exactamente: **BORRAR {operacion_a_borrar.id}**")
-            
-            with col2:
-                st.warning("⚠️ **Operaciones más seguras de borrar:**")
+                # Registros que la base borrará en cascada
+                dependencias = operacion_service.contar_dependencias([operacion_id])[operacion_id]
                 
-                # Mostrar operaciones canceladas (más seguras de borrar)
-                if operaciones_canceladas:
-                    st.write("**Operaciones CANCELADAS:**")
-                    for op in operaciones_canceladas:
-                        # Obtener conteos de forma segura
-                        mov_count = db.query(MovimientoFinanciero).filter(
-                            MovimientoFinanciero.operacion_id == op.id
-                        ).count()
-                        pago_count = db.query(PagoProgramado).filter(
-                            PagoProgramado.operacion_id == op.id
-                        ).count()
-                        st.write(f"- #{op.id}: {op.cliente.nombre} ({mov_count} mov, {pago_count} pagos)")
-                else:
-                    st.write("No hay operaciones canceladas")
+                # Mostrar información de la operación
+                st.warning(f"⚠️ **Operación a borrar:**")
+                st.write(f"- **ID:** #{operacion_id}")
+                st.write(f"- **Cliente:** {cliente_nombre}")
+                st.write(f"- **Proveedor:** {proveedor_nombre}")
+                st.write(f"- **Valor:** ${precio_venta:,.2f}")
+                st.write(f"- **Estado:** {estado.value.title()}")
+                st.write(f"- **Fecha:** {fecha_creacion.strftime('%d/%m/%Y')}")
+                
+                st.write(f"- **Movimientos financieros:** {dependencias['movimientos']}")
+                st.write(f"- **Pagos programados:** {dependencias['pagos']}")
+                st.write(f"- **Factura:** {'Sí' if dependencias['facturas'] else 'No'}")
                 
-                st.info("💡 **Tips para borrar operaciones:**")
-                st.write("- Las operaciones **CANCELADAS** son más seguras de borrar")
-                st.write("- Las operaciones **ACTIVAS** pueden tener movimientos financieros importantes")
-                st.write("- Las operaciones **COMPLETADAS** tienen historial valioso")
-                st.write("- Siempre haz backup antes de borrar")
-                st.write("- Considera cambiar el estado a CANCELADA en lugar de borrar")
+                # Confirmación de borrado
+                st.error("⚠️ **ADVERTENCIA:** Esta acción eliminará la operación y TODOS sus registros relacionados (movimientos, pagos, factura).")
+                
+                confirmar_texto = st.text_input(
+                    f"Para confirmar, escribe: **BORRAR {operacion_id}**",
+                    key="confirmar_operacion"
+                )
                 
-                # Opción rápida para cancelar operación en lugar de borrar
-                if operacion_a_borrar and operacion_a_borrar.estado == EstadoOperacion.ACTIVA:
-                    st.markdown("---")
-                    st.write("**Alternativa: Cancelar en lugar de borrar**")
-                    if st.button("📝 Marcar como CANCELADA", key="cancelar_op"):
+                if st.button("🗑️ CONFIRMAR BORRADO", type="primary", key="confirmar_borrado_op"):
+                    if confirmar_texto == f"BORRAR {operacion_id}":
                         try:
-                            operacion_id_cancelar = operacion_a_borrar.id
-                            db_fresh = next(get_db())
-                            op_fresh = db_fresh.query(Operacion).filter(Operacion.id == operacion_id_cancelar).first()
-                            if op_fresh:
-                                op_fresh.estado = EstadoOperacion.CANCELADA
-                                db_fresh.commit()
-                                st.success(f"✅ Operación #{operacion_id_cancelar} marcada como CANCELADA")
-                                db_fresh.close()
-                                st.cache_data.clear()
+                            eliminados = OperacionService(db).eliminar_operacion(operacion_id)
+                            
+                            if eliminados is not None:
+                                st.success(f"""✅ **Operación #{operacion_id} borrada exitosamente!**
+                                
+                                **Registros eliminados:**
+                                - Operación: 1
+                                - Movimientos financieros: {eliminados['movimientos']}
+                                - Pagos programados: {eliminados['pagos']}
+                                - Facturas: {eliminados['facturas']}
+                                """)
+                                
+                                time.sleep(2)
                                 st.rerun()
+                            else:
+                                st.error("❌ La operación ya no existe")
+                        
                         except Exception as e:
-                            st.error(f"Error: {str(e)}")
-        else:
-            st.info("No hay operaciones para borrar.")
+                            st.error(f"❌ Error al borrar operación: {str(e)}")
+                    else:
+                        st.error(f"❌ Debes escribir exactamente: **BORRAR {operacion_id}**")
+        
+        with col2:
+            st.warning("⚠️ **Operaciones más seguras de borrar:**")
+            
+            # Mostrar operaciones canceladas (más seguras de borrar), solo las más recientes
+            total_canceladas = conteo_estados.get(EstadoOperacion.CANCELADA, 0)
+            if total_canceladas:
+                st.write("**Operaciones CANCELADAS:**")
+                canceladas, _ = operacion_service.pagina_operaciones(EstadoOperacion.CANCELADA, tamano=MAXIMO_CANCELADAS)
+                ids_canceladas = [int(op_id) for op_id in canceladas["ID"]]
+                conteos = operacion_service.contar_dependencias(ids_canceladas)
+                for op_id, cliente in zip(ids_canceladas, canceladas["Cliente"]):
+                    st.write(f"- #{op_id}: {cliente} ({conteos[op_id]['movimientos']} mov, {conteos[op_id]['pagos']} pagos)")
+                if total_canceladas > len(ids_canceladas):
+                    st.caption(f"... y {total_canceladas - len(ids_canceladas)} más")
+                
+                confirmar_canceladas = st.checkbox(
+                    f"Confirmo borrar las {total_canceladas} operaciones canceladas y sus registros",
+                    key="confirmar_borrar_canceladas"
+                )
+                if st.button("🗑️ Borrar todas las canceladas", key="borrar_canceladas", disabled=not confirmar_canceladas):
+                    try:
+                        eliminados = operacion_service.eliminar_operaciones(
+                            operacion_service.ids_operaciones(EstadoOperacion.CANCELADA)
+                        )
+                        st.success(
+                            f"✅ {eliminados['operaciones']} operaciones borradas "
+                            f"({eliminados['movimientos']} movimientos, {eliminados['pagos']} pagos, "
+                            f"{eliminados['facturas']} facturas)"
+                        )
+                        time.sleep(2)
+                        st.rerun()
+                    except Exception as e:
+                        st.error(f"❌ Error al borrar operaciones: {str(e)}")
+            else:
+                st.write("No hay operaciones canceladas")
+            
+            st.info("💡 **Tips para borrar operaciones:**")
+            st.write("- Las operaciones **CANCELADAS** son más seguras de borrar")
+            st.write("- Las operaciones **ACTIVAS** pueden tener movimientos financieros importantes")
+            st.write("- Las operaciones **COMPLETADAS** tienen historial valioso")
+            st.write("- Siempre haz backup antes de borrar")
+            st.write("- Considera cambiar el estado a CANCELADA en lugar de borrar")
+            
+            # Opción rápida para cancelar operación en lugar de borrar
+            if operacion_a_borrar and estado == EstadoOperacion.ACTIVA:
+                st.markdown("---")
+                st.write("**Alternativa: Cancelar en lugar de borrar**")
+                if st.button("📝 Marcar como CANCELADA", key="cancelar_op"):
+                    try:
+                        OperacionService(db).cambiar_estado(operacion_id, EstadoOperacion.CANCELADA)
+                        st.success(f"✅ Operación #{operacion_id} marcada como CANCELADA")
+                        st.rerun()
+                    except Exception as e:
+                        st.error(f"Error: {str(e)}")
     else:
         st.info("No hay operaciones registradas.")
 
-def show_contactos():
+def show_contactos(db: Session):
     """Gestión de contactos"""
     st.header("👥 Gestión de Contactos")
     
-    db = next(get_db())
     contacto_service = ContactoService(db)
     
     tab1, tab2 = st.tabs(["Ver Contactos", "Nuevo Contacto"])
@@ -1069,106 +1288,60 @@ def show_contactos():
             options=["Todos", "PROVEEDOR", "CLIENTE", "AGENTE_LOGISTICO"]
         )
         
-        if tipo_filtro == "Todos":
-            contactos = contacto_service.obtener_contactos()
-        else:
-            contactos = contacto_service.obtener_contactos(TipoContacto(tipo_filtro.lower()))
-        
-        if contactos:
-            data = []
-            for contacto in contactos:
-                data.append({
-                    "ID": contacto.id,
-                    "Nombre": contacto.nombre,
-                    "Razón Social": getattr(contacto, 'razon_social', None) or "N/A",
-                    "Tipo": contacto.tipo.value.title(),
-                    "País": contacto.pais or "N/A",
-                    "Provincia": getattr(contacto, 'provincia', None) or "N/A",
-                    "Email": contacto.email or "N/A",
-                    "Teléfono": contacto.telefono or "N/A",
-                    "ID Fiscal": getattr(contacto, 'numero_identificacion_fiscal', None) or "N/A",
-                    "Industria": getattr(contacto, 'industria', None).value.title() if getattr(contacto, 'industria', None) else "N/A",
-                    "Dir. Fábrica": getattr(contacto, 'direccion_fabrica', None) or "N/A",
-                    "Puerto": getattr(contacto, 'puerto_conveniente', None) or "N/A"
-                })
-            
-            df = pd.DataFrame(data)
-            st.dataframe(df, use_container_width=True)
+        tipo = None if tipo_filtro == "Todos" else TipoContacto(tipo_filtro.lower())
+        uso = contacto_service.uso_contactos(tipo)
+        
+        if not uso.empty:
+            df = contacto_service.tabla_contactos(tipo).merge(
+                uso[["ID", "Operaciones", "Volumen", "Margen", "Última Operación"]], on="ID", how="left"
+            )
+            st.dataframe(df, column_config=configurar_columnas(df), use_container_width=True)
             
             # Sección de borrado
             st.markdown("---")
             st.subheader("🗑️ Borrar Contacto")
             
             # Separar contactos con y sin operaciones
-            contactos_sin_ops = []
-            contactos_con_ops = []
-            
-            for contacto in contactos:
-                tiene_ops = (
-                    len(contacto.operaciones_proveedor) > 0 or
-                    len(contacto.operaciones_cliente) > 0 or
-                    len(contacto.operaciones_agente) > 0
-                )
-                
-                if tiene_ops:
-                    contactos_con_ops.append(contacto)
-                else:
-                    contactos_sin_ops.append(contacto)
+            contactos_sin_ops = uso[uso["Operaciones"] == 0]
+            contactos_con_ops = uso[uso["Operaciones"] > 0]
+            nombres = dict(zip(uso["ID"], uso["Nombre"] + " (" + uso["Tipo"] + ")"))
             
             col1, col2 = st.columns(2)
             
             with col1:
                 st.info(f"✅ **Contactos sin operaciones:** {len(contactos_sin_ops)} (seguros para borrar)")
                 
-                if contactos_sin_ops:
+                if not contactos_sin_ops.empty:
                     contacto_a_borrar = st.selectbox(
                         "Seleccionar contacto a borrar:",
-                        options=[None] + contactos_sin_ops,
-                        format_func=lambda x: "Seleccionar..." if x is None else f"{x.nombre} ({x.tipo.value})",
+                        options=[None] + contactos_sin_ops["ID"].tolist(),
+                        format_func=lambda x: "Seleccionar..." if x is None else nombres[x],
                         key="contacto_borrar"
                     )
                     
                     if contacto_a_borrar:
-                        st.warning(f"⚠️ ¿Estás seguro de borrar a **{contacto_a_borrar.nombre}**?")
+                        st.warning(f"⚠️ ¿Estás seguro de borrar a **{nombres[contacto_a_borrar]}**?")
                         
                         if st.button("🗑️ Confirmar Borrado", type="primary", key="confirmar_borrar"):
                             try:
-                                # Obtener el contacto fresco de la base de datos
-                                contacto_id = contacto_a_borrar.id
-                                contacto_nombre = contacto_a_borrar.nombre
-                                
-                                # Crear una nueva sesión para evitar conflictos
-                                db_fresh = next(get_db())
-                                
-                                contacto_fresh = db_fresh.query(Contacto).filter(Contacto.id == contacto_id).first()
+                                contacto_nombre = nombres[contacto_a_borrar]
                                 
-                                if contacto_fresh:
-                                    db_fresh.delete(contacto_fresh)
-                                    db_fresh.commit()
+                                if contacto_service.eliminar_contacto(contacto_a_borrar):
                                     st.success(f"✅ Contacto '{contacto_nombre}' borrado exitosamente")
-                                    db_fresh.close()
                                     st.rerun()
                                 else:
                                     st.error("❌ El contacto ya no existe")
                                     
                             except Exception as e:
-                                if 'db_fresh' in locals():
-                                    db_fresh.rollback()
-                                    db_fresh.close()
                                 st.error(f"❌ Error al borrar contacto: {str(e)}")
             
             with col2:
                 st.warning(f"⚠️ **Contactos con operaciones:** {len(contactos_con_ops)} (no se pueden borrar)")
                 
-                if contactos_con_ops:
+                if not contactos_con_ops.empty:
                     st.write("**Contactos que NO se pueden borrar:**")
-                    for contacto in contactos_con_ops:
-                        total_ops = (
-                            len(contacto.operaciones_proveedor) + 
-                            len(contacto.operaciones_cliente) + 
-                            len(contacto.operaciones_agente)
-                        )
-                        st.write(f"- {contacto.nombre}: {total_ops} operacion(es)")
+                    for contacto in contactos_con_ops.itertuples(index=False):
+                        st.write(f"- {contacto.Nombre}: {contacto.Operaciones} operacion(es)")
                     
                     st.info("💡 **Tip:** Para borrar estos contactos, primero debes borrar todas sus operaciones relacionadas desde 'Borrar Registros'.")
         else:
@@ -1266,31 +1439,37 @@ def show_contactos():
                         except Exception as e:
                             st.error(f"Error al crear contacto: {str(e)}")
 
-def show_hs_codes():
+def show_hs_codes(db: Session):
     """Gestión de códigos HS e impuestos"""
     st.header("📦 Gestión de Códigos HS")
     
-    db = next(get_db())
     hs_service = HSCodeService(db)
     
-    tab1, tab2 = st.tabs(["Ver Códigos HS", "Nuevo Código HS"])
+    tab1, tab2, tab3 = st.tabs(["Ver Códigos HS", "Nuevo Código HS", "Importar Nomenclatura"])
     
     with tab1:
         st.subheader("Códigos HS Registrados")
         
-        hs_codes = hs_service.obtener_hs_codes()
+        prefijo = st.text_input("Buscar por código:", placeholder="Ej: 8471", key="prefijo_hs").strip()
         
-        if hs_codes:
-            for hs in hs_codes:
-                with st.expander(f"**{hs.codigo}** - {hs.descripcion}"):
-                    impuestos = hs_service.obtener_impuestos_por_hs(hs.id)
-                    
-                    if impuestos:
+        cursores, df, siguiente, total = pagina_actual(
+            "pagina_hs_codes",
+            (prefijo,),
+            lambda cursor: load_pagina_hs_codes(db, prefijo or None, cursor)
+        )
+        
+        if not df.empty:
+            for hs in df.to_dict("records"):
+                with st.expander(f"**{hs['Código']}** - {hs['Descripción']} · {hs['Total Impuestos %']:.2f}% de impuestos"):
+                    if hs["Impuestos"]:
                         st.write("**Impuestos asociados:**")
-                        for imp in impuestos:
-                            st.write(f"- {imp.nombre}: {imp.porcentaje}%")
+                        for nombre, porcentaje in hs["Impuestos"]:
+                            st.write(f"- {nombre}: {porcentaje}%")
                     else:
                         st.write("Sin impuestos asociados")
+            controles_paginacion("pagina_hs_codes", cursores, siguiente, total)
+        elif prefijo:
+            st.info(f"No hay códigos HS que empiecen con {prefijo}")
         else:
             st.info("No hay códigos HS registrados")
     
@@ -1337,12 +1516,46 @@ def show_hs_codes():
                             st.rerun()
                         except Exception as e:
                             st.error(f"Error al registrar código HS: {str(e)}")
+    
+    with tab3:
+        st.subheader("Importar Nomenclatura Arancelaria")
+        st.caption(
+            "Columnas obligatorias: Codigo y Descripcion. Cada columna adicional es un impuesto: "
+            "el encabezado es su nombre y el valor su porcentaje (vacío si no aplica). "
+            "Los códigos ya registrados se actualizan."
+        )
+        
+        archivo = st.file_uploader("Archivo de nomenclatura:", type=["csv", "xlsx"], key="archivo_nomenclatura")
+        tamano_lote = st.number_input(
+            "Códigos por transacción:", min_value=100, max_value=20000, value=2000, step=100, key="lote_nomenclatura"
+        )
+        
+        if archivo is not None and st.button("🚀 Importar nomenclatura", key="importar_nomenclatura"):
+            try:
+                with st.spinner("Importando nomenclatura..."):
+                    guardados, errores = importar_nomenclatura(db, archivo, archivo.name, int(tamano_lote))
+            except Exception as e:
+                st.error(f"Error al leer el archivo: {str(e)}")
+                return
+            
+            if guardados:
+                st.success(f"✅ {guardados} códigos HS cargados")
+            if not errores.empty:
+                st.warning(f"⚠️ {len(errores)} filas rechazadas")
+                st.dataframe(errores, use_container_width=True, hide_index=True)
+                st.download_button(
+                    label="📥 Descargar reporte de errores",
+                    data=errores.to_csv(index=False),
+                    file_name=f"errores_nomenclatura_{datetime.now().strftime('%Y%m%d_%H%M')}.csv",
+                    mime="text/csv"
+                )
+            elif not guardados:
+                st.info("El archivo no contiene códigos")
 
-def show_facturas():
+def show_facturas(db: Session):
     """Gestión de facturas"""
     st.header("📄 Gestión de Facturas")
     
-    db = next(get_db())
     factura_service = FacturaService(db)
     operacion_service = OperacionService(db)
     
@@ -1351,23 +1564,10 @@ def show_facturas():
     with tab1:
         st.subheader("Facturas Generadas")
         
-        facturas = factura_service.obtener_facturas()
-        
-        if facturas:
-            data = []
-            for factura in facturas:
-                data.append({
-                    "Número": factura.numero,
-                    "Fecha": factura.fecha.strftime("%Y-%m-%d"),
-                    "Cliente": factura.operacion.cliente.nombre,
-                    "Subtotal FOB": f"${factura.subtotal_fob:,.2f}",
-                    "Total INCOTERM": f"${factura.total_incoterm:,.2f}",
-                    "Moneda": factura.moneda,
-                    "Operación ID": factura.operacion_id
-                })
-            
-            df = pd.DataFrame(data)
-            st.dataframe(df, use_container_width=True)
+        df = factura_service.tabla_facturas()
+        
+        if not df.empty:
+            st.dataframe(df, column_config=configurar_columnas(df), use_container_width=True)
         else:
             st.info("No hay facturas generadas")
     
@@ -1381,6 +1581,26 @@ def show_facturas():
             st.warning("No hay operaciones activas para facturar")
             return
         
+        with st.expander("🧾 Facturar todas las operaciones pendientes"):
+            fecha_lote = st.date_input(
+                "Fecha de las facturas:",
+                value=date.today(),
+                key="fecha_facturacion_lote",
+                help="Se facturan las operaciones activas sin factura cuyo HBL es posterior a esta fecha"
+            )
+            pendientes = factura_service.contar_facturables(fecha_lote)
+            st.write(f"Operaciones facturables: **{pendientes}**")
+            
+            if st.button("🧾 Facturar pendientes", disabled=pendientes == 0, key="facturar_pendientes"):
+                try:
+                    generadas = factura_service.facturar_operaciones(fecha_lote)
+                    if generadas:
+                        st.success(f"✅ {len(generadas)} facturas generadas ({generadas[0][1]} a {generadas[-1][1]})")
+                    else:
+                        st.info("No hay operaciones pendientes de facturar")
+                except Exception as e:
+                    st.error(f"Error al facturar operaciones: {str(e)}")
+        
         with st.form("generar_factura"):
             operacion_seleccionada = st.selectbox(
                 "Seleccionar Operación:",
@@ -1397,8 +1617,8 @@ def show_facturas():
                 # Datos básicos de la factura
                 numero_factura = st.text_input(
                     "Número de Factura:",
-                    value=f"FAC-{datetime.now().strftime('%Y%m%d')}-{operacion_seleccionada.id if operacion_seleccionada else '001'}",
-                    help="Ingrese el número de factura personalizado"
+                    placeholder=f"Automático (INV-{date.today().year}-NNNNNN)",
+                    help="Deje vacío para usar el próximo número de la serie o ingrese uno personalizado"
                 )
                 
                 fecha_factura = st.date_input(
@@ -1493,16 +1713,14 @@ def show_facturas():
             submitted = st.form_submit_button("📄 Generar Factura", use_container_width=True)
             
             if submitted:
-                if not numero_factura:
-                    st.error("El número de factura es obligatorio")
-                elif not descripcion_productos:
+                if not descripcion_productos:
                     st.error("La descripción de productos es obligatoria")
                 else:
                     try:
                         # Crear factura con datos personalizados
                         factura_service.generar_factura_personalizada(
                             operacion_id=operacion_seleccionada.id,
-                            numero=numero_factura,
+                            numero=numero_factura.strip() or None,
                             fecha_factura=fecha_factura,
                             subtotal_fob=subtotal_fob,
                             total_incoterm=total_incoterm,
@@ -1517,9 +1735,6 @@ def show_facturas():
                         st.error(f"Error al generar factura: {str(e)}")
 
 def main():
-    # Ejecutar migración si es necesario
-    migrate_tipo_pagos()
-    
     st.title("🌍 Gestión de Comercio Exterior")
     st.markdown("---")
     
@@ -1530,6 +1745,7 @@ def main():
         [
             "Dashboard", 
             "Nueva Operación", 
+            "Importar Operaciones",
             "Ver Operaciones", 
             "Gestión Financiera", 
             "Gestionar Pagos y Cobros",
@@ -1539,28 +1755,37 @@ def main():
         ]
     )
     
-    if page == "Dashboard":
-        show_dashboard()
-    elif page == "Nueva Operación":
-        show_nueva_operacion()
-    elif page == "Ver Operaciones":
-        show_operaciones()
-    elif page == "Gestión Financiera":
-        show_gestion_financiera()
-    elif page == "Gestionar Pagos y Cobros":
-        show_gestionar_pagos()
-    elif page == "Gestión de Contactos":
-        show_contactos()
-    elif page == "Códigos HS":
-        show_hs_codes()
-    elif page == "Facturas":
-        show_facturas()
+    # Estado del pool de conexiones
+    with st.sidebar.expander("🔌 Conexiones a la base de datos"):
+        metricas = metricas_pool()
+        st.write(f"En uso: {metricas['en_uso']} / {metricas['maximo']}")
+        st.write(f"Disponibles en el pool: {metricas['disponibles']}")
+    
+    # Una sesión por ejecución del script: se devuelve al pool al terminar, aun ante errores o st.rerun()
+    with sesion_db() as db:
+        if page == "Dashboard":
+            show_dashboard(db)
+        elif page == "Nueva Operación":
+            show_nueva_operacion(db)
+        elif page == "Importar Operaciones":
+            show_importar_operaciones(db)
+        elif page == "Ver Operaciones":
+            show_operaciones(db)
+        elif page == "Gestión Financiera":
+            show_gestion_financiera(db)
+        elif page == "Gestionar Pagos y Cobros":
+            show_gestionar_pagos(db)
+        elif page == "Gestión de Contactos":
+            show_contactos(db)
+        elif page == "Códigos HS":
+            show_hs_codes(db)
+        elif page == "Facturas":
+            show_facturas(db)
 
-def show_gestionar_pagos():
+def show_gestionar_pagos(db: Session):
     """Gestionar pagos y cobros pendientes"""
     st.header("💸 Gestionar Pagos y Cobros")
     
-    db = next(get_db())
     operacion_service = OperacionService(db)
     movimiento_service = MovimientoFinancieroService(db)
     
@@ -1575,6 +1800,25 @@ def show_gestionar_pagos():
         st.info("No hay operaciones activas para gestionar pagos")
         return
     
+    with st.expander("🔄 Resincronizar estados"):
+        st.write("Recalcula el estado de los pagos y cobros de todas las operaciones a partir de los movimientos registrados.")
+        if st.button("Resincronizar todos los pagos", key="reconciliar_pagos"):
+            try:
+                cambios = movimiento_service.reconciliar_estado_pagos()
+                if cambios:
+                    st.success(f"✅ {len(cambios)} pagos actualizados")
+                    st.dataframe(pd.DataFrame([{
+                        "Pago ID": c["pago_id"],
+                        "Operación": c["operacion_id"],
+                        "Estado anterior": c["estado_anterior"].value.title(),
+                        "Estado nuevo": c["estado_nuevo"].value.title(),
+                        "Fecha real": c["fecha_real_nueva"].strftime("%Y-%m-%d") if c["fecha_real_nueva"] else "-"
+                    } for c in cambios]), use_container_width=True)
+                else:
+                    st.info("Todos los pagos ya estaban sincronizados")
+            except Exception as e:
+                st.error(f"Error al resincronizar pagos: {str(e)}")
+    
     # Usar solo los IDs para selección
     operaciones_ids = [(op.id, f"#{op.id} - {op.cliente.nombre} (${op.precio_venta:,.2f})") for op in operaciones]
     
@@ -1615,9 +1859,7 @@ def show_gestionar_pagos():
                         with st.container(border=True):
                             col1, col2, col3, col4 = st.columns([3, 2, 2, 1])
                             
-                            # Calcular monto
-                            costo_total = operacion_seleccionada.valor_compra + operacion_seleccionada.costo_flete + operacion_seleccionada.costo_despachante
-                            monto = costo_total * pago.porcentaje / 100
+                            monto = pago.monto
                             
                             with col1:
                                 st.write(f"**{pago.descripcion}** ({pago.porcentaje:.1f}%)")
@@ -1653,21 +1895,13 @@ def show_gestionar_pagos():
                                                 tipo=TipoMovimiento.DEPOSITO_OPERACION,
                                                 descripcion=f"Pago: {pago.descripcion} - Op #{operacion_seleccionada.id}",
                                                 monto_salida=monto,
-                                                operacion_id=operacion_seleccionada.id
+                                                operacion_id=operacion_seleccionada.id,
+                                                pago_programado_id=pago.id
                                             )
                                             
-                                            # Actualizar estado del pago - obtener de la BD para evitar detached
-                                            pago_update = db.query(PagoProgramado).filter(PagoProgramado.id == pago.id).first()
-                                            if pago_update:
-                                                pago_update.estado = EstadoPago.PAGADO
-                                                pago_update.fecha_real_pago = fecha_real_pago
-                                                db.commit()
-                                                
-                                                st.success(f"Pago registrado exitosamente")
-                                                time.sleep(1)
-                                                st.rerun()
-                                            else:
-                                                st.error("No se pudo encontrar el pago en la base de datos")
+                                            st.success(f"Pago registrado exitosamente")
+                                            time.sleep(1)
+                                            st.rerun()
                                         except Exception as e:
                                             st.error(f"Error al registrar pago: {str(e)}")
             
@@ -1678,8 +1912,7 @@ def show_gestionar_pagos():
                     with st.container(border=True):
                         col1, col2, col3, col4 = st.columns([3, 2, 2, 1])
                         
-                        # Calcular monto
-                        monto = operacion_seleccionada.precio_venta * cobro.porcentaje / 100
+                        monto = cobro.monto
                         
                         with col1:
                             st.write(f"**{cobro.descripcion}** ({cobro.porcentaje:.1f}%)")
@@ -1715,21 +1948,13 @@ def show_gestionar_pagos():
                                                 tipo=TipoMovimiento.COBRO_OPERACION,
                                                 descripcion=f"Cobro: {cobro.descripcion} - Op #{operacion_seleccionada.id}",
                                                 monto_entrada=monto,
-                                                operacion_id=operacion_seleccionada.id
+                                                operacion_id=operacion_seleccionada.id,
+                                                pago_programado_id=cobro.id
                                             )
                                             
-                                            # Actualizar estado del cobro - obtener de la BD para evitar detached
-                                            cobro_update = db.query(PagoProgramado).filter(PagoProgramado.id == cobro.id).first()
-                                            if cobro_update:
-                                                cobro_update.estado = EstadoPago.PAGADO
-                                                cobro_update.fecha_real_pago = fecha_real_cobro
-                                                db.commit()
-                                                
-                                                st.success(f"Cobro registrado exitosamente")
-                                                time.sleep(1)
-                                                st.rerun()
-                                            else:
-                                                st.error("No se pudo encontrar el cobro en la base de datos")
+                                            st.success(f"Cobro registrado exitosamente")
+                                            time.sleep(1)
+                                            st.rerun()
                                         except Exception as e:
                                             st.error(f"Error al registrar cobro: {str(e)}")
         else:
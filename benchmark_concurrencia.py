@@ -0,0 +1,129 @@
+# benchmark_concurrencia.py - Compara lecturas/escrituras concurrentes con y sin el perfil SQLite
+import argparse
+import os
+import tempfile
+import threading
+import time
+from datetime import date, timedelta
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from models import Base, TipoMovimiento, PERFIL_SQLITE, configurar_sqlite
+from database import MovimientoFinancieroService
+
+# Valores por defecto de SQLite: journal en modo DELETE, synchronous FULL y sin espera ante bloqueos.
+# Se fijan explícitamente porque pysqlite ya espera 5 s por su cuenta (timeout=5.0).
+PERFIL_POR_DEFECTO = {"journal_mode": "DELETE", "synchronous": "FULL", "busy_timeout": 0}
+
+def _crear_sesiones(ruta: str, perfil: dict, hilos: int):
+    """Crea un engine sobre un archivo nuevo con el perfil indicado"""
+    # El timeout de pysqlite se alinea con el busy_timeout del perfil para no sumar una espera oculta
+    engine = create_engine(
+        f"sqlite:///{ruta}", pool_size=hilos, max_overflow=0,
+        connect_args={"timeout": perfil.get("busy_timeout", 0) / 1000}
+    )
+    configurar_sqlite(engine, perfil)
+    Base.metadata.create_all(bind=engine)
+    return engine, sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+def _sembrar(Sesion, cantidad: int = 500):
+    """Carga movimientos iniciales para que las lecturas tengan trabajo"""
+    db = Sesion()
+    try:
+        service = MovimientoFinancieroService(db)
+        inicio = date.today() - timedelta(days=cantidad)
+        for i in range(cantidad):
+            service.crear_movimiento(
+                fecha=inicio + timedelta(days=i),
+                tipo=TipoMovimiento.APORTE_INICIAL,
+                descripcion=f"Aporte inicial {i}",
+                monto_entrada=1000.0
+            )
+    finally:
+        db.close()
+
+def _lector(Sesion, fin: float, resultado: dict, lock: threading.Lock):
+    """Consulta saldo y movimientos recientes hasta que termina la prueba"""
+    ok = errores = 0
+    while time.perf_counter() < fin:
+        db = Sesion()
+        try:
+            service = MovimientoFinancieroService(db)
+            service.calcular_saldo()
+            service.obtener_movimientos(fecha_desde=date.today() - timedelta(days=30))
+            ok += 1
+        except Exception:
+            errores += 1
+        finally:
+            db.close()
+    with lock:
+        resultado["lecturas"] += ok
+        resultado["errores_lectura"] += errores
+
+def _escritor(Sesion, fin: float, resultado: dict, lock: threading.Lock):
+    """Registra movimientos hasta que termina la prueba"""
+    ok = errores = 0
+    while time.perf_counter() < fin:
+        db = Sesion()
+        try:
+            MovimientoFinancieroService(db).crear_movimiento(
+                fecha=date.today(),
+                tipo=TipoMovimiento.APORTE_INICIAL,
+                descripcion="Aporte de prueba",
+                monto_entrada=10.0
+            )
+            ok += 1
+        except Exception:
+            errores += 1
+        finally:
+            db.close()
+    with lock:
+        resultado["escrituras"] += ok
+        resultado["errores_escritura"] += errores
+
+def ejecutar_benchmark(perfil: dict, lectores: int = 8, escritores: int = 2,
+                       duracion: float = 10.0) -> dict:
+    """Ejecuta lectores y escritores en paralelo sobre una base nueva y devuelve el throughput"""
+    with tempfile.TemporaryDirectory() as directorio:
+        engine, Sesion = _crear_sesiones(
+            os.path.join(directorio, "benchmark.db"), perfil, lectores + escritores
+        )
+        try:
+            _sembrar(Sesion)
+
+            resultado = {"lecturas": 0, "escrituras": 0, "errores_lectura": 0, "errores_escritura": 0}
+            lock = threading.Lock()
+            fin = time.perf_counter() + duracion
+            hilos = (
+                [threading.Thread(target=_lector, args=(Sesion, fin, resultado, lock)) for _ in range(lectores)]
+                + [threading.Thread(target=_escritor, args=(Sesion, fin, resultado, lock)) for _ in range(escritores)]
+            )
+            for hilo in hilos:
+                hilo.start()
+            for hilo in hilos:
+                hilo.join()
+        finally:
+            engine.dispose()
+
+    resultado["lecturas_por_seg"] = resultado["lecturas"] / duracion
+    resultado["escrituras_por_seg"] = resultado["escrituras"] / duracion
+    return resultado
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de concurrencia SQLite")
+    parser.add_argument("--lectores", type=int, default=8)
+    parser.add_argument("--escritores", type=int, default=2)
+    parser.add_argument("--duracion", type=float, default=10.0, help="Segundos por perfil")
+    args = parser.parse_args()
+
+    for nombre, perfil in [("por defecto", PERFIL_POR_DEFECTO), ("perfil WAL", PERFIL_SQLITE)]:
+        r = ejecutar_benchmark(perfil, args.lectores, args.escritores, args.duracion)
+        print(
+            f"{nombre:>12}: {r['lecturas_por_seg']:8.1f} lecturas/s "
+            f"({r['errores_lectura']} errores), {r['escrituras_por_seg']:8.1f} escrituras/s "
+            f"({r['errores_escritura']} errores)"
+        )
+
+if __name__ == "__main__":
+    main()
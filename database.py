@@ -2,6 +2,10 @@
 from sqlalchemy.orm import Session
 from typing import List, Optional
 from datetime import date
+import hashlib
+import re
+import numpy as np
+import pandas as pd
 import logging
 
 # Configurar logging básico si no está configurado
@@ -12,6 +16,159 @@ logging.basicConfig(
 import logging
 import logging
 
+from models import _insert_dialecto
+
+def leer_dataframe(db: Session, consulta) -> pd.DataFrame:
+    """Ejecuta un SELECT de columnas y arma un DataFrame tipado sin hidratar objetos ORM.
+    
+    Las columnas toman el nombre de su etiqueta en la consulta. Los enums se
+    convierten a su valor, los importes a float y las fechas a datetime64; el
+    formato de moneda queda para la capa de presentación.
+    """
+    from sqlalchemy import Enum as EnumSQL, Float, Integer, Date, DateTime
+    
+    resultado = db.execute(consulta)
+    df = pd.DataFrame(resultado.all(), columns=list(resultado.keys()))
+    
+    for columna in consulta.selected_columns:
+        nombre, tipo = columna.key, columna.type
+        if isinstance(tipo, EnumSQL):
+            df[nombre] = df[nombre].map(lambda valor: valor.value if valor is not None else None)
+        elif isinstance(tipo, Float):
+            df[nombre] = pd.to_numeric(df[nombre], errors="coerce").astype("float64")
+        elif isinstance(tipo, Integer):
+            df[nombre] = df[nombre].astype("Int64")
+        elif isinstance(tipo, (Date, DateTime)):
+            df[nombre] = pd.to_datetime(df[nombre])
+    return df
+
+def primer_dia_mes(fecha) -> date:
+    """Clave de mes de los resúmenes mensuales"""
+    return date(fecha.year, fecha.month, 1)
+
+def acumular_en_tabla(db: Session, tabla, claves: list, filas: list, campo_conteo: str = None):
+    """Suma deltas a una tabla de acumulados con clave compuesta.
+    
+    Cada fila es un diccionario con las columnas clave y el delta de cada columna
+    acumulada. Las filas que no existen se crean en cero y, si se indica
+    `campo_conteo`, se borran las que quedan en cero. No confirma la transacción.
+    """
+    from sqlalchemy import update, delete, and_, bindparam
+    
+    if not filas:
+        return
+    campos = [campo for campo in filas[0] if campo not in claves]
+    
+    insert = _insert_dialecto(db)
+    db.execute(
+        insert(tabla).on_conflict_do_nothing(index_elements=claves),
+        [{**{c: fila[c] for c in claves}, **{c: 0 for c in campos}} for fila in filas]
+    )
+    
+    coincide = and_(*[tabla.c[c] == bindparam(f"clave_{c}") for c in claves])
+    db.execute(
+        update(tabla).where(coincide).values({c: tabla.c[c] + bindparam(f"delta_{c}") for c in campos}),
+        [{**{f"clave_{c}": fila[c] for c in claves}, **{f"delta_{c}": fila[c] for c in campos}} for fila in filas]
+    )
+    
+    if campo_conteo and any(fila[campo_conteo] < 0 for fila in filas):
+        db.execute(
+            delete(tabla).where(coincide, tabla.c[campo_conteo] <= 0),
+            [{f"clave_{c}": fila[c] for c in claves} for fila in filas]
+        )
+
+# Dimensiones por las que se pueden agrupar los márgenes (clave: nombre de la columna)
+DIMENSIONES_MARGEN = {
+    "cliente": "Cliente",
+    "proveedor": "Proveedor",
+    "hs_code": "HS Code",
+    "capitulo_hs": "Capítulo HS",
+    "partida_hs": "Partida HS",
+    "incoterms": "Incoterms",
+    "origen": "Origen",
+    "mes": "Mes"
+}
+
+# Granularidades disponibles para la proyección de saldos (días por intervalo)
+GRANULARIDADES_PROYECCION = {
+    "diaria": 1,
+    "semanal": 7,
+    "mensual": None  # Meses calendario desde la fecha de corte
+}
+
+def generar_fechas_proyeccion(fecha_inicio: date, dias_proyeccion: int = 90,
+                              granularidad: str = "semanal") -> list:
+    """Genera las fechas de corte de la proyección según horizonte y granularidad"""
+    from datetime import timedelta
+    from dateutil.relativedelta import relativedelta
+    
+    if granularidad not in GRANULARIDADES_PROYECCION:
+        raise ValueError(f"Granularidad inválida: {granularidad}")
+    if dias_proyeccion < 0:
+        raise ValueError("El horizonte de proyección no puede ser negativo")
+    
+    paso = GRANULARIDADES_PROYECCION[granularidad]
+    if paso:
+        return [fecha_inicio + timedelta(days=i) for i in range(0, dias_proyeccion+1, paso)]
+    
+    fecha_fin = fecha_inicio + timedelta(days=dias_proyeccion)
+    fechas = []
+    meses = 0
+    while fecha_inicio + relativedelta(months=meses) <= fecha_fin:
+        fechas.append(fecha_inicio + relativedelta(months=meses))
+        meses += 1
+    return fechas
+
+# Diferencia máxima (en USD) para considerar saldado un pago programado
+TOLERANCIA_ASIGNACION = 0.005
+
+def repartir_fifo(monto: float, cola: list, pago_preferido_id: int = None) -> list:
+    """Reparte un monto entre pagos pendientes en orden FIFO.
+    
+    `cola` es una lista ordenada de dicts {"id", "restante"} que se actualiza en el
+    lugar. El pago preferido, si está en la cola, se cubre primero. Devuelve una lista
+    de tuplas (pago_id, monto_asignado); el excedente queda sin asignar.
+    """
+    orden = sorted(cola, key=lambda pago: pago["id"] != pago_preferido_id)
+    asignaciones = []
+    for pago in orden:
+        if monto <= TOLERANCIA_ASIGNACION:
+            break
+        if pago["restante"] <= TOLERANCIA_ASIGNACION:
+            continue
+        parte = min(monto, pago["restante"])
+        pago["restante"] -= parte
+        monto -= parte
+        asignaciones.append((pago["id"], parte))
+    return asignaciones
+
+def hash_movimiento(fecha: date, monto: float, referencia: str = None, ocurrencia: int = 0) -> str:
+    """Huella de una línea de extracto bancario para detectar reimportaciones.
+    
+    `monto` es el neto con signo (entrada - salida). `ocurrencia` distingue líneas
+    idénticas dentro del mismo extracto, como dos comisiones iguales el mismo día.
+    """
+    clave = f"{fecha.isoformat()}|{monto:.2f}|{(referencia or '').strip().casefold()}|{ocurrencia}"
+    return hashlib.sha256(clave.encode("utf-8")).hexdigest()
+
+def jerarquia_hs(codigo: str) -> dict:
+    """Código normalizado (solo dígitos) y capítulo, partida y subpartida de un código HS.
+    
+    Los niveles que el código no alcanza quedan en None: "84" es solo un capítulo.
+    """
+    digitos = re.sub(r"\D", "", codigo or "")
+    return {
+        "codigo_normalizado": digitos or None,
+        "capitulo": digitos[:2] if len(digitos) >= 2 else None,
+        "partida": digitos[:4] if len(digitos) >= 4 else None,
+        "subpartida": digitos[:6] if len(digitos) >= 6 else None
+    }
+
+def filtro_prefijo_hs(columna, prefijo: str):
+    """Condición de prefijo por rango sobre una columna de dígitos, que aprovecha su índice"""
+    # ':' sigue a '9' en ASCII: todo código que empieza con el prefijo queda por debajo
+    return (columna >= prefijo) & (columna < prefijo + ":")
+
 class ContactoService:
     """Servicio para gestionar contactos"""
     
@@ -60,6 +217,113 @@ class ContactoService:
             query = query.filter(Contacto.tipo == tipo)
         return query.order_by(Contacto.nombre).all()
     
+    def tabla_contactos(self, tipo = None) -> pd.DataFrame:
+        """Contactos para mostrar, leídos por columnas"""
+        from models import Contacto
+        from sqlalchemy import select
+        
+        consulta = select(
+            Contacto.id.label("ID"),
+            Contacto.nombre.label("Nombre"),
+            Contacto.razon_social.label("Razón Social"),
+            Contacto.tipo.label("Tipo"),
+            Contacto.pais.label("País"),
+            Contacto.provincia.label("Provincia"),
+            Contacto.email.label("Email"),
+            Contacto.telefono.label("Teléfono"),
+            Contacto.numero_identificacion_fiscal.label("ID Fiscal"),
+            Contacto.industria.label("Industria"),
+            Contacto.direccion_fabrica.label("Dir. Fábrica"),
+            Contacto.puerto_conveniente.label("Puerto")
+        ).order_by(Contacto.nombre)
+        if tipo:
+            consulta = consulta.where(Contacto.tipo == tipo)
+        
+        df = leer_dataframe(self.db, consulta)
+        df["Tipo"] = df["Tipo"].str.title()
+        df["Industria"] = df["Industria"].str.title()
+        return df.fillna("N/A")
+
+    def uso_contactos(self, tipo = None) -> pd.DataFrame:
+        """Operaciones, volumen, margen y última operación de cada contacto, en una consulta agrupada.
+
+        Cada contacto participa como proveedor (volumen = valor de compra), cliente
+        (precio de venta) o agente logístico (costo de flete). Si tiene más de un rol
+        en la misma operación, la operación y su margen cuentan una vez y el volumen
+        suma el de cada rol. Los contactos sin operaciones aparecen con cero.
+        """
+        from models import Contacto, Operacion
+        from sqlalchemy import select, func, union_all
+
+        roles = union_all(*[
+            select(
+                rol.label("contacto_id"),
+                Operacion.id.label("operacion_id"),
+                volumen.label("volumen"),
+                Operacion.margen_calculado.label("margen"),
+                Operacion.fecha_creacion.label("fecha")
+            ).where(rol.isnot(None))
+            for rol, volumen in [
+                (Operacion.proveedor_id, Operacion.valor_compra),
+                (Operacion.cliente_id, Operacion.precio_venta),
+                (Operacion.agente_logistico_id, Operacion.costo_flete)
+            ]
+        ]).subquery()
+
+        # Una fila por contacto y operación antes de agregar por contacto
+        participaciones = select(
+            roles.c.contacto_id,
+            roles.c.operacion_id,
+            func.sum(roles.c.volumen).label("volumen"),
+            func.max(roles.c.margen).label("margen"),
+            func.max(roles.c.fecha).label("fecha")
+        ).group_by(roles.c.contacto_id, roles.c.operacion_id).subquery()
+
+        consulta = select(
+            Contacto.id.label("ID"),
+            Contacto.nombre.label("Nombre"),
+            Contacto.tipo.label("Tipo"),
+            func.count(participaciones.c.operacion_id).label("Operaciones"),
+            func.coalesce(func.sum(participaciones.c.volumen), 0.0).label("Volumen"),
+            func.coalesce(func.sum(participaciones.c.margen), 0.0).label("Margen"),
+            func.max(participaciones.c.fecha).label("Última Operación")
+        ).outerjoin(
+            participaciones, participaciones.c.contacto_id == Contacto.id
+        ).group_by(Contacto.id, Contacto.nombre, Contacto.tipo).order_by(Contacto.nombre)
+        if tipo:
+            consulta = consulta.where(Contacto.tipo == tipo)
+
+        return leer_dataframe(self.db, consulta)
+
+    def eliminar_contacto(self, contacto_id: int) -> bool:
+        """Elimina un contacto sin operaciones; la base rechaza (RESTRICT) borrar uno en uso"""
+        from models import Contacto, Operacion
+        from sqlalchemy import or_
+        from sqlalchemy.exc import IntegrityError
+        
+        try:
+            en_uso = self.db.query(Operacion.id).filter(or_(
+                Operacion.proveedor_id == contacto_id,
+                Operacion.cliente_id == contacto_id,
+                Operacion.agente_logistico_id == contacto_id
+            )).first()
+            if en_uso:
+                raise ValueError("El contacto tiene operaciones asociadas y no puede eliminarse")
+            
+            eliminados = self.db.query(Contacto).filter(Contacto.id == contacto_id).delete(synchronize_session=False)
+            contacto = self.db.identity_map.get(self.db.identity_key(Contacto, contacto_id))
+            if contacto is not None:
+                self.db.expunge(contacto)
+            self.db.commit()
+            return eliminados > 0
+        except IntegrityError as e:
+            # Una operación creada entre la verificación y el borrado
+            self.db.rollback()
+            raise ValueError("El contacto tiene operaciones asociadas y no puede eliminarse") from e
+        except Exception:
+            self.db.rollback()
+            raise
+    
     def obtener_contacto(self, contacto_id: int):
         """Obtiene un contacto por ID"""
         from models import Contacto
@@ -151,6 +415,7 @@ class OperacionService:
             # Calcular margen
             operacion.calcular_margen()
             self.logger.info(f"Margen calculado: ${operacion.margen_calculado:,.2f} ({operacion.margen_porcentaje:.1f}%)")
+            self.aplicar_a_resumen_mensual([self._valores_resumen(operacion)])
             
             # Crear pagos programados con estado y validar montos
             if pagos_programados:
@@ -176,6 +441,7 @@ class OperacionService:
                         numero_pago=pago['numero'],
                         descripcion=pago['descripcion'],
                         porcentaje=pago['porcentaje'],
+                        monto=monto,
                         fecha_programada=pago['fecha'],
                         fecha_real_pago=None,
                         estado=EstadoPago.PENDIENTE,
@@ -199,7 +465,68 @@ class OperacionService:
             self.db.rollback()
             self.logger.error(f"Error al crear operación: {str(e)}")
             raise
-    
+
+    def importar_operaciones(self, operaciones: list) -> tuple:
+        """Inserta un lote de operaciones ya validadas en una sola transacción.
+
+        Cada elemento es un dict con "fila" (número de fila de origen), "operacion"
+        (columnas de Operacion), "pagos" (numero, descripcion, porcentaje, fecha, tipo)
+        y opcionalmente "factura" (columnas de Factura). Si el lote falla se reintenta
+        fila por fila para aislar las que no pueden guardarse.
+        Devuelve (cantidad importada, lista de (fila, error)).
+        """
+        from models import Operacion, PagoProgramado, Factura, EstadoOperacion, EstadoPago, TipoPago
+
+        if not operaciones:
+            return 0, []
+
+        try:
+            nuevas = []
+            for item in operaciones:
+                operacion = Operacion(**{
+                    "costo_flete": 0.0,
+                    "costo_despachante": 0.0,
+                    **item["operacion"],
+                    "estado": EstadoOperacion.ACTIVA
+                })
+                operacion.calcular_margen()
+                costo_total = operacion.valor_compra + operacion.costo_flete + operacion.costo_despachante
+
+                for pago in item["pagos"]:
+                    tipo_pago = TipoPago(pago["tipo"])
+                    base = operacion.precio_venta if tipo_pago == TipoPago.COBRO else costo_total
+                    operacion.pagos_programados.append(PagoProgramado(
+                        numero_pago=pago["numero"],
+                        descripcion=pago["descripcion"],
+                        porcentaje=pago["porcentaje"],
+                        monto=base * pago["porcentaje"] / 100,
+                        fecha_programada=pago["fecha"],
+                        estado=EstadoPago.PENDIENTE,
+                        tipo=tipo_pago
+                    ))
+                if item.get("factura"):
+                    operacion.factura.append(Factura(**item["factura"]))
+                nuevas.append(operacion)
+
+            # El flush agrupa los INSERT por tabla y recupera los IDs en una sola ida
+            self.db.add_all(nuevas)
+            self.db.flush()
+            self.aplicar_a_resumen_mensual([self._valores_resumen(operacion) for operacion in nuevas])
+            self.db.commit()
+            return len(nuevas), []
+        except Exception as e:
+            self.db.rollback()
+            if len(operaciones) == 1:
+                return 0, [(operaciones[0]["fila"], str(e).splitlines()[0])]
+
+            self.logger.warning(f"Lote de {len(operaciones)} operaciones rechazado, reintentando fila por fila: {str(e)}")
+            importadas, errores = 0, []
+            for item in operaciones:
+                ok, error = self.importar_operaciones([item])
+                importadas += ok
+                errores.extend(error)
+            return importadas, errores
+
     def obtener_operaciones(self, estado = None):
         """Obtiene todas las operaciones o filtra por estado"""
         from models import Operacion
@@ -211,6 +538,8 @@ class OperacionService:
         query = query.options(
             joinedload(Operacion.proveedor),
             joinedload(Operacion.cliente),
+            joinedload(Operacion.agente_logistico),
+            joinedload(Operacion.hs_code),
             joinedload(Operacion.pagos_programados)
         )
         
@@ -218,24 +547,101 @@ class OperacionService:
             query = query.filter(Operacion.estado == estado)
         return query.order_by(Operacion.fecha_creacion.desc()).all()
     
-    def obtener_resumen_margenes(self, fecha_desde: date = None, fecha_hasta: date = None) -> dict:
-        """Obtiene un resumen de márgenes por diferentes criterios con filtro de fechas"""
-        from models import EstadoOperacion, Operacion
+    def _consulta_operaciones(self, estado = None):
+        """SELECT por columnas de las operaciones con los nombres de sus contactos"""
+        from models import Operacion, Contacto, HSCode
+        from sqlalchemy import select
+        from sqlalchemy.orm import aliased
         
-        query = self.db.query(Operacion)
+        proveedor = aliased(Contacto)
+        cliente = aliased(Contacto)
+        agente = aliased(Contacto)
+        consulta = (
+            select(
+                Operacion.id.label("ID"),
+                Operacion.fecha_creacion.label("Fecha"),
+                proveedor.nombre.label("Proveedor"),
+                cliente.nombre.label("Cliente"),
+                agente.nombre.label("Agente"),
+                HSCode.codigo.label("HS Code"),
+                Operacion.incoterm_compra.label("Incoterm Compra"),
+                Operacion.valor_compra.label("Valor Compra"),
+                Operacion.incoterm_venta.label("Incoterm Venta"),
+                Operacion.precio_venta.label("Precio Venta"),
+                Operacion.margen_calculado.label("Margen"),
+                Operacion.margen_porcentaje.label("Margen %"),
+                Operacion.estado.label("Estado")
+            )
+            .outerjoin(proveedor, Operacion.proveedor_id == proveedor.id)
+            .outerjoin(cliente, Operacion.cliente_id == cliente.id)
+            .outerjoin(agente, Operacion.agente_logistico_id == agente.id)
+            .outerjoin(HSCode, Operacion.hs_code_id == HSCode.id)
+            .order_by(Operacion.fecha_creacion.desc(), Operacion.id.desc())
+        )
+        if estado:
+            consulta = consulta.where(Operacion.estado == estado)
+        return consulta
+    
+    def _leer_tabla_operaciones(self, consulta) -> pd.DataFrame:
+        df = leer_dataframe(self.db, consulta)
+        df[["Margen", "Margen %"]] = df[["Margen", "Margen %"]].fillna(0.0)
+        df[["Proveedor", "Cliente", "Agente", "HS Code"]] = df[["Proveedor", "Cliente", "Agente", "HS Code"]].fillna("N/A")
+        return df
+    
+    def tabla_operaciones(self, estado = None) -> pd.DataFrame:
+        """Operaciones para mostrar, con importes numéricos y nombres de contactos en un solo SELECT"""
+        return self._leer_tabla_operaciones(self._consulta_operaciones(estado))
+    
+    def pagina_operaciones(self, estado = None, despues_de: tuple = None, tamano: int = 50) -> tuple:
+        """Página de operaciones de la más reciente a la más antigua, por keyset sobre (fecha_creacion, id).
         
-        # Filtrar por fechas si se proporcionan
-        if fecha_desde:
-            query = query.filter(Operacion.fecha_creacion >= fecha_desde)
-        if fecha_hasta:
-            # Agregar un día para incluir toda la fecha_hasta
-            from datetime import datetime, timedelta
-            fecha_hasta_completa = datetime.combine(fecha_hasta, datetime.max.time())
-            query = query.filter(Operacion.fecha_creacion <= fecha_hasta_completa)
+        `despues_de` es el cursor devuelto por la página anterior. Devuelve el
+        DataFrame de la página y el cursor de la siguiente, o None si es la última.
+        """
+        from models import Operacion
+        from sqlalchemy import tuple_
         
-        operaciones = query.filter(Operacion.estado == EstadoOperacion.ACTIVA).all()
+        consulta = self._consulta_operaciones(estado)
+        if despues_de:
+            consulta = consulta.where(tuple_(Operacion.fecha_creacion, Operacion.id) < tuple_(*despues_de))
+        df = self._leer_tabla_operaciones(consulta.limit(tamano + 1))
         
-        if not operaciones:
+        if len(df) <= tamano:
+            return df, None
+        df = df.iloc[:tamano]
+        return df, (df["Fecha"].iloc[-1].to_pydatetime(), int(df["ID"].iloc[-1]))
+    
+    def contar_operaciones(self, estado = None) -> int:
+        """Cantidad de operaciones, opcionalmente de un estado"""
+        from models import Operacion
+        from sqlalchemy import func
+        
+        query = self.db.query(func.count(Operacion.id))
+        if estado:
+            query = query.filter(Operacion.estado == estado)
+        return query.scalar()
+    
+    def contar_por_estado(self) -> dict:
+        """Cantidad de operaciones de cada estado, con una sola consulta agrupada"""
+        from models import Operacion
+        from sqlalchemy import func
+        
+        return dict(self.db.query(Operacion.estado, func.count(Operacion.id)).group_by(Operacion.estado).all())
+    
+    def ids_operaciones(self, estado = None) -> list:
+        """IDs de las operaciones, opcionalmente de un estado, sin cargar sus datos"""
+        from models import Operacion
+        
+        query = self.db.query(Operacion.id)
+        if estado:
+            query = query.filter(Operacion.estado == estado)
+        return [operacion_id for (operacion_id,) in query.order_by(Operacion.id)]
+    
+    def obtener_resumen_margenes(self, fecha_desde: date = None, fecha_hasta: date = None) -> dict:
+        """Obtiene el resumen de márgenes de las operaciones activas con filtro de fechas"""
+        resumen = self.analizar_margenes(None, fecha_desde, fecha_hasta).iloc[0]
+        
+        if not resumen["Operaciones"]:
             return {
                 "total_operaciones": 0,
                 "margen_total": 0,
@@ -243,16 +649,394 @@ class OperacionService:
                 "margen_porcentaje_promedio": 0
             }
         
-        margen_total = sum(op.margen_calculado or 0 for op in operaciones)
-        margen_promedio = margen_total / len(operaciones)
-        margen_porcentaje_promedio = sum(op.margen_porcentaje or 0 for op in operaciones) / len(operaciones)
-        
         return {
-            "total_operaciones": len(operaciones),
-            "margen_total": margen_total,
-            "margen_promedio": margen_promedio,
-            "margen_porcentaje_promedio": margen_porcentaje_promedio
+            "total_operaciones": int(resumen["Operaciones"]),
+            "margen_total": float(resumen["Margen"]),
+            "margen_promedio": float(resumen["Margen Promedio"]),
+            "margen_porcentaje_promedio": float(resumen["Margen % Promedio"])
         }
+    
+    def analizar_margenes(self, agrupar_por: str = None, fecha_desde: date = None,
+                          fecha_hasta: date = None, solo_activas: bool = True,
+                          prefijo_hs: str = None) -> pd.DataFrame:
+        """Totales y promedios de margen calculados con GROUP BY en la base de datos.
+        
+        `agrupar_por` es una clave de DIMENSIONES_MARGEN; sin agrupación devuelve una
+        sola fila con el total. El margen % ponderado es margen total / ventas totales,
+        a diferencia del promedio simple de los márgenes % de cada operación.
+        `prefijo_hs` limita a las operaciones cuyo código HS empieza con esos dígitos
+        (ej. "84" para todo el capítulo 84).
+        """
+        from models import Operacion, Contacto, HSCode, EstadoOperacion
+        from sqlalchemy import select, func, case, extract
+        from sqlalchemy.orm import aliased
+        from datetime import datetime
+        
+        if agrupar_por is not None and agrupar_por not in DIMENSIONES_MARGEN:
+            raise ValueError(f"Dimensión no válida: {agrupar_por}")
+        
+        margen = func.coalesce(func.sum(Operacion.margen_calculado), 0.0)
+        ventas = func.coalesce(func.sum(Operacion.precio_venta), 0.0)
+        metricas = [
+            func.count(Operacion.id).label("Operaciones"),
+            func.coalesce(func.sum(Operacion.valor_compra), 0.0).label("Compras"),
+            ventas.label("Ventas"),
+            margen.label("Margen"),
+            func.avg(func.coalesce(Operacion.margen_calculado, 0.0)).label("Margen Promedio"),
+            func.avg(func.coalesce(Operacion.margen_porcentaje, 0.0)).label("Margen % Promedio"),
+            case((ventas > 0, margen * 100.0 / ventas), else_=0.0).label("Margen % Ponderado")
+        ]
+        
+        # Columnas de agrupación de cada dimensión
+        grupos = []
+        consulta = select(Operacion.id)
+        if agrupar_por in ("cliente", "proveedor"):
+            contacto = aliased(Contacto)
+            columna_fk = Operacion.cliente_id if agrupar_por == "cliente" else Operacion.proveedor_id
+            consulta = consulta.outerjoin(contacto, columna_fk == contacto.id)
+            grupos = [contacto.nombre.label(DIMENSIONES_MARGEN[agrupar_por])]
+        elif agrupar_por in ("hs_code", "capitulo_hs", "partida_hs"):
+            consulta = consulta.outerjoin(HSCode, Operacion.hs_code_id == HSCode.id)
+            columna = {"hs_code": HSCode.codigo, "capitulo_hs": HSCode.capitulo, "partida_hs": HSCode.partida}[agrupar_por]
+            grupos = [columna.label(DIMENSIONES_MARGEN[agrupar_por])]
+        elif agrupar_por == "incoterms":
+            grupos = [Operacion.incoterm_compra.label("Incoterm Compra"), Operacion.incoterm_venta.label("Incoterm Venta")]
+        elif agrupar_por == "origen":
+            grupos = [Operacion.origen_bienes.label("Origen")]
+        elif agrupar_por == "mes":
+            grupos = [
+                extract("year", Operacion.fecha_creacion).label("Año"),
+                extract("month", Operacion.fecha_creacion).label("Número Mes")
+            ]
+        
+        digitos_hs = jerarquia_hs(prefijo_hs)["codigo_normalizado"]
+        if digitos_hs:
+            if agrupar_por not in ("hs_code", "capitulo_hs", "partida_hs"):
+                consulta = consulta.join(HSCode, Operacion.hs_code_id == HSCode.id)
+            consulta = consulta.where(filtro_prefijo_hs(HSCode.codigo_normalizado, digitos_hs))
+        
+        consulta = consulta.with_only_columns(*grupos, *metricas)
+        if solo_activas:
+            consulta = consulta.where(Operacion.estado == EstadoOperacion.ACTIVA)
+        if fecha_desde:
+            consulta = consulta.where(Operacion.fecha_creacion >= fecha_desde)
+        if fecha_hasta:
+            # Incluir todo el día de fecha_hasta
+            consulta = consulta.where(Operacion.fecha_creacion <= datetime.combine(fecha_hasta, datetime.max.time()))
+        if grupos:
+            consulta = consulta.group_by(*grupos)
+            consulta = consulta.order_by(*grupos) if agrupar_por == "mes" else consulta.order_by(margen.desc())
+        
+        df = leer_dataframe(self.db, consulta)
+        
+        if agrupar_por == "incoterms":
+            df.insert(0, "Incoterms", df.pop("Incoterm Compra") + " → " + df.pop("Incoterm Venta"))
+        elif agrupar_por == "mes":
+            anio, mes = df.pop("Año"), df.pop("Número Mes")
+            df.insert(0, "Mes", [f"{a:04d}-{m:02d}" for a, m in zip(anio, mes)])
+        elif grupos:
+            df[df.columns[0]] = df[df.columns[0]].fillna("Sin datos")
+        return df
+
+    def cambiar_estado(self, operacion_id: int, estado):
+        """Cambia el estado de una operación manteniendo los resúmenes mensuales"""
+        from models import Operacion
+        
+        try:
+            operacion = self.db.query(Operacion).filter(Operacion.id == operacion_id).first()
+            if not operacion:
+                raise ValueError("Operación no encontrada")
+            
+            if operacion.estado != estado:
+                self.aplicar_a_resumen_mensual([self._valores_resumen(operacion)], signo=-1)
+                operacion.estado = estado
+                self.aplicar_a_resumen_mensual([self._valores_resumen(operacion)])
+            self.db.commit()
+            return operacion
+        except Exception as e:
+            self.db.rollback()
+            self.logger.error(f"Error al cambiar el estado de la operación {operacion_id}: {str(e)}")
+            raise
+    
+    @staticmethod
+    def _columnas_resumen() -> list:
+        """Columnas de una operación que alimentan los resúmenes mensuales, en orden"""
+        from models import Operacion
+        
+        return [
+            Operacion.fecha_creacion,
+            Operacion.cliente_id,
+            Operacion.proveedor_id,
+            Operacion.estado,
+            Operacion.valor_compra,
+            Operacion.precio_venta,
+            Operacion.margen_calculado,
+            Operacion.margen_porcentaje
+        ]
+    
+    def _valores_resumen(self, operacion) -> tuple:
+        return tuple(getattr(operacion, columna.key) for columna in self._columnas_resumen())
+    
+    def aplicar_a_resumen_mensual(self, operaciones, signo: int = 1):
+        """Suma (signo=1) o resta (signo=-1) operaciones a los totales mensuales.
+        
+        Recibe tuplas con los valores de `_columnas_resumen` y no confirma la
+        transacción: el llamador hace commit junto con el cambio de la operación.
+        """
+        from models import ResumenMensualOperacion
+        
+        deltas = {}
+        for fecha, cliente_id, proveedor_id, estado, compra, venta, margen, margen_pct in operaciones:
+            delta = deltas.setdefault((primer_dia_mes(fecha), cliente_id, proveedor_id, estado), [0, 0.0, 0.0, 0.0, 0.0])
+            delta[0] += 1
+            delta[1] += compra or 0.0
+            delta[2] += venta or 0.0
+            delta[3] += margen or 0.0
+            delta[4] += margen_pct or 0.0
+        
+        acumular_en_tabla(self.db, ResumenMensualOperacion.__table__, ["mes", "cliente_id", "proveedor_id", "estado"], [
+            {
+                "mes": mes,
+                "cliente_id": cliente_id,
+                "proveedor_id": proveedor_id,
+                "estado": estado,
+                "cantidad_operaciones": signo * delta[0],
+                "total_compras": signo * delta[1],
+                "total_ventas": signo * delta[2],
+                "total_margen": signo * delta[3],
+                "suma_margen_porcentaje": signo * delta[4]
+            }
+            for (mes, cliente_id, proveedor_id, estado), delta in deltas.items()
+        ], campo_conteo="cantidad_operaciones")
+    
+    def reconstruir_resumen_mensual(self, confirmar: bool = True) -> int:
+        """Reconstruye desde cero los totales mensuales de operaciones.
+        
+        Con `confirmar=False` deja la transacción abierta para que la confirme el llamador.
+        """
+        from models import Operacion, ResumenMensualOperacion
+        from sqlalchemy import func, extract, insert
+        
+        try:
+            anio = extract("year", Operacion.fecha_creacion)
+            mes = extract("month", Operacion.fecha_creacion)
+            filas = self.db.query(
+                anio, mes, Operacion.cliente_id, Operacion.proveedor_id, Operacion.estado,
+                func.count(Operacion.id),
+                func.sum(func.coalesce(Operacion.valor_compra, 0.0)),
+                func.sum(func.coalesce(Operacion.precio_venta, 0.0)),
+                func.sum(func.coalesce(Operacion.margen_calculado, 0.0)),
+                func.sum(func.coalesce(Operacion.margen_porcentaje, 0.0))
+            ).group_by(anio, mes, Operacion.cliente_id, Operacion.proveedor_id, Operacion.estado).all()
+            
+            self.db.query(ResumenMensualOperacion).delete(synchronize_session=False)
+            resumen = [
+                {
+                    "mes": date(int(a), int(m), 1),
+                    "cliente_id": cliente_id,
+                    "proveedor_id": proveedor_id,
+                    "estado": estado,
+                    "cantidad_operaciones": cantidad,
+                    "total_compras": compras,
+                    "total_ventas": ventas,
+                    "total_margen": margen,
+                    "suma_margen_porcentaje": margen_pct
+                }
+                for a, m, cliente_id, proveedor_id, estado, cantidad, compras, ventas, margen, margen_pct in filas
+            ]
+            if resumen:
+                self.db.execute(insert(ResumenMensualOperacion.__table__), resumen)
+            if confirmar:
+                self.db.commit()
+            self.logger.info(f"Resumen mensual de operaciones reconstruido: {len(resumen)} filas")
+            return len(resumen)
+        except Exception as e:
+            if confirmar:
+                self.db.rollback()
+            self.logger.error(f"Error al reconstruir el resumen mensual de operaciones: {str(e)}")
+            raise
+    
+    def obtener_resumen_mensual(self, fecha_desde: date = None, fecha_hasta: date = None,
+                                solo_activas: bool = True) -> pd.DataFrame:
+        """Totales de operaciones por mes leídos de la tabla de resumen"""
+        from models import ResumenMensualOperacion as R, EstadoOperacion
+        from sqlalchemy import select, func, case
+        
+        ventas = func.sum(R.total_ventas)
+        margen = func.sum(R.total_margen)
+        consulta = select(
+            R.mes.label("Mes"),
+            func.sum(R.cantidad_operaciones).label("Operaciones"),
+            func.sum(R.total_compras).label("Compras"),
+            ventas.label("Ventas"),
+            margen.label("Margen"),
+            case((ventas > 0, margen * 100.0 / ventas), else_=0.0).label("Margen % Ponderado")
+        ).group_by(R.mes).order_by(R.mes)
+        if solo_activas:
+            consulta = consulta.where(R.estado == EstadoOperacion.ACTIVA)
+        if fecha_desde:
+            consulta = consulta.where(R.mes >= primer_dia_mes(fecha_desde))
+        if fecha_hasta:
+            consulta = consulta.where(R.mes <= fecha_hasta)
+        return leer_dataframe(self.db, consulta)
+
+    def recalcular_montos_pagos(self, operacion_ids: list = None, solo_faltantes: bool = False) -> int:
+        """Recalcula en SQL el monto resuelto de los pagos programados.
+        
+        Pagos: costo total * porcentaje / 100. Cobros: precio de venta * porcentaje / 100.
+        No confirma la transacción.
+        """
+        from models import Operacion, PagoProgramado, TipoPago
+        from sqlalchemy import select, case
+        
+        costo_total = select(
+            Operacion.valor_compra + Operacion.costo_flete + Operacion.costo_despachante
+        ).where(Operacion.id == PagoProgramado.operacion_id).scalar_subquery()
+        precio_venta = select(Operacion.precio_venta).where(
+            Operacion.id == PagoProgramado.operacion_id
+        ).scalar_subquery()
+        
+        query = self.db.query(PagoProgramado)
+        if operacion_ids is not None:
+            query = query.filter(PagoProgramado.operacion_id.in_(operacion_ids))
+        if solo_faltantes:
+            query = query.filter(PagoProgramado.monto.is_(None))
+        
+        return query.update({
+            PagoProgramado.monto: case(
+                (PagoProgramado.tipo == TipoPago.COBRO, precio_venta * PagoProgramado.porcentaje / 100),
+                else_=costo_total * PagoProgramado.porcentaje / 100
+            )
+        }, synchronize_session=False)
+    
+    def actualizar_costos(self, operacion_id: int, valor_compra: float = None,
+                          costo_flete: float = None, costo_despachante: float = None,
+                          precio_venta: float = None):
+        """Actualiza costos y precio de una operación recalculando margen, montos y estado de pagos.
+        
+        Margen, resumen mensual, montos de los pagos y su reconciliación se confirman
+        en una sola transacción.
+        """
+        from models import Operacion
+        
+        try:
+            operacion = self.db.query(Operacion).filter(Operacion.id == operacion_id).first()
+            if not operacion:
+                raise ValueError("Operación no encontrada")
+            
+            valores_anteriores = self._valores_resumen(operacion)
+            if valor_compra is not None:
+                operacion.valor_compra = valor_compra
+            if costo_flete is not None:
+                operacion.costo_flete = costo_flete
+            if costo_despachante is not None:
+                operacion.costo_despachante = costo_despachante
+            if precio_venta is not None:
+                operacion.precio_venta = precio_venta
+            
+            if operacion.precio_venta <= operacion.valor_compra:
+                raise ValueError("El precio de venta debe ser mayor al valor de compra")
+            
+            operacion.calcular_margen()
+            self.aplicar_a_resumen_mensual([valores_anteriores], signo=-1)
+            self.aplicar_a_resumen_mensual([self._valores_resumen(operacion)])
+            self.db.flush()
+            self.recalcular_montos_pagos([operacion_id])
+            
+            # Los nuevos montos pueden cambiar qué pagos quedan cubiertos
+            MovimientoFinancieroService(self.db).reconciliar_estado_pagos([operacion_id], confirmar=False)
+            self.db.commit()
+            self.db.refresh(operacion)
+            self.logger.info(f"Costos de la operación {operacion_id} actualizados")
+            return operacion
+        except Exception as e:
+            self.db.rollback()
+            self.logger.error(f"Error al actualizar costos de la operación {operacion_id}: {str(e)}")
+            raise
+    
+    def contar_dependencias(self, operacion_ids: list) -> dict:
+        """Movimientos, pagos y facturas de cada operación, con una sola consulta agrupada"""
+        from models import MovimientoFinanciero, PagoProgramado, Factura
+        from sqlalchemy import select, literal, func, union_all
+        
+        dependencias = union_all(*[
+            select(modelo.operacion_id.label("operacion_id"), literal(nombre).label("tabla"))
+            .where(modelo.operacion_id.in_(operacion_ids))
+            for nombre, modelo in [("movimientos", MovimientoFinanciero), ("pagos", PagoProgramado), ("facturas", Factura)]
+        ]).subquery()
+        
+        conteos = {operacion_id: {"movimientos": 0, "pagos": 0, "facturas": 0} for operacion_id in operacion_ids}
+        for operacion_id, tabla, cantidad in self.db.execute(
+            select(dependencias.c.operacion_id, dependencias.c.tabla, func.count())
+            .group_by(dependencias.c.operacion_id, dependencias.c.tabla)
+        ):
+            conteos[operacion_id][tabla] = cantidad
+        return conteos
+    
+    def eliminar_operaciones(self, operacion_ids: list) -> dict:
+        """Elimina varias operaciones en una transacción.
+        
+        La base borra en cascada movimientos, pagos, asignaciones y facturas
+        (ON DELETE CASCADE); aquí solo se descuentan de los acumulados. Devuelve
+        la cantidad de operaciones y de registros dependientes eliminados.
+        """
+        from models import Operacion, MovimientoFinanciero, PagoProgramado, Factura
+        from sqlalchemy import inspect
+        
+        try:
+            operacion_ids = [
+                operacion_id for (operacion_id,) in
+                self.db.query(Operacion.id).filter(Operacion.id.in_(list(operacion_ids)))
+            ]
+            eliminados = {"operaciones": len(operacion_ids), "movimientos": 0, "pagos": 0, "facturas": 0}
+            if not operacion_ids:
+                return eliminados
+            
+            for conteo in self.contar_dependencias(operacion_ids).values():
+                for tabla, cantidad in conteo.items():
+                    eliminados[tabla] += cantidad
+            
+            # Descontar movimientos y operaciones de los saldos diarios y resúmenes mensuales
+            movimientos = self.db.query(
+                MovimientoFinanciero.fecha,
+                MovimientoFinanciero.tipo,
+                MovimientoFinanciero.monto_entrada,
+                MovimientoFinanciero.monto_salida
+            ).filter(MovimientoFinanciero.operacion_id.in_(operacion_ids)).all()
+            MovimientoFinancieroService(self.db).aplicar_a_acumulados(movimientos, signo=-1)
+            self.aplicar_a_resumen_mensual(
+                self.db.query(*self._columnas_resumen()).filter(Operacion.id.in_(operacion_ids)).all(), signo=-1
+            )
+            
+            self.db.query(Operacion).filter(Operacion.id.in_(operacion_ids)).delete(synchronize_session=False)
+            
+            # Quitar de la sesión los objetos ya cargados que la base borró en cascada
+            # (se leen los valores en memoria para no recargar objetos expirados)
+            borrados = set(operacion_ids)
+            for estado in [inspect(objeto) for objeto in self.db.identity_map.values()]:
+                if (estado.class_ is Operacion and estado.identity[0] in borrados) or (
+                    estado.class_ in (MovimientoFinanciero, PagoProgramado, Factura)
+                    and estado.dict.get("operacion_id") in borrados
+                ):
+                    # Expulsar una operación también expulsa sus colecciones cargadas
+                    if estado.session is not None:
+                        self.db.expunge(estado.obj())
+            self.db.commit()
+            
+            self.logger.info(f"Operaciones eliminadas: {eliminados}")
+            return eliminados
+        except Exception as e:
+            self.db.rollback()
+            self.logger.error(f"Error al eliminar operaciones {operacion_ids}: {str(e)}")
+            raise
+    
+    def eliminar_operacion(self, operacion_id: int) -> Optional[dict]:
+        """Elimina una operación con sus movimientos, pagos y facturas en una transacción"""
+        eliminados = self.eliminar_operaciones([operacion_id])
+        if not eliminados.pop("operaciones"):
+            self.logger.warning(f"Operación {operacion_id} no encontrada")
+            return None
+        return eliminados
 
 class MovimientoFinancieroService:
     """Servicio para gestionar movimientos financieros"""
@@ -263,61 +1047,217 @@ class MovimientoFinancieroService:
     
     def actualizar_estado_pagos(self, operacion_id: int):
         """Actualiza el estado de los pagos programados basado en los movimientos realizados"""
-        from models import PagoProgramado, EstadoPago, MovimientoFinanciero, TipoMovimiento, TipoPago
-        
-        # Obtener todos los pagos programados de la operación
-        pagos = self.db.query(PagoProgramado).filter(
-            PagoProgramado.operacion_id == operacion_id
-        ).order_by(PagoProgramado.numero_pago).all()
-        
-        # Obtener movimientos de la operación
-        movimientos = self.obtener_movimientos_por_operacion(operacion_id)
-        
-        # Separar movimientos por tipo
-        depositos = [m for m in movimientos if m.tipo == TipoMovimiento.DEPOSITO_OPERACION]
-        cobros = [m for m in movimientos if m.tipo == TipoMovimiento.COBRO_OPERACION]
-        
-        # Calcular totales una sola vez
-        depositos_totales = sum(d.monto_salida for d in depositos)
-        cobros_totales = sum(c.monto_entrada for c in cobros)
-        
-        # Actualizar estado de pagos de depósitos
-        for pago in [p for p in pagos if p.tipo == TipoPago.PAGO]:
-            # Calcular el monto del pago basado en el costo total
-            costo_total = pago.operacion.valor_compra + pago.operacion.costo_flete + pago.operacion.costo_despachante
-            monto_pago = costo_total * pago.porcentaje / 100
-            if depositos_totales >= monto_pago:
-                pago.estado = EstadoPago.PAGADO
-                pago.fecha_real_pago = max(d.fecha for d in depositos) if depositos else None
+        return self.reconciliar_estado_pagos([operacion_id])
+    
+    def reconciliar_estado_pagos(self, operacion_ids: list = None, tamano_lote: int = 500,
+                                 confirmar: bool = True) -> list:
+        """Reconstruye las asignaciones FIFO y el estado de los pagos de varias operaciones.
+        
+        Sin `operacion_ids` reconcilia todas las operaciones. Trabaja por lotes de
+        `tamano_lote` operaciones con consultas agrupadas y confirma todo en una
+        única transacción (con `confirmar=False` la deja abierta para el llamador).
+        Devuelve la lista de pagos cuyo estado o fecha real cambió.
+        """
+        from models import Operacion
+        
+        try:
+            if operacion_ids is None:
+                ids = [operacion_id for (operacion_id,) in self.db.query(Operacion.id).order_by(Operacion.id)]
             else:
-                pago.estado = EstadoPago.PENDIENTE
-                pago.fecha_real_pago = None
-        
-        # Actualizar estado de pagos de cobros
-        for pago in [p for p in pagos if p.tipo == TipoPago.COBRO]:
-            monto_pago = pago.operacion.precio_venta * pago.porcentaje / 100
-            if cobros_totales >= monto_pago:
-                pago.estado = EstadoPago.PAGADO
-                pago.fecha_real_pago = max(c.fecha for c in cobros) if cobros else None
+                ids = list(dict.fromkeys(operacion_ids))
+            
+            cambios = []
+            for i in range(0, len(ids), tamano_lote):
+                cambios.extend(self._reconciliar_lote(ids[i:i + tamano_lote]))
+            
+            if confirmar:
+                self.db.commit()
+            self.logger.info(f"Estados de pagos reconciliados: {len(cambios)} cambios")
+            return cambios
+        except Exception as e:
+            if confirmar:
+                self.db.rollback()
+            self.logger.error(f"Error al reconciliar estados de pagos: {str(e)}")
+            raise
+    
+    def _tipo_pago_de(self, tipo_movimiento):
+        """Tipo de pago programado que salda cada tipo de movimiento de operación"""
+        from models import TipoMovimiento, TipoPago
+        
+        return {
+            TipoMovimiento.DEPOSITO_OPERACION: TipoPago.PAGO,
+            TipoMovimiento.COBRO_OPERACION: TipoPago.COBRO
+        }.get(tipo_movimiento)
+    
+    def _reconciliar_lote(self, operacion_ids: list) -> list:
+        """Reconstruye en FIFO las asignaciones de un lote de operaciones sin confirmar la transacción"""
+        from models import PagoProgramado, EstadoPago, MovimientoFinanciero, TipoMovimiento, TipoPago, AsignacionPago
+        from sqlalchemy import select, insert
+        
+        # Descartar las asignaciones previas del lote
+        self.db.query(AsignacionPago).filter(AsignacionPago.pago_programado_id.in_(
+            select(PagoProgramado.id).where(PagoProgramado.operacion_id.in_(operacion_ids))
+        )).delete(synchronize_session=False)
+        
+        # Colas FIFO de pagos por operación y tipo
+        query_pagos = self.db.query(
+            PagoProgramado.id,
+            PagoProgramado.operacion_id,
+            PagoProgramado.tipo,
+            PagoProgramado.monto
+        ).filter(
+            PagoProgramado.operacion_id.in_(operacion_ids),
+            PagoProgramado.tipo.in_([TipoPago.PAGO, TipoPago.COBRO]),
+            PagoProgramado.estado != EstadoPago.CANCELADO,
+            PagoProgramado.monto.isnot(None)
+        )
+        
+        colas = {}
+        for pago in query_pagos.order_by(PagoProgramado.fecha_programada, PagoProgramado.numero_pago, PagoProgramado.id):
+            colas.setdefault((pago.operacion_id, pago.tipo), []).append({"id": pago.id, "restante": pago.monto})
+        
+        # Aplicar los movimientos en orden cronológico
+        query_movimientos = self.db.query(
+            MovimientoFinanciero.id,
+            MovimientoFinanciero.operacion_id,
+            MovimientoFinanciero.tipo,
+            MovimientoFinanciero.monto_entrada,
+            MovimientoFinanciero.monto_salida,
+            MovimientoFinanciero.pago_programado_id
+        ).filter(
+            MovimientoFinanciero.operacion_id.in_(operacion_ids),
+            MovimientoFinanciero.tipo.in_([TipoMovimiento.DEPOSITO_OPERACION, TipoMovimiento.COBRO_OPERACION])
+        )
+        
+        asignaciones = []
+        for mov in query_movimientos.order_by(MovimientoFinanciero.fecha, MovimientoFinanciero.id):
+            tipo_pago = self._tipo_pago_de(mov.tipo)
+            monto = (mov.monto_salida if tipo_pago == TipoPago.PAGO else mov.monto_entrada) or 0
+            cola = colas.get((mov.operacion_id, tipo_pago), [])
+            for pago_id, parte in repartir_fifo(monto, cola, mov.pago_programado_id):
+                asignaciones.append({"movimiento_id": mov.id, "pago_programado_id": pago_id, "monto": parte})
+        
+        if asignaciones:
+            self.db.execute(insert(AsignacionPago.__table__), asignaciones)
+        self.db.flush()
+        
+        return self._sincronizar_estados(operacion_ids=operacion_ids)
+    
+    def _sincronizar_estados(self, pago_ids: list = None, operacion_ids: list = None) -> list:
+        """Deriva estado y fecha_real_pago de las asignaciones de cada pago, sin confirmar la transacción"""
+        from models import PagoProgramado, EstadoPago, MovimientoFinanciero, TipoPago, AsignacionPago
+        from sqlalchemy import func, update
+        
+        query = self.db.query(
+            PagoProgramado.id,
+            PagoProgramado.operacion_id,
+            PagoProgramado.monto,
+            PagoProgramado.estado,
+            PagoProgramado.fecha_real_pago,
+            func.coalesce(func.sum(AsignacionPago.monto), 0.0).label("asignado"),
+            func.max(MovimientoFinanciero.fecha).label("ultima_fecha")
+        ).outerjoin(
+            AsignacionPago, AsignacionPago.pago_programado_id == PagoProgramado.id
+        ).outerjoin(
+            MovimientoFinanciero, MovimientoFinanciero.id == AsignacionPago.movimiento_id
+        ).filter(
+            PagoProgramado.tipo.in_([TipoPago.PAGO, TipoPago.COBRO]),
+            PagoProgramado.estado != EstadoPago.CANCELADO
+        )
+        if pago_ids is not None:
+            query = query.filter(PagoProgramado.id.in_(pago_ids))
+        if operacion_ids is not None:
+            query = query.filter(PagoProgramado.operacion_id.in_(operacion_ids))
+        
+        cambios = []
+        for pago in query.group_by(PagoProgramado.id):
+            # El pago queda saldado en la fecha del último movimiento que lo cubrió
+            if pago.monto is not None and pago.asignado + TOLERANCIA_ASIGNACION >= pago.monto:
+                estado, fecha_real = EstadoPago.PAGADO, pago.ultima_fecha
             else:
-                pago.estado = EstadoPago.PENDIENTE
-                pago.fecha_real_pago = None
+                estado, fecha_real = EstadoPago.PENDIENTE, None
+            
+            if estado != pago.estado or fecha_real != pago.fecha_real_pago:
+                cambios.append({
+                    "pago_id": pago.id,
+                    "operacion_id": pago.operacion_id,
+                    "estado_anterior": pago.estado,
+                    "estado_nuevo": estado,
+                    "fecha_real_anterior": pago.fecha_real_pago,
+                    "fecha_real_nueva": fecha_real
+                })
+        
+        if cambios:
+            self.db.execute(update(PagoProgramado), [
+                {"id": c["pago_id"], "estado": c["estado_nuevo"], "fecha_real_pago": c["fecha_real_nueva"]}
+                for c in cambios
+            ])
+        return cambios
+    
+    def asignar_movimiento(self, movimiento) -> list:
+        """Aplica en FIFO un movimiento de operación a sus pagos pendientes, sin confirmar la transacción"""
+        from models import PagoProgramado, EstadoPago, TipoPago, AsignacionPago
+        from sqlalchemy import func, insert
+        
+        tipo_pago = self._tipo_pago_de(movimiento.tipo)
+        if not movimiento.operacion_id or tipo_pago is None:
+            return []
+        
+        monto = (movimiento.monto_salida if tipo_pago == TipoPago.PAGO else movimiento.monto_entrada) or 0
+        
+        # Pendientes de la operación con lo ya asignado, en orden de vencimiento
+        pendientes = self.db.query(
+            PagoProgramado.id,
+            PagoProgramado.monto,
+            func.coalesce(func.sum(AsignacionPago.monto), 0.0).label("asignado")
+        ).outerjoin(
+            AsignacionPago, AsignacionPago.pago_programado_id == PagoProgramado.id
+        ).filter(
+            PagoProgramado.operacion_id == movimiento.operacion_id,
+            PagoProgramado.tipo == tipo_pago,
+            PagoProgramado.estado == EstadoPago.PENDIENTE,
+            PagoProgramado.monto.isnot(None)
+        ).group_by(PagoProgramado.id).order_by(
+            PagoProgramado.fecha_programada, PagoProgramado.numero_pago, PagoProgramado.id
+        ).all()
+        
+        cola = [{"id": p.id, "restante": p.monto - p.asignado} for p in pendientes]
+        asignaciones = repartir_fifo(monto, cola, movimiento.pago_programado_id)
+        if not asignaciones:
+            return []
         
-        self.db.commit()
+        self.db.execute(insert(AsignacionPago.__table__), [
+            {"movimiento_id": movimiento.id, "pago_programado_id": pago_id, "monto": parte}
+            for pago_id, parte in asignaciones
+        ])
+        self.db.flush()
+        return self._sincronizar_estados(pago_ids=[pago_id for pago_id, _ in asignaciones])
+    
+    def obtener_saldo_actual(self, fecha_hasta: date = None) -> float:
+        """Obtiene el saldo real (entradas - salidas) a una fecha sin calcular la proyección"""
+        acumulados = self.obtener_saldos_acumulados(fecha_hasta)
+        return acumulados["total_entradas"] - acumulados["total_salidas"]
+    
+    def verificar_saldo_disponible(self, monto_salida: float, fecha_hasta: date = None) -> float:
+        """Verifica que haya saldo suficiente para un egreso y devuelve el saldo disponible"""
+        saldo_disponible = self.obtener_saldo_actual(fecha_hasta)
+        if monto_salida > saldo_disponible:
+            raise ValueError(f"Saldo insuficiente. Disponible: ${saldo_disponible:,.2f}")
+        return saldo_disponible
 
     def crear_movimiento(self, fecha: date, tipo, descripcion: str,
                         monto_entrada: float = 0.0, monto_salida: float = 0.0,
                         referencia: str = None, observaciones: str = None,
                         operacion_id: int = None,
-                        impuestos_personalizados: list = None):
+                        impuestos_personalizados: list = None,
+                        pago_programado_id: int = None):
         """Crea un nuevo movimiento financiero validando el saldo disponible"""
         from models import MovimientoFinanciero, TipoMovimiento, Operacion
+        from sqlalchemy import func
         try:
             # Verificar saldo disponible si es un egreso
             if monto_salida > 0:
-                saldo_info = self.calcular_saldo()
-                if monto_salida > saldo_info['saldo_actual']:
-                    raise ValueError(f"Saldo insuficiente. Disponible: ${saldo_info['saldo_actual']:,.2f}")
+                self.verificar_saldo_disponible(monto_salida)
 
             # Si es un depósito de operación, verificar el monto contra la operación
             if tipo == TipoMovimiento.DEPOSITO_OPERACION and operacion_id:
@@ -326,10 +1266,12 @@ class MovimientoFinancieroService:
                     raise ValueError("Operación no encontrada")
                 
                 # Calcular total de depósitos ya realizados para esta operación
-                depositos_previos = sum(
-                    mov.monto_salida for mov in self.obtener_movimientos_por_operacion(operacion_id)
-                    if mov.tipo == TipoMovimiento.DEPOSITO_OPERACION
-                )
+                depositos_previos = self.db.query(
+                    func.coalesce(func.sum(MovimientoFinanciero.monto_salida), 0.0)
+                ).filter(
+                    MovimientoFinanciero.operacion_id == operacion_id,
+                    MovimientoFinanciero.tipo == TipoMovimiento.DEPOSITO_OPERACION
+                ).scalar()
                 
                 # Calcular el costo total de la operación incluyendo costos adicionales
                 costo_total = operacion.valor_compra + operacion.costo_flete + operacion.costo_despachante
@@ -345,14 +1287,16 @@ class MovimientoFinancieroService:
                 monto_salida=monto_salida,
                 referencia=referencia,
                 observaciones=observaciones,
-                operacion_id=operacion_id
+                operacion_id=operacion_id,
+                pago_programado_id=pago_programado_id
             )
             self.db.add(movimiento)
+            self.aplicar_a_acumulados([(fecha, tipo, monto_entrada, monto_salida)])
             
-            # Actualizar estado de pagos si el movimiento está relacionado con una operación
+            # Asignar el movimiento a los pagos pendientes si está relacionado con una operación
             if operacion_id and tipo in [TipoMovimiento.DEPOSITO_OPERACION, TipoMovimiento.COBRO_OPERACION]:
                 self.db.flush()  # Para obtener el ID del movimiento
-                self.actualizar_estado_pagos(operacion_id)
+                self.asignar_movimiento(movimiento)
             
             self.db.commit()
             self.db.refresh(movimiento)
@@ -363,6 +1307,123 @@ class MovimientoFinancieroService:
             self.logger.error(f"Error al crear movimiento: {str(e)}")
             raise
     
+    def importar_movimientos(self, movimientos: pd.DataFrame, tamano_lote: int = 500) -> dict:
+        """Importa en bloque los movimientos de un extracto bancario.
+        
+        `movimientos` tiene las columnas fecha, tipo, descripcion, monto_entrada,
+        monto_salida, referencia y operacion_id. Las líneas cuyo hash de (fecha,
+        monto, referencia) ya está registrado se omiten. El saldo disponible y el
+        tope de depósitos por operación se validan una sola vez para todo el
+        extracto; el saldo se controla en cada línea y también en las fechas de los
+        movimientos ya registrados desde la primera línea, incluidos los
+        posteriores al extracto. Los movimientos se insertan por lotes con sus
+        acumulados y se reconcilian los pagos de cada operación afectada, todo en
+        una única transacción: si algo falla no queda guardada ninguna línea.
+        Devuelve un dict con importados, duplicados y operaciones.
+        """
+        from models import MovimientoFinanciero, Operacion, TipoMovimiento, SaldoDiario
+        from sqlalchemy import func, insert
+        from datetime import timedelta
+        from bisect import bisect_right
+        
+        df = movimientos.reset_index(drop=True)
+        df["monto_entrada"] = df["monto_entrada"].fillna(0.0)
+        df["monto_salida"] = df["monto_salida"].fillna(0.0)
+        neto = (df["monto_entrada"] - df["monto_salida"]).round(2)
+        referencia = df["referencia"].fillna("")
+        ocurrencia = df.groupby([df["fecha"], neto, referencia]).cumcount()
+        df["hash_importacion"] = [
+            hash_movimiento(fecha, monto, ref, n)
+            for fecha, monto, ref, n in zip(df["fecha"], neto, referencia, ocurrencia)
+        ]
+        
+        # Descartar lo ya importado con una consulta por lote sobre el índice único
+        hashes = df["hash_importacion"].tolist()
+        registrados = set()
+        for i in range(0, len(hashes), tamano_lote):
+            registrados.update(h for (h,) in self.db.query(MovimientoFinanciero.hash_importacion).filter(
+                MovimientoFinanciero.hash_importacion.in_(hashes[i:i + tamano_lote])
+            ))
+        nuevos = df[~df["hash_importacion"].isin(registrados)].sort_values("fecha", kind="stable")
+        resultado = {"importados": 0, "duplicados": len(df) - len(nuevos), "operaciones": []}
+        if nuevos.empty:
+            return resultado
+        
+        operacion_ids = sorted(int(op) for op in nuevos["operacion_id"].dropna().unique())
+        if operacion_ids:
+            costos = dict(self.db.query(
+                Operacion.id, Operacion.valor_compra + Operacion.costo_flete + Operacion.costo_despachante
+            ).filter(Operacion.id.in_(operacion_ids)))
+            faltantes = [f"#{op}" for op in operacion_ids if op not in costos]
+            if faltantes:
+                raise ValueError(f"Operaciones no encontradas: {', '.join(faltantes)}")
+            
+            depositos_previos = dict(self.db.query(
+                MovimientoFinanciero.operacion_id, func.sum(MovimientoFinanciero.monto_salida)
+            ).filter(
+                MovimientoFinanciero.operacion_id.in_(operacion_ids),
+                MovimientoFinanciero.tipo == TipoMovimiento.DEPOSITO_OPERACION
+            ).group_by(MovimientoFinanciero.operacion_id))
+            depositos = nuevos[nuevos["tipo"] == TipoMovimiento.DEPOSITO_OPERACION].groupby("operacion_id")["monto_salida"].sum()
+            excedidas = [
+                f"#{int(op)}" for op, monto in depositos.items()
+                if (depositos_previos.get(int(op)) or 0.0) + monto > costos[int(op)] + TOLERANCIA_ASIGNACION
+            ]
+            if excedidas:
+                raise ValueError(f"Los depósitos superarían el costo total de las operaciones {', '.join(excedidas)}")
+        
+        # Saldo en cada línea del extracto: el de los movimientos ya registrados hasta esa
+        # fecha (checkpoints diarios) más lo acumulado del extracto hasta esa línea
+        primera_fecha = nuevos["fecha"].min()
+        checkpoints = self.db.query(
+            SaldoDiario.fecha, SaldoDiario.total_entradas - SaldoDiario.total_salidas
+        ).filter(SaldoDiario.fecha >= primera_fecha).order_by(SaldoDiario.fecha).all()
+        fechas_checkpoint = [fecha for fecha, _ in checkpoints]
+        saldos_registrados = [self.obtener_saldo_actual(primera_fecha - timedelta(days=1))]
+        saldos_registrados += [saldo_dia for _, saldo_dia in checkpoints]
+        neto_extracto = (nuevos["monto_entrada"] - nuevos["monto_salida"]).cumsum()
+        saldos = [
+            (fecha, saldos_registrados[bisect_right(fechas_checkpoint, fecha)] + neto)
+            for fecha, neto in zip(nuevos["fecha"], neto_extracto)
+        ]
+        # Y en cada fecha con movimientos registrados: las salidas del extracto no pueden
+        # dejar sin fondos a un movimiento ya guardado, aunque sea posterior al extracto
+        fechas_extracto = nuevos["fecha"].tolist()
+        for fecha, saldo_dia in checkpoints:
+            posicion = bisect_right(fechas_extracto, fecha)
+            if neto_extracto.iloc[posicion - 1] < 0:
+                saldos.append((fecha, saldo_dia + neto_extracto.iloc[posicion - 1]))
+        insuficientes = [(fecha, saldo) for fecha, saldo in saldos if saldo < -TOLERANCIA_ASIGNACION]
+        if insuficientes:
+            fecha, saldo = min(insuficientes, key=lambda par: par[0])
+            raise ValueError(
+                f"Saldo insuficiente: el extracto dejaría el saldo en ${saldo:,.2f} "
+                f"el {fecha.strftime('%d/%m/%Y')}"
+            )
+        
+        columnas = ["fecha", "tipo", "descripcion", "monto_entrada", "monto_salida",
+                    "referencia", "operacion_id", "hash_importacion"]
+        filas = nuevos[columnas].astype(object).where(nuevos[columnas].notna(), None).to_dict("records")
+        try:
+            for i in range(0, len(filas), tamano_lote):
+                lote = filas[i:i + tamano_lote]
+                self.db.execute(insert(MovimientoFinanciero.__table__), lote)
+                self.aplicar_a_acumulados([
+                    (fila["fecha"], fila["tipo"], fila["monto_entrada"], fila["monto_salida"]) for fila in lote
+                ])
+            if operacion_ids:
+                self.reconciliar_estado_pagos(operacion_ids, confirmar=False)
+            self.db.commit()
+        except Exception as e:
+            self.db.rollback()
+            self.logger.error(f"Error al importar movimientos, no se guardó ninguna línea: {str(e)}")
+            raise
+        
+        resultado["importados"] = len(filas)
+        resultado["operaciones"] = operacion_ids
+        self.logger.info(f"Extracto importado: {resultado['importados']} movimientos, {resultado['duplicados']} duplicados")
+        return resultado
+
     def obtener_movimientos(self, fecha_desde: date = None, fecha_hasta: date = None):
         """Obtiene movimientos financieros con filtro de fechas"""
         from models import MovimientoFinanciero
@@ -383,6 +1444,73 @@ class MovimientoFinancieroService:
             self.logger.error(f"Error al obtener movimientos: {str(e)}")
             raise
 
+    def _consulta_movimientos(self, fecha_desde: date = None, fecha_hasta: date = None):
+        """SELECT por columnas de los movimientos, del más reciente al más antiguo"""
+        from models import MovimientoFinanciero
+        from sqlalchemy import select
+        
+        consulta = select(
+            MovimientoFinanciero.id.label("ID"),
+            MovimientoFinanciero.fecha.label("Fecha"),
+            MovimientoFinanciero.tipo.label("Tipo"),
+            MovimientoFinanciero.descripcion.label("Descripción"),
+            MovimientoFinanciero.monto_entrada.label("Entrada"),
+            MovimientoFinanciero.monto_salida.label("Salida"),
+            MovimientoFinanciero.referencia.label("Referencia"),
+            MovimientoFinanciero.observaciones.label("Observaciones")
+        ).order_by(MovimientoFinanciero.fecha.desc(), MovimientoFinanciero.id.desc())
+        if fecha_desde:
+            consulta = consulta.where(MovimientoFinanciero.fecha >= fecha_desde)
+        if fecha_hasta:
+            consulta = consulta.where(MovimientoFinanciero.fecha <= fecha_hasta)
+        return consulta
+    
+    def _leer_tabla_movimientos(self, consulta) -> pd.DataFrame:
+        df = leer_dataframe(self.db, consulta)
+        df["Tipo"] = df["Tipo"].str.replace("_", " ").str.title()
+        df[["Entrada", "Salida"]] = df[["Entrada", "Salida"]].fillna(0.0)
+        df[["Referencia", "Observaciones"]] = df[["Referencia", "Observaciones"]].fillna("-")
+        return df
+    
+    def tabla_movimientos(self, fecha_desde: date = None, fecha_hasta: date = None,
+                          limite: int = None) -> pd.DataFrame:
+        """Movimientos para mostrar, leídos por columnas y del más reciente al más antiguo"""
+        consulta = self._consulta_movimientos(fecha_desde, fecha_hasta)
+        if limite:
+            consulta = consulta.limit(limite)
+        return self._leer_tabla_movimientos(consulta)
+    
+    def pagina_movimientos(self, fecha_desde: date = None, fecha_hasta: date = None,
+                           despues_de: tuple = None, tamano: int = 50) -> tuple:
+        """Página de movimientos por keyset sobre (fecha, id).
+        
+        Devuelve el DataFrame de la página y el cursor de la siguiente, o None si es la última.
+        """
+        from models import MovimientoFinanciero
+        from sqlalchemy import tuple_
+        
+        consulta = self._consulta_movimientos(fecha_desde, fecha_hasta)
+        if despues_de:
+            consulta = consulta.where(tuple_(MovimientoFinanciero.fecha, MovimientoFinanciero.id) < tuple_(*despues_de))
+        df = self._leer_tabla_movimientos(consulta.limit(tamano + 1))
+        
+        if len(df) <= tamano:
+            return df, None
+        df = df.iloc[:tamano]
+        return df, (df["Fecha"].iloc[-1].date(), int(df["ID"].iloc[-1]))
+    
+    def contar_movimientos(self, fecha_desde: date = None, fecha_hasta: date = None) -> int:
+        """Cantidad de movimientos en el rango de fechas"""
+        from models import MovimientoFinanciero
+        from sqlalchemy import func
+        
+        query = self.db.query(func.count(MovimientoFinanciero.id))
+        if fecha_desde:
+            query = query.filter(MovimientoFinanciero.fecha >= fecha_desde)
+        if fecha_hasta:
+            query = query.filter(MovimientoFinanciero.fecha <= fecha_hasta)
+        return query.scalar()
+
     def obtener_movimientos_por_operacion(self, operacion_id: int):
         """Obtiene todos los movimientos relacionados con una operación"""
         from models import MovimientoFinanciero
@@ -409,116 +1537,333 @@ class MovimientoFinancieroService:
             self.logger.error(f"Error al calcular saldo de la operación {operacion_id}: {str(e)}")
             raise
     
-    def calcular_saldo(self, fecha_hasta: date = None) -> dict:
+    def aplicar_a_acumulados(self, movimientos, signo: int = 1):
+        """Suma o resta movimientos a los saldos diarios y a los resúmenes mensuales.
+        
+        Recibe tuplas (fecha, tipo, monto_entrada, monto_salida) y no confirma la transacción.
+        """
+        self.aplicar_a_saldos_diarios(movimientos, signo)
+        self.aplicar_a_resumen_mensual(movimientos, signo)
+    
+    def aplicar_a_resumen_mensual(self, movimientos, signo: int = 1):
+        """Suma (signo=1) o resta (signo=-1) movimientos a los totales por mes y tipo"""
+        from models import ResumenMensualMovimiento
+        
+        deltas = {}
+        for fecha, tipo, monto_entrada, monto_salida in movimientos:
+            delta = deltas.setdefault((primer_dia_mes(fecha), tipo), [0, 0.0, 0.0])
+            delta[0] += 1
+            delta[1] += monto_entrada if monto_entrada and monto_entrada > 0 else 0.0
+            delta[2] += monto_salida if monto_salida and monto_salida > 0 else 0.0
+        
+        acumular_en_tabla(self.db, ResumenMensualMovimiento.__table__, ["mes", "tipo"], [
+            {
+                "mes": mes,
+                "tipo": tipo,
+                "cantidad_movimientos": signo * delta[0],
+                "total_entradas": signo * delta[1],
+                "total_salidas": signo * delta[2]
+            }
+            for (mes, tipo), delta in deltas.items()
+        ], campo_conteo="cantidad_movimientos")
+    
+    def reconstruir_resumen_mensual(self, confirmar: bool = True) -> int:
+        """Reconstruye desde cero los totales mensuales de movimientos.
+        
+        Con `confirmar=False` deja la transacción abierta para que la confirme el llamador.
+        """
+        from models import MovimientoFinanciero, ResumenMensualMovimiento
+        from sqlalchemy import func, case, extract, insert
+        
+        try:
+            entrada = MovimientoFinanciero.monto_entrada
+            salida = MovimientoFinanciero.monto_salida
+            anio = extract("year", MovimientoFinanciero.fecha)
+            mes = extract("month", MovimientoFinanciero.fecha)
+            filas = self.db.query(
+                anio, mes, MovimientoFinanciero.tipo,
+                func.count(MovimientoFinanciero.id),
+                func.sum(case((entrada > 0, entrada), else_=0.0)),
+                func.sum(case((salida > 0, salida), else_=0.0))
+            ).group_by(anio, mes, MovimientoFinanciero.tipo).all()
+            
+            self.db.query(ResumenMensualMovimiento).delete(synchronize_session=False)
+            resumen = [
+                {
+                    "mes": date(int(a), int(m), 1),
+                    "tipo": tipo,
+                    "cantidad_movimientos": cantidad,
+                    "total_entradas": entradas,
+                    "total_salidas": salidas
+                }
+                for a, m, tipo, cantidad, entradas, salidas in filas
+            ]
+            if resumen:
+                self.db.execute(insert(ResumenMensualMovimiento.__table__), resumen)
+            if confirmar:
+                self.db.commit()
+            self.logger.info(f"Resumen mensual de movimientos reconstruido: {len(resumen)} filas")
+            return len(resumen)
+        except Exception as e:
+            if confirmar:
+                self.db.rollback()
+            self.logger.error(f"Error al reconstruir el resumen mensual de movimientos: {str(e)}")
+            raise
+    
+    def obtener_resumen_mensual(self, fecha_desde: date = None, fecha_hasta: date = None) -> pd.DataFrame:
+        """Entradas, salidas y neto por mes leídos de la tabla de resumen"""
+        from models import ResumenMensualMovimiento as R
+        from sqlalchemy import select, func
+        
+        consulta = select(
+            R.mes.label("Mes"),
+            func.sum(R.cantidad_movimientos).label("Movimientos"),
+            func.sum(R.total_entradas).label("Entradas"),
+            func.sum(R.total_salidas).label("Salidas"),
+            (func.sum(R.total_entradas) - func.sum(R.total_salidas)).label("Neto")
+        ).group_by(R.mes).order_by(R.mes)
+        if fecha_desde:
+            consulta = consulta.where(R.mes >= primer_dia_mes(fecha_desde))
+        if fecha_hasta:
+            consulta = consulta.where(R.mes <= fecha_hasta)
+        return leer_dataframe(self.db, consulta)
+    
+    def aplicar_a_saldos_diarios(self, movimientos, signo: int = 1):
+        """Suma (signo=1) o resta (signo=-1) movimientos a los checkpoints diarios.
+        
+        Recibe tuplas (fecha, tipo, monto_entrada, monto_salida) y no confirma la
+        transacción: el llamador hace commit junto con el alta o baja del movimiento.
+        """
+        from models import SaldoDiario, TipoMovimiento
+        
+        # Agrupar por fecha para tocar cada checkpoint una sola vez
+        deltas = {}
+        for fecha, tipo, monto_entrada, monto_salida in movimientos:
+            entrada = monto_entrada if monto_entrada and monto_entrada > 0 else 0.0
+            salida = monto_salida if monto_salida and monto_salida > 0 else 0.0
+            delta = deltas.setdefault(fecha, [0.0, 0.0, 0.0, 0.0, 0])
+            delta[0] += entrada
+            delta[1] += salida
+            if tipo == TipoMovimiento.DEPOSITO_OPERACION:
+                delta[2] += salida
+            if tipo == TipoMovimiento.COBRO_OPERACION:
+                delta[3] += entrada
+            delta[4] += 1
+        
+        for fecha in sorted(deltas):
+            entradas, salidas, depositos, cobros, cantidad = deltas[fecha]
+            
+            # Crear el checkpoint del día heredando los acumulados del día anterior. Es una
+            # sola sentencia para que dos escrituras concurrentes no lo dupliquen ni copien
+            # un día anterior desactualizado.
+            self.db.execute(self._insertar_checkpoint(fecha))
+            
+            # Propagar el delta a este día y a todos los posteriores en una sola sentencia
+            self.db.query(SaldoDiario).filter(SaldoDiario.fecha >= fecha).update({
+                SaldoDiario.total_entradas: SaldoDiario.total_entradas + signo * entradas,
+                SaldoDiario.total_salidas: SaldoDiario.total_salidas + signo * salidas,
+                SaldoDiario.depositos_operaciones: SaldoDiario.depositos_operaciones + signo * depositos,
+                SaldoDiario.cobros_operaciones: SaldoDiario.cobros_operaciones + signo * cobros,
+                SaldoDiario.cantidad_movimientos: SaldoDiario.cantidad_movimientos + signo * cantidad
+            }, synchronize_session=False)
+    
+    def _insertar_checkpoint(self, fecha: date):
+        """INSERT ... SELECT del checkpoint de una fecha que se ignora si ya existe"""
+        from models import SaldoDiario
+        from sqlalchemy import select, func, literal, true
+        
+        insert = _insert_dialecto(self.db)
+        columnas = [
+            SaldoDiario.total_entradas,
+            SaldoDiario.total_salidas,
+            SaldoDiario.depositos_operaciones,
+            SaldoDiario.cobros_operaciones,
+            SaldoDiario.cantidad_movimientos
+        ]
+        anteriores = [
+            func.coalesce(
+                select(columna).where(SaldoDiario.fecha < fecha)
+                .order_by(SaldoDiario.fecha.desc()).limit(1).scalar_subquery(),
+                0
+            )
+            for columna in columnas
+        ]
+        # El WHERE evita la ambigüedad de SQLite entre INSERT ... SELECT y ON CONFLICT
+        origen = select(literal(fecha, SaldoDiario.fecha.type), *anteriores).where(true())
+        return insert(SaldoDiario).from_select(
+            [SaldoDiario.fecha] + columnas, origen
+        ).on_conflict_do_nothing(index_elements=[SaldoDiario.fecha])
+    
+    def obtener_saldos_acumulados(self, fecha_hasta: date = None) -> dict:
+        """Obtiene los acumulados de movimientos hasta una fecha desde el checkpoint diario"""
+        from models import SaldoDiario
+        from datetime import date as date_class
+        
+        if fecha_hasta is None:
+            fecha_hasta = date_class.today()
+        
+        checkpoint = self.db.query(
+            SaldoDiario.total_entradas,
+            SaldoDiario.total_salidas,
+            SaldoDiario.depositos_operaciones,
+            SaldoDiario.cobros_operaciones,
+            SaldoDiario.cantidad_movimientos
+        ).filter(SaldoDiario.fecha <= fecha_hasta).order_by(SaldoDiario.fecha.desc()).first()
+        
+        if not checkpoint:
+            return {
+                "total_entradas": 0.0,
+                "total_salidas": 0.0,
+                "depositos_operaciones": 0.0,
+                "cobros_operaciones": 0.0,
+                "cantidad_movimientos": 0
+            }
+        
+        return {
+            "total_entradas": checkpoint.total_entradas,
+            "total_salidas": checkpoint.total_salidas,
+            "depositos_operaciones": checkpoint.depositos_operaciones,
+            "cobros_operaciones": checkpoint.cobros_operaciones,
+            "cantidad_movimientos": checkpoint.cantidad_movimientos
+        }
+    
+    def reconstruir_saldos_diarios(self, confirmar: bool = True) -> int:
+        """Reconstruye desde cero los checkpoints diarios a partir de los movimientos.
+        
+        Con `confirmar=False` deja la transacción abierta para que la confirme el llamador.
+        """
+        from models import MovimientoFinanciero, SaldoDiario, TipoMovimiento
+        from sqlalchemy import func, case, and_, insert
+        
+        try:
+            entrada = MovimientoFinanciero.monto_entrada
+            salida = MovimientoFinanciero.monto_salida
+            filas = self.db.query(
+                MovimientoFinanciero.fecha,
+                func.sum(case((entrada > 0, entrada), else_=0.0)),
+                func.sum(case((salida > 0, salida), else_=0.0)),
+                func.sum(case((and_(MovimientoFinanciero.tipo == TipoMovimiento.DEPOSITO_OPERACION, salida > 0), salida), else_=0.0)),
+                func.sum(case((and_(MovimientoFinanciero.tipo == TipoMovimiento.COBRO_OPERACION, entrada > 0), entrada), else_=0.0)),
+                func.count(MovimientoFinanciero.id)
+            ).group_by(MovimientoFinanciero.fecha).order_by(MovimientoFinanciero.fecha).all()
+            
+            self.db.query(SaldoDiario).delete(synchronize_session=False)
+            
+            acumulado = [0.0, 0.0, 0.0, 0.0, 0]
+            checkpoints = []
+            for fecha, *totales_dia in filas:
+                acumulado = [a + (t or 0) for a, t in zip(acumulado, totales_dia)]
+                checkpoints.append({
+                    "fecha": fecha,
+                    "total_entradas": acumulado[0],
+                    "total_salidas": acumulado[1],
+                    "depositos_operaciones": acumulado[2],
+                    "cobros_operaciones": acumulado[3],
+                    "cantidad_movimientos": acumulado[4]
+                })
+            
+            if checkpoints:
+                self.db.execute(insert(SaldoDiario.__table__), checkpoints)
+            if confirmar:
+                self.db.commit()
+            self.logger.info(f"Saldos diarios reconstruidos: {len(checkpoints)} días")
+            return len(checkpoints)
+        except Exception as e:
+            if confirmar:
+                self.db.rollback()
+            self.logger.error(f"Error al reconstruir saldos diarios: {str(e)}")
+            raise
+    
+    def _cargar_cronograma_pendiente(self) -> dict:
+        """Carga en arrays los pagos programados pendientes con una única consulta"""
+        from models import PagoProgramado, EstadoPago, TipoPago
+        
+        filas = self.db.query(
+            PagoProgramado.tipo,
+            PagoProgramado.fecha_programada,
+            PagoProgramado.monto
+        ).filter(
+            PagoProgramado.estado == EstadoPago.PENDIENTE
+        ).all()
+        
+        fechas = np.array([f.fecha_programada for f in filas], dtype='datetime64[D]')
+        es_pago = np.array([f.tipo == TipoPago.PAGO for f in filas], dtype=bool)
+        es_cobro = np.array([f.tipo == TipoPago.COBRO for f in filas], dtype=bool)
+        montos = np.array([f.monto for f in filas], dtype=float)
+        
+        return {
+            "fechas": fechas,
+            "egresos": np.where(es_pago, montos, 0.0),
+            "ingresos": np.where(es_cobro, montos, 0.0)
+        }
+    
+    def _proyectar_saldos(self, cronograma: dict, saldo_actual: float,
+                          fecha_hasta: date, fechas_proyeccion: list) -> dict:
+        """Agrupa los pagos futuros por fecha de corte y acumula ingresos y egresos"""
+        cortes = np.array(fechas_proyeccion, dtype='datetime64[D]')
+        futuros = cronograma["fechas"] > np.datetime64(fecha_hasta, 'D')
+        
+        # Cada pago futuro cae en el primer corte igual o posterior a su fecha programada
+        posiciones = np.searchsorted(cortes, cronograma["fechas"][futuros], side='left')
+        dentro = posiciones < len(cortes)
+        posiciones = posiciones[dentro]
+        
+        ingresos_acum = np.bincount(
+            posiciones, weights=cronograma["ingresos"][futuros][dentro], minlength=len(cortes)
+        ).cumsum()
+        egresos_acum = np.bincount(
+            posiciones, weights=cronograma["egresos"][futuros][dentro], minlength=len(cortes)
+        ).cumsum()
+        
+        proyeccion_saldos = {}
+        for i, fecha in enumerate(fechas_proyeccion):
+            proyeccion_saldos[fecha.strftime('%Y-%m-%d')] = {
+                'saldo': saldo_actual + float(ingresos_acum[i]) - float(egresos_acum[i]),
+                'ingresos': float(ingresos_acum[i]),
+                'egresos': float(egresos_acum[i])
+            }
+        
+        return proyeccion_saldos
+    
+    def calcular_saldo(self, fecha_hasta: date = None, dias_proyeccion: int = 90,
+                       granularidad: str = "semanal") -> dict:
         """Calcula el saldo y proyección de cash flow hasta una fecha determinada - ACTUALIZADO"""
-        from models import MovimientoFinanciero, TipoMovimiento, PagoProgramado, EstadoPago, Operacion, TipoPago
-        from datetime import date as date_class, timedelta
+        from datetime import date as date_class
         
         try:
             if fecha_hasta is None:
                 fecha_hasta = date_class.today()
             
-            # PASO 1: Obtener todos los movimientos financieros realizados hasta la fecha
-            movimientos = self.db.query(MovimientoFinanciero).filter(
-                MovimientoFinanciero.fecha <= fecha_hasta
-            ).all()
-            
-            # PASO 2: Calcular saldo actual SOLO basado en movimientos reales
-            total_entradas = 0
-            total_salidas = 0
-            depositos_operaciones = 0
-            cobros_operaciones = 0
-            
-            for mov in movimientos:
-                # Procesar entradas (ingresos de dinero)
-                if mov.monto_entrada > 0:
-                    total_entradas += mov.monto_entrada
-                    if mov.tipo == TipoMovimiento.COBRO_OPERACION:
-                        cobros_operaciones += mov.monto_entrada
-            
-                # Procesar salidas (egresos de dinero)
-                if mov.monto_salida > 0:
-                    total_salidas += mov.monto_salida
-                    if mov.tipo == TipoMovimiento.DEPOSITO_OPERACION:
-                        depositos_operaciones += mov.monto_salida
-            
-            # Saldo actual = entradas - salidas
+            # PASO 1: Leer los acumulados de movimientos desde el checkpoint diario más reciente
+            acumulados = self.obtener_saldos_acumulados(fecha_hasta)
+            total_entradas = acumulados["total_entradas"]
+            total_salidas = acumulados["total_salidas"]
+            depositos_operaciones = acumulados["depositos_operaciones"]
+            cobros_operaciones = acumulados["cobros_operaciones"]
+            
+            # PASO 2: Saldo actual = entradas - salidas (solo movimientos reales)
             saldo_actual = total_entradas - total_salidas
             
-            # PASO 3: Calcular pagos vencidos y futuros
-            depositos_pendientes = 0  # Pagos vencidos
-            cobros_pendientes = 0     # Cobros vencidos
-            depositos_futuros = 0     # Pagos futuros
-            cobros_futuros = 0        # Cobros futuros
-            
-            # Obtener todos los pagos programados pendientes
-            pagos_programados = self.db.query(PagoProgramado).join(Operacion).filter(
-                PagoProgramado.estado == EstadoPago.PENDIENTE
-            ).all()
-            
-            for pago in pagos_programados:
-                if pago.tipo == TipoPago.PAGO:
-                    # Depósitos: basado en costo total de la operación
-                    costo_total = pago.operacion.valor_compra + pago.operacion.costo_flete + pago.operacion.costo_despachante
-                    monto = costo_total * pago.porcentaje / 100
-                    
-                    if pago.fecha_programada <= fecha_hasta:
-                        # Es un pago vencido
-                        depositos_pendientes += monto
-                    else:
-                        # Es un pago futuro
-                        depositos_futuros += monto
-                        
-                elif pago.tipo == TipoPago.COBRO:
-                    # Cobros: basado en precio de venta
-                    monto = pago.operacion.precio_venta * pago.porcentaje / 100
-                    
-                    if pago.fecha_programada <= fecha_hasta:
-                        # Es un cobro vencido
-                        cobros_pendientes += monto
-                    else:
-                        # Es un cobro futuro
-                        cobros_futuros += monto
+            # PASO 3: Cargar una sola vez el cronograma pendiente y separar vencidos de futuros
+            cronograma = self._cargar_cronograma_pendiente()
+            fechas = cronograma["fechas"]
+            vencidos = fechas <= np.datetime64(fecha_hasta, 'D')
             
-            # PASO 4: Calcular proyección por fechas (próximos 90 días)
-            dias_proyeccion = 90
-            fechas_proyeccion = [fecha_hasta + timedelta(days=i) for i in range(0, dias_proyeccion+1, 7)]
-            proyeccion_saldos = {}
+            depositos_pendientes = float(cronograma["egresos"][vencidos].sum())   # Pagos vencidos
+            cobros_pendientes = float(cronograma["ingresos"][vencidos].sum())     # Cobros vencidos
+            depositos_futuros = float(cronograma["egresos"][~vencidos].sum())     # Pagos futuros
+            cobros_futuros = float(cronograma["ingresos"][~vencidos].sum())       # Cobros futuros
             
-            for fecha in fechas_proyeccion:
-                fecha_str = fecha.strftime('%Y-%m-%d')
-                
-                # Calcular ingresos y egresos acumulados hasta esta fecha
-                ingresos_acum = 0
-                egresos_acum = 0
-                
-                pagos_hasta_fecha = self.db.query(PagoProgramado).join(Operacion).filter(
-                    PagoProgramado.estado == EstadoPago.PENDIENTE,
-                    PagoProgramado.fecha_programada <= fecha,
-                    PagoProgramado.fecha_programada > fecha_hasta  # Solo futuros
-                ).all()
-                
-                for pago in pagos_hasta_fecha:
-                    if pago.tipo == TipoPago.PAGO:
-                        costo_total = pago.operacion.valor_compra + pago.operacion.costo_flete + pago.operacion.costo_despachante
-                        monto = costo_total * pago.porcentaje / 100
-                        egresos_acum += monto
-                    elif pago.tipo == TipoPago.COBRO:
-                        monto = pago.operacion.precio_venta * pago.porcentaje / 100
-                        ingresos_acum += monto
-                
-                proyeccion_saldos[fecha_str] = {
-                    'saldo': saldo_actual + ingresos_acum - egresos_acum,
-                    'ingresos': ingresos_acum,
-                    'egresos': egresos_acum
-                }
+            # PASO 4: Calcular proyección por fechas (por defecto próximos 90 días, semanal)
+            fechas_proyeccion = generar_fechas_proyeccion(fecha_hasta, dias_proyeccion, granularidad)
+            proyeccion_saldos = self._proyectar_saldos(cronograma, saldo_actual, fecha_hasta, fechas_proyeccion)
             
             # Saldo proyectado = saldo actual + todos los cobros pendientes - todos los depósitos pendientes
             saldo_proyectado = saldo_actual + (cobros_pendientes + cobros_futuros) - (depositos_pendientes + depositos_futuros)
             
             # Log para debugging
             self.logger.info(f"CÁLCULO DE SALDO ACTUALIZADO:")
-            self.logger.info(f"- Movimientos procesados: {len(movimientos)}")
+            self.logger.info(f"- Movimientos procesados: {acumulados['cantidad_movimientos']}")
             self.logger.info(f"- Total entradas: ${total_entradas:,.2f}")
             self.logger.info(f"- Total salidas: ${total_salidas:,.2f}")
             self.logger.info(f"- Saldo actual: ${saldo_actual:,.2f}")
@@ -541,7 +1886,7 @@ class MovimientoFinancieroService:
                 "cobros_futuros": cobros_futuros,
                 "saldo_proyectado": saldo_proyectado,
                 "proyeccion_saldos": proyeccion_saldos,
-                "cantidad_movimientos": len(movimientos)
+                "cantidad_movimientos": acumulados["cantidad_movimientos"]
             }
             
         except Exception as e:
@@ -558,8 +1903,17 @@ class MovimientoFinancieroService:
             ).first()
             
             if movimiento:
-                # Los impuestos personalizados se eliminan automáticamente por cascade
+                operacion_id = movimiento.operacion_id if self._tipo_pago_de(movimiento.tipo) else None
+                self.aplicar_a_acumulados(
+                    [(movimiento.fecha, movimiento.tipo, movimiento.monto_entrada, movimiento.monto_salida)],
+                    signo=-1
+                )
+                # Los impuestos personalizados y las asignaciones se eliminan automáticamente por cascade
                 self.db.delete(movimiento)
+                self.db.flush()
+                if operacion_id:
+                    # Repartir de nuevo la cola FIFO: el excedente de otros movimientos cubre los pagos liberados
+                    self._reconciliar_lote([operacion_id])
                 self.db.commit()
                 logging.info(f"Movimiento {movimiento_id} eliminado correctamente")
                 return True
@@ -585,7 +1939,8 @@ class HSCodeService:
         try:
             hs_code = HSCode(
                 codigo=codigo,
-                descripcion=descripcion
+                descripcion=descripcion,
+                **jerarquia_hs(codigo)
             )
             
             self.db.add(hs_code)
@@ -625,6 +1980,112 @@ class HSCodeService:
         return self.db.query(ImpuestoHS).filter(
             ImpuestoHS.hs_code_id == hs_code_id
         ).all()
+    
+    def _filtro_prefijo(self, query, prefijo: str = None):
+        """Filtra por prefijo de dígitos ("8471", "8471.30") sin importar puntos ni espacios"""
+        from models import HSCode
+        
+        if prefijo:
+            digitos = jerarquia_hs(prefijo)["codigo_normalizado"]
+            if digitos:
+                query = query.filter(filtro_prefijo_hs(HSCode.codigo_normalizado, digitos))
+            else:
+                query = query.filter(HSCode.codigo.startswith(prefijo.strip(), autoescape=True))
+        return query
+    
+    def pagina_hs_codes(self, prefijo: str = None, despues_de: str = None, tamano: int = 50) -> tuple:
+        """Página de códigos HS ordenados por código, con sus impuestos y la tasa total.
+        
+        La tasa total sale de una subconsulta escalar en la misma lectura y los
+        impuestos se cargan con selectinload: dos consultas por página sin importar
+        cuántos códigos haya. `despues_de` es el último código de la página
+        anterior. Devuelve el DataFrame de la página y el cursor de la siguiente.
+        """
+        from models import HSCode, ImpuestoHS
+        from sqlalchemy import select, func
+        from sqlalchemy.orm import selectinload
+        
+        total_impuestos = select(
+            func.coalesce(func.sum(ImpuestoHS.porcentaje), 0.0)
+        ).where(ImpuestoHS.hs_code_id == HSCode.id).scalar_subquery()
+        
+        query = self._filtro_prefijo(
+            self.db.query(HSCode, total_impuestos).options(selectinload(HSCode.impuestos)), prefijo
+        )
+        if despues_de:
+            query = query.filter(HSCode.codigo > despues_de)
+        filas = query.order_by(HSCode.codigo).limit(tamano + 1).all()
+        
+        df = pd.DataFrame(
+            [
+                {
+                    "ID": hs.id,
+                    "Código": hs.codigo,
+                    "Descripción": hs.descripcion,
+                    "Impuestos": [(impuesto.nombre, impuesto.porcentaje) for impuesto in hs.impuestos],
+                    "Total Impuestos %": float(total)
+                }
+                for hs, total in filas[:tamano]
+            ],
+            columns=["ID", "Código", "Descripción", "Impuestos", "Total Impuestos %"]
+        )
+        siguiente = df["Código"].iloc[-1] if len(filas) > tamano else None
+        return df, siguiente
+    
+    def contar_hs_codes(self, prefijo: str = None) -> int:
+        """Cantidad de códigos HS, opcionalmente de los que empiezan con un prefijo"""
+        from models import HSCode
+        from sqlalchemy import func
+        
+        return self._filtro_prefijo(self.db.query(func.count(HSCode.id)), prefijo).scalar()
+
+    def guardar_nomenclatura(self, codigos: list) -> int:
+        """Alta o actualización en bloque de códigos HS con sus impuestos.
+        
+        `codigos` es una lista de dicts con codigo, descripcion e impuestos (lista
+        de (nombre, porcentaje)). Los códigos existentes actualizan descripción y
+        jerarquía y sus impuestos se reemplazan por los recibidos. Todo el lote se
+        escribe con sentencias masivas en una transacción. Devuelve la cantidad de
+        códigos guardados.
+        """
+        from models import HSCode, ImpuestoHS
+        from sqlalchemy import insert, delete
+        
+        if not codigos:
+            return 0
+        
+        try:
+            alta = _insert_dialecto(self.db)(HSCode.__table__)
+            alta = alta.on_conflict_do_update(
+                index_elements=[HSCode.codigo],
+                set_={
+                    columna: alta.excluded[columna]
+                    for columna in ("descripcion", "codigo_normalizado", "capitulo", "partida", "subpartida")
+                }
+            )
+            self.db.execute(alta, [
+                {"codigo": c["codigo"], "descripcion": c["descripcion"], **jerarquia_hs(c["codigo"])}
+                for c in codigos
+            ])
+            
+            ids = dict(self.db.query(HSCode.codigo, HSCode.id).filter(
+                HSCode.codigo.in_([c["codigo"] for c in codigos])
+            ))
+            self.db.execute(delete(ImpuestoHS).where(ImpuestoHS.hs_code_id.in_(list(ids.values()))))
+            impuestos = [
+                {"hs_code_id": ids[c["codigo"]], "nombre": nombre, "porcentaje": porcentaje, "tipo": "PORCENTUAL"}
+                for c in codigos
+                for nombre, porcentaje in c["impuestos"]
+            ]
+            if impuestos:
+                self.db.execute(insert(ImpuestoHS.__table__), impuestos)
+            
+            self.db.commit()
+            return len(codigos)
+        except Exception as e:
+            self.db.rollback()
+            logging.error(f"Error al guardar nomenclatura: {str(e)}")
+            raise
 
 class FacturaService:
     """Servicio para gestionar facturas"""
@@ -632,8 +2093,44 @@ class FacturaService:
     def __init__(self, db: Session):
         self.db = db
     
-    def generar_factura(self, operacion_id: int, fecha_factura: date = None):
-        """Genera una factura para una operación - CORREGIDO"""
+    def reservar_numeros(self, prefijo: str, anio: int, cantidad: int = 1) -> list:
+        """Reserva un bloque de números consecutivos de la serie (prefijo, año).
+        
+        El contador se incrementa con un único UPDATE ... RETURNING dentro de la
+        transacción del llamador: el bloqueo de escritura serializa a quienes
+        facturan a la vez y, si la transacción se deshace, los números vuelven a
+        quedar libres. No confirma la transacción.
+        """
+        from models import SecuenciaFactura, Factura
+        from sqlalchemy import update
+        
+        incrementar = update(SecuenciaFactura).where(
+            SecuenciaFactura.prefijo == prefijo,
+            SecuenciaFactura.anio == anio
+        ).values(
+            ultimo_numero=SecuenciaFactura.ultimo_numero + cantidad
+        ).returning(SecuenciaFactura.ultimo_numero)
+        
+        ultimo = self.db.execute(incrementar).scalar()
+        if ultimo is None:
+            # Primera factura de la serie: arrancar después de los números ya cargados a mano con ese formato
+            serie = f"{prefijo}-{anio}-"
+            existentes = [
+                int(numero[len(serie):]) for (numero,) in
+                self.db.query(Factura.numero).filter(Factura.numero.like(f"{serie}%"))
+                if numero[len(serie):].isdigit()
+            ]
+            self.db.execute(
+                _insert_dialecto(self.db)(SecuenciaFactura)
+                .values(prefijo=prefijo, anio=anio, ultimo_numero=max(existentes, default=0))
+                .on_conflict_do_nothing()
+            )
+            ultimo = self.db.execute(incrementar).scalar()
+        
+        return [f"{prefijo}-{anio}-{numero:06d}" for numero in range(ultimo - cantidad + 1, ultimo + 1)]
+    
+    def generar_factura(self, operacion_id: int, fecha_factura: date = None, prefijo: str = "INV"):
+        """Genera una factura para una operación con el próximo número de la serie del año"""
         from models import Factura, Operacion
         from datetime import date as date_class
         
@@ -659,12 +2156,8 @@ class FacturaService:
             if factura_existente:
                 raise ValueError(f"Ya existe una factura para esta operación: {factura_existente.numero}")
             
-            # Generar número de factura
-            ultimo_numero = self.db.query(Factura).count()
-            numero_factura = f"INV-{ultimo_numero + 1:06d}"
-            
             factura = Factura(
-                numero=numero_factura,
+                numero=self.reservar_numeros(prefijo, fecha_factura.year)[0],
                 fecha=fecha_factura,
                 operacion_id=operacion_id,
                 subtotal_fob=operacion.valor_compra,
@@ -684,11 +2177,71 @@ class FacturaService:
             logging.error(f"Error al generar factura: {str(e)}")
             raise
     
-    def generar_factura_personalizada(self, operacion_id: int, numero: str, 
+    def _consulta_facturables(self, fecha_factura: date):
+        """Operaciones activas sin factura cuyo HBL (si existe) es posterior a la fecha de factura"""
+        from models import Operacion, Factura, EstadoOperacion
+        from sqlalchemy import select, or_
+        
+        return select(
+            Operacion.id,
+            Operacion.valor_compra,
+            Operacion.precio_venta,
+            Operacion.descripcion_venta
+        ).where(
+            Operacion.estado == EstadoOperacion.ACTIVA,
+            ~select(Factura.id).where(Factura.operacion_id == Operacion.id).exists(),
+            or_(Operacion.fecha_hbl.is_(None), Operacion.fecha_hbl > fecha_factura)
+        ).order_by(Operacion.id)
+    
+    def contar_facturables(self, fecha_factura: date = None) -> int:
+        """Cantidad de operaciones que `facturar_operaciones` facturaría"""
+        from sqlalchemy import select, func
+        
+        consulta = self._consulta_facturables(fecha_factura or date.today()).order_by(None).subquery()
+        return self.db.execute(select(func.count()).select_from(consulta)).scalar()
+    
+    def facturar_operaciones(self, fecha_factura: date = None, prefijo: str = "INV") -> list:
+        """Factura en bloque todas las operaciones facturables.
+        
+        Reserva de una vez un número por operación e inserta todas las facturas en
+        la misma transacción. Devuelve una lista de (operacion_id, numero).
+        """
+        from models import Factura
+        from sqlalchemy import insert
+        
+        fecha_factura = fecha_factura or date.today()
+        try:
+            operaciones = self.db.execute(self._consulta_facturables(fecha_factura)).all()
+            if not operaciones:
+                return []
+            
+            numeros = self.reservar_numeros(prefijo, fecha_factura.year, len(operaciones))
+            self.db.execute(insert(Factura.__table__), [
+                {
+                    "numero": numero,
+                    "fecha": fecha_factura,
+                    "operacion_id": operacion.id,
+                    "subtotal_fob": operacion.valor_compra,
+                    "total_incoterm": operacion.precio_venta,
+                    "moneda": "USD",
+                    "descripcion": operacion.descripcion_venta
+                }
+                for operacion, numero in zip(operaciones, numeros)
+            ])
+            self.db.commit()
+            logging.info(f"Facturas generadas en bloque: {len(numeros)} ({numeros[0]} a {numeros[-1]})")
+            return [(operacion.id, numero) for operacion, numero in zip(operaciones, numeros)]
+        except Exception as e:
+            self.db.rollback()
+            logging.error(f"Error al facturar operaciones: {str(e)}")
+            raise
+    
+    def generar_factura_personalizada(self, operacion_id: int, numero: Optional[str], 
                                      fecha_factura: date, subtotal_fob: float, 
                                      total_incoterm: float, moneda: str = "USD",
-                                     descripcion: str = "", observaciones: str = ""):
-        """Genera una factura con datos personalizados"""
+                                     descripcion: str = "", observaciones: str = "",
+                                     prefijo: str = "INV"):
+        """Genera una factura con datos personalizados; sin número se toma el próximo de la serie"""
         from models import Factura, Operacion
         
         try:
@@ -709,13 +2262,16 @@ class FacturaService:
             if factura_existente:
                 raise ValueError(f"Ya existe una factura para esta operación: {factura_existente.numero}")
             
-            # Verificar que el número de factura no exista
-            numero_existente = self.db.query(Factura).filter(
-                Factura.numero == numero
-            ).first()
-            
-            if numero_existente:
-                raise ValueError(f"Ya existe una factura con el número: {numero}")
+            if numero:
+                # Verificar que el número de factura no exista
+                numero_existente = self.db.query(Factura).filter(
+                    Factura.numero == numero
+                ).first()
+                
+                if numero_existente:
+                    raise ValueError(f"Ya existe una factura con el número: {numero}")
+            else:
+                numero = self.reservar_numeros(prefijo, fecha_factura.year)[0]
             
             factura = Factura(
                 numero=numero,
@@ -746,6 +2302,27 @@ class FacturaService:
         
         return self.db.query(Factura).order_by(Factura.fecha.desc()).all()
     
+    def tabla_facturas(self) -> pd.DataFrame:
+        """Facturas para mostrar con el cliente de su operación"""
+        from models import Factura, Operacion, Contacto
+        from sqlalchemy import select
+        
+        consulta = (
+            select(
+                Factura.numero.label("Número"),
+                Factura.fecha.label("Fecha"),
+                Contacto.nombre.label("Cliente"),
+                Factura.subtotal_fob.label("Subtotal FOB"),
+                Factura.total_incoterm.label("Total INCOTERM"),
+                Factura.moneda.label("Moneda"),
+                Factura.operacion_id.label("Operación ID")
+            )
+            .join(Operacion, Factura.operacion_id == Operacion.id)
+            .outerjoin(Contacto, Operacion.cliente_id == Contacto.id)
+            .order_by(Factura.fecha.desc())
+        )
+        return leer_dataframe(self.db, consulta)
+    
     def obtener_factura_por_operacion(self, operacion_id: int):
         """Obtiene la factura de una operación específica"""
         from models import Factura
@@ -753,52 +2330,3 @@ class FacturaService:
         return self.db.query(Factura).filter(
             Factura.operacion_id == operacion_id
         ).first()
-
-def migrate_database_fields():
-    """Migra campos nuevos en la base de datos"""
-    from sqlalchemy import create_engine, text
-    
-    DATABASE_URL = "sqlite:///comercio.db"
-    engine = create_engine(DATABASE_URL)
-    
-    with engine.connect() as conn:
-        try:
-            # Verificar si las columnas ya existen en contactos
-            result = conn.execute(text("PRAGMA table_info(contactos)"))
-            columns = [row[1] for row in result.fetchall()]
-            
-            # Agregar campos nuevos a contactos si no existen
-            new_fields = {
-                "provincia": "VARCHAR(100)",
-                "numero_identificacion_fiscal": "VARCHAR(50)",
-                "industria": "VARCHAR(50)",
-                "direccion_fabrica": "VARCHAR(500)",
-                "puerto_conveniente": "VARCHAR(200)"
-            }
-            
-            for field, field_type in new_fields.items():
-                if field not in columns:
-                    conn.execute(text(f"ALTER TABLE contactos ADD COLUMN {field} {field_type}"))
-                    logging.info(f"Agregada columna {field} a contactos")
-            
-            # Verificar si las columnas ya existen en facturas
-            result = conn.execute(text("PRAGMA table_info(facturas)"))
-            columns = [row[1] for row in result.fetchall()]
-            
-            # Agregar campos nuevos a facturas si no existen
-            factura_fields = {
-                "descripcion": "VARCHAR(1000)",
-                "observaciones": "VARCHAR(1000)"
-            }
-            
-            for field, field_type in factura_fields.items():
-                if field not in columns:
-                    conn.execute(text(f"ALTER TABLE facturas ADD COLUMN {field} {field_type}"))
-                    logging.info(f"Agregada columna {field} a facturas")
-            
-            conn.commit()
-            logging.info("Migración de campos completada exitosamente")
-            
-        except Exception as e:
-            logging.error(f"Error en migración: {str(e)}")
-            conn.rollback()
@@ -0,0 +1,282 @@
+# migraciones.py - Migraciones versionadas del esquema de base de datos
+from sqlalchemy import text, or_, inspect
+from sqlalchemy.orm import Session
+import threading
+import logging
+
+from models import init_database, SessionLocal, VersionEsquema
+
+# Streamlit re-ejecuta app.py en cada interacción: las migraciones se aplican una vez por proceso
+_lock_migraciones = threading.Lock()
+_migraciones_ejecutadas = False
+
+def _columnas(db: Session, tabla: str) -> list:
+    """Obtiene los nombres de columna de una tabla en cualquier backend"""
+    return [columna["name"] for columna in inspect(db.connection()).get_columns(tabla)]
+
+def _agregar_columnas(db: Session, tabla: str, campos: dict):
+    """Agrega a una tabla las columnas que todavía no existen"""
+    columnas = _columnas(db, tabla)
+    for campo, tipo_campo in campos.items():
+        if campo not in columnas:
+            db.execute(text(f"ALTER TABLE {tabla} ADD COLUMN {campo} {tipo_campo}"))
+            logging.info(f"Agregada columna {campo} a {tabla}")
+
+def migrar_campos_contactos_facturas(db: Session):
+    """Agrega los campos de facturación a contactos y facturas"""
+    _agregar_columnas(db, "contactos", {
+        "provincia": "VARCHAR(100)",
+        "numero_identificacion_fiscal": "VARCHAR(50)",
+        "industria": "VARCHAR(50)",
+        "direccion_fabrica": "VARCHAR(500)",
+        "puerto_conveniente": "VARCHAR(200)"
+    })
+    _agregar_columnas(db, "facturas", {
+        "descripcion": "VARCHAR(1000)",
+        "observaciones": "VARCHAR(1000)"
+    })
+
+def migrar_tipo_pagos(db: Session):
+    """Agrega el campo tipo a pagos_programados y lo completa según la descripción"""
+    from models import PagoProgramado, TipoPago
+
+    if "tipo" in _columnas(db, "pagos_programados"):
+        return
+
+    db.execute(text("ALTER TABLE pagos_programados ADD COLUMN tipo VARCHAR(10)"))
+
+    # Depósitos y saldos de compra son pagos; el resto son cobros
+    es_pago = or_(
+        PagoProgramado.descripcion.like("%Depósito%"),
+        PagoProgramado.descripcion.like("%Compra%")
+    )
+    db.query(PagoProgramado).filter(es_pago).update(
+        {PagoProgramado.tipo: TipoPago.PAGO}, synchronize_session=False
+    )
+    db.query(PagoProgramado).filter(PagoProgramado.tipo.is_(None)).update(
+        {PagoProgramado.tipo: TipoPago.COBRO}, synchronize_session=False
+    )
+
+def migrar_monto_pagos(db: Session):
+    """Agrega el monto resuelto a pagos_programados y lo calcula para los pagos existentes"""
+    from database import OperacionService
+
+    _agregar_columnas(db, "pagos_programados", {"monto": "FLOAT"})
+    actualizados = OperacionService(db).recalcular_montos_pagos(solo_faltantes=True)
+    if actualizados:
+        logging.info(f"Montos calculados para {actualizados} pagos programados")
+
+def migrar_destino_movimientos(db: Session):
+    """Agrega a los movimientos el pago programado al que se destinan"""
+    _agregar_columnas(db, "movimientos_financieros", {
+        "pago_programado_id": "INTEGER REFERENCES pagos_programados(id)"
+    })
+
+def migrar_indices(db: Session):
+    """Crea los índices declarados en los modelos que aún no existen"""
+    from models import Base
+
+    for tabla in Base.metadata.sorted_tables:
+        columnas = set(_columnas(db, tabla.name))
+        for indice in tabla.indexes:
+            # Los índices sobre columnas que agrega una migración posterior los crea esa migración
+            if all(columna.name in columnas for columna in indice.columns):
+                indice.create(bind=db.connection(), checkfirst=True)
+
+def migrar_saldos_diarios(db: Session):
+    """Genera los checkpoints de saldos diarios a partir de los movimientos existentes"""
+    from database import MovimientoFinancieroService
+
+    MovimientoFinancieroService(db).reconstruir_saldos_diarios(confirmar=False)
+
+def migrar_asignaciones_pago(db: Session):
+    """Genera las asignaciones FIFO de los movimientos de operaciones existentes"""
+    from database import MovimientoFinancieroService
+
+    cambios = MovimientoFinancieroService(db).reconciliar_estado_pagos(confirmar=False)
+    logging.info(f"Asignaciones generadas: {len(cambios)} pagos actualizados")
+
+def migrar_resumenes_mensuales(db: Session):
+    """Genera los resúmenes mensuales de operaciones y movimientos existentes"""
+    from database import OperacionService, MovimientoFinancieroService
+
+    OperacionService(db).reconstruir_resumen_mensual(confirmar=False)
+    MovimientoFinancieroService(db).reconstruir_resumen_mensual(confirmar=False)
+
+def migrar_hash_movimientos(db: Session):
+    """Agrega la huella de importación de extractos a los movimientos, con índice único"""
+    from models import MovimientoFinanciero
+
+    _agregar_columnas(db, "movimientos_financieros", {"hash_importacion": "VARCHAR(64)"})
+    for indice in MovimientoFinanciero.__table__.indexes:
+        indice.create(bind=db.connection(), checkfirst=True)
+
+def _claves_foraneas(claves) -> set:
+    return {
+        (tuple(clave["constrained_columns"]), clave["referred_table"], (clave.get("options") or {}).get("ondelete", "").upper())
+        for clave in claves
+    }
+
+def _tablas_con_claves_desactualizadas(db: Session) -> list:
+    """Tablas cuyas FOREIGN KEY en la base no tienen las reglas ON DELETE del modelo"""
+    from models import Base
+
+    inspector = inspect(db.connection())
+    tablas = []
+    for tabla in Base.metadata.sorted_tables:
+        esperadas = _claves_foraneas(
+            {
+                "constrained_columns": [columna.name for columna in fk.columns],
+                "referred_table": fk.referred_table.name,
+                "options": {"ondelete": fk.ondelete or ""}
+            }
+            for fk in tabla.foreign_key_constraints
+        )
+        if esperadas != _claves_foraneas(inspector.get_foreign_keys(tabla.name)):
+            tablas.append(tabla)
+    return tablas
+
+def _reconstruir_tablas_sqlite(db: Session, tablas: list):
+    """Recrea tablas SQLite con el esquema del modelo conservando los datos.
+
+    SQLite no permite alterar FOREIGN KEY: se crea la tabla nueva, se copian los
+    datos, se borra la original y se renombra. Las claves foráneas se desactivan
+    durante la copia, lo que solo es posible fuera de una transacción, por eso
+    se trabaja sobre una conexión propia con BEGIN explícito.
+    """
+    from sqlalchemy import MetaData
+    from sqlalchemy.schema import CreateTable
+
+    # Copia del esquema para compilar cada tabla nueva con otro nombre
+    copia = MetaData()
+    for tabla in tablas[0].metadata.sorted_tables:
+        tabla.to_metadata(copia)
+
+    with db.get_bind().connect() as conexion:
+        conexion.exec_driver_sql("PRAGMA foreign_keys=OFF")
+        try:
+            conexion.exec_driver_sql("BEGIN")
+            for tabla in tablas:
+                nueva = copia.tables[tabla.name].to_metadata(copia, name=f"{tabla.name}__nueva")
+                existentes = {columna["name"] for columna in inspect(conexion).get_columns(tabla.name)}
+                columnas = ", ".join(columna.name for columna in tabla.columns if columna.name in existentes)
+
+                conexion.execute(CreateTable(nueva))
+                conexion.exec_driver_sql(f"INSERT INTO {nueva.name} ({columnas}) SELECT {columnas} FROM {tabla.name}")
+                conexion.exec_driver_sql(f"DROP TABLE {tabla.name}")
+                conexion.exec_driver_sql(f"ALTER TABLE {nueva.name} RENAME TO {tabla.name}")
+                for indice in tabla.indexes:
+                    indice.create(bind=conexion)
+                logging.info(f"Tabla {tabla.name} reconstruida con sus claves foráneas")
+
+            huerfanos = conexion.exec_driver_sql("PRAGMA foreign_key_check").fetchall()
+            if huerfanos:
+                logging.warning(f"Registros con referencias inexistentes: {len(huerfanos)}")
+            conexion.commit()
+        except Exception:
+            conexion.rollback()
+            raise
+        finally:
+            conexion.exec_driver_sql("PRAGMA foreign_keys=ON")
+
+def migrar_claves_foraneas(db: Session):
+    """Aplica las reglas ON DELETE CASCADE/RESTRICT del modelo a las claves foráneas existentes"""
+    from sqlalchemy import MetaData
+    from sqlalchemy.schema import AddConstraint
+
+    tablas = _tablas_con_claves_desactualizadas(db)
+    if not tablas:
+        return
+
+    if db.get_bind().dialect.name == "sqlite":
+        _reconstruir_tablas_sqlite(db, tablas)
+        return
+
+    # AddConstraint marca la restricción para que CREATE TABLE ya no la incluya: se usa
+    # una copia del esquema para no alterar las tablas del modelo
+    copia = MetaData()
+    for tabla in tablas[0].metadata.sorted_tables:
+        tabla.to_metadata(copia)
+
+    inspector = inspect(db.connection())
+    for tabla in tablas:
+        for clave in inspector.get_foreign_keys(tabla.name):
+            db.execute(text(f'ALTER TABLE {tabla.name} DROP CONSTRAINT "{clave["name"]}"'))
+        for fk in copia.tables[tabla.name].foreign_key_constraints:
+            db.execute(AddConstraint(fk))
+        logging.info(f"Claves foráneas de {tabla.name} actualizadas")
+
+def migrar_jerarquia_hs(db: Session):
+    """Agrega código normalizado, capítulo, partida y subpartida a los códigos HS, con sus índices"""
+    from sqlalchemy import update
+    from models import HSCode
+    from database import jerarquia_hs
+
+    _agregar_columnas(db, "hs_codes", {
+        "codigo_normalizado": "VARCHAR(20)",
+        "capitulo": "VARCHAR(2)",
+        "partida": "VARCHAR(4)",
+        "subpartida": "VARCHAR(6)"
+    })
+    valores = [{"id": hs_id, **jerarquia_hs(codigo)} for hs_id, codigo in db.query(HSCode.id, HSCode.codigo)]
+    if valores:
+        db.execute(update(HSCode), valores)
+    for indice in HSCode.__table__.indexes:
+        indice.create(bind=db.connection(), checkfirst=True)
+    logging.info(f"Jerarquía calculada para {len(valores)} códigos HS")
+
+# Migraciones en orden de aplicación: (versión, nombre, función)
+MIGRACIONES = [
+    (1, "campos_contactos_facturas", migrar_campos_contactos_facturas),
+    (2, "tipo_pagos_programados", migrar_tipo_pagos),
+    (3, "monto_pagos_programados", migrar_monto_pagos),
+    (4, "destino_movimientos", migrar_destino_movimientos),
+    (5, "indices", migrar_indices),
+    (6, "saldos_diarios", migrar_saldos_diarios),
+    (7, "asignaciones_pago", migrar_asignaciones_pago),
+    (8, "resumenes_mensuales", migrar_resumenes_mensuales),
+    (9, "hash_movimientos", migrar_hash_movimientos),
+    (10, "claves_foraneas", migrar_claves_foraneas),
+    (11, "jerarquia_hs", migrar_jerarquia_hs),
+]
+
+def ejecutar_migraciones(forzar: bool = False) -> list:
+    """Crea las tablas y aplica las migraciones pendientes una sola vez por proceso.
+
+    Cada migración se registra en schema_version al terminar, de modo que no vuelve
+    a ejecutarse. Las migraciones no confirman: sus datos y su registro se
+    confirman juntos, y un fallo deshace ambos. Si una falla, se detiene la
+    secuencia y se reintenta en la próxima ejecución. Devuelve los nombres de las
+    migraciones aplicadas.
+    """
+    global _migraciones_ejecutadas
+
+    with _lock_migraciones:
+        if _migraciones_ejecutadas and not forzar:
+            return []
+
+        init_database()
+
+        db = SessionLocal()
+        aplicadas = []
+        try:
+            versiones = {version for (version,) in db.query(VersionEsquema.version)}
+
+            for version, nombre, migracion in MIGRACIONES:
+                if version in versiones:
+                    continue
+                try:
+                    migracion(db)
+                    db.add(VersionEsquema(version=version, nombre=nombre))
+                    db.commit()
+                    aplicadas.append(nombre)
+                    logging.info(f"Migración {version} ({nombre}) aplicada")
+                except Exception as e:
+                    db.rollback()
+                    logging.error(f"Error en migración {version} ({nombre}): {str(e)}")
+                    return aplicadas
+
+            _migraciones_ejecutadas = True
+            return aplicadas
+        finally:
+            db.close()
@@ -2,6 +2,30 @@
 import pandas as pd
 from datetime import date, timedelta
 
+COLUMNAS_PLANTILLA = [
+    "Factura",
+    "Fecha", 
+    "Proveedor",
+    "Codigo_Producto",
+    "Cliente",
+    "INCOTERM",
+    "Origen",
+    "Puerto_Origen", 
+    "Destino_Final",
+    "Valor_Compra_FOB",
+    "Porcentaje_Deposito",
+    "Fecha_Deposito",
+    "Fecha_Pago_Saldo",
+    "Valor_Venta",
+    "Numero_Cuotas",
+    "Fechas_Cuotas",
+    "Observaciones"
+]
+
+COLUMNAS_OBLIGATORIAS = ["Factura", "Fecha", "Proveedor", "Cliente", "Valor_Compra_FOB", "Valor_Venta"]
+
+PORCENTAJE_DEPOSITO_DEFECTO = 30.0
+
 def generar_plantilla_excel():
     """Genera un DataFrame con el formato correcto para cargar movimientos"""
     
@@ -99,25 +123,7 @@ def generar_plantilla_excel():
 def generar_plantilla_vacia():
     """Genera una plantilla vacía solo con las columnas"""
     
-    columnas = [
-        "Factura",
-        "Fecha", 
-        "Proveedor",
-        "Codigo_Producto",
-        "Cliente",
-        "INCOTERM",
-        "Origen",
-        "Puerto_Origen", 
-        "Destino_Final",
-        "Valor_Compra_FOB",
-        "Porcentaje_Deposito",
-        "Fecha_Deposito",
-        "Fecha_Pago_Saldo",
-        "Valor_Venta",
-        "Numero_Cuotas",
-        "Fechas_Cuotas",
-        "Observaciones"
-    ]
+    columnas = COLUMNAS_PLANTILLA
     
     # Crear DataFrame vacío con una fila de ejemplo
     data = {col: [""] for col in columnas}
@@ -187,3 +193,415 @@ Borra esta fila de instrucciones antes de subir el archivo.
 """
     
     return instrucciones
+
+def leer_plantilla(archivo, nombre: str = "", tamano_lote: int = 500):
+    """Lee la plantilla por lotes de filas, como texto.
+
+    Los CSV se leen en streaming; Excel no admite lectura parcial, así que se
+    lee completo y se entrega en lotes del mismo tamaño. El índice de cada lote
+    conserva la posición de la fila en el archivo.
+    """
+    if nombre.lower().endswith((".xlsx", ".xls")):
+        df = pd.read_excel(archivo, dtype=str)
+        for inicio in range(0, len(df), tamano_lote):
+            yield df.iloc[inicio:inicio + tamano_lote]
+    else:
+        yield from pd.read_csv(archivo, dtype=str, chunksize=tamano_lote)
+
+def indice_contactos(db) -> tuple:
+    """Índices en memoria nombre -> id de proveedores y clientes, con una sola consulta"""
+    from models import Contacto, TipoContacto
+    
+    proveedores, clientes = {}, {}
+    filas = db.query(Contacto.id, Contacto.nombre, Contacto.tipo).filter(
+        Contacto.tipo.in_([TipoContacto.PROVEEDOR, TipoContacto.CLIENTE])
+    )
+    for contacto_id, nombre, tipo in filas:
+        indice = proveedores if tipo == TipoContacto.PROVEEDOR else clientes
+        indice.setdefault(nombre.strip().casefold(), contacto_id)
+    return proveedores, clientes
+
+def _normalizar_lote(lote: pd.DataFrame) -> pd.DataFrame:
+    """Completa las columnas opcionales faltantes, recorta espacios y trata vacíos como nulos"""
+    df = lote.reindex(columns=COLUMNAS_PLANTILLA).astype("string")
+    df = df.apply(lambda columna: columna.str.strip()).replace("", pd.NA)
+    return df.dropna(how="all")
+
+def _fechas(serie: pd.Series) -> pd.Series:
+    return pd.to_datetime(serie, format="ISO8601", errors="coerce")
+
+def validar_plantilla(df: pd.DataFrame, proveedores: dict, clientes: dict,
+                      facturas_registradas: set = frozenset()) -> tuple:
+    """Valida un lote normalizado con operaciones vectorizadas.
+
+    Devuelve (válidas, errores): un DataFrame con los valores ya convertidos de
+    las filas correctas y otro con Fila, Factura y Error de las rechazadas.
+    """
+    from models import IncotermVenta
+    
+    problemas = {}
+    for columna in COLUMNAS_OBLIGATORIAS:
+        problemas[f"Falta {columna}"] = df[columna].isna()
+    
+    problemas["Factura repetida en el archivo"] = df["Factura"].notna() & df["Factura"].duplicated()
+    problemas["La factura ya está registrada"] = df["Factura"].isin(list(facturas_registradas))
+    
+    fecha = _fechas(df["Fecha"])
+    problemas["Fecha inválida"] = df["Fecha"].notna() & fecha.isna()
+    fecha_deposito = _fechas(df["Fecha_Deposito"])
+    problemas["Fecha_Deposito inválida"] = df["Fecha_Deposito"].notna() & fecha_deposito.isna()
+    fecha_saldo = _fechas(df["Fecha_Pago_Saldo"])
+    problemas["Fecha_Pago_Saldo inválida"] = df["Fecha_Pago_Saldo"].notna() & fecha_saldo.isna()
+    
+    proveedor_id = df["Proveedor"].str.casefold().map(proveedores)
+    problemas["Proveedor no encontrado"] = df["Proveedor"].notna() & proveedor_id.isna()
+    cliente_id = df["Cliente"].str.casefold().map(clientes)
+    problemas["Cliente no encontrado"] = df["Cliente"].notna() & cliente_id.isna()
+    
+    compra = pd.to_numeric(df["Valor_Compra_FOB"], errors="coerce").astype("float64")
+    problemas["Valor_Compra_FOB debe ser un número positivo"] = df["Valor_Compra_FOB"].notna() & ~(compra > 0)
+    venta = pd.to_numeric(df["Valor_Venta"], errors="coerce").astype("float64")
+    problemas["Valor_Venta debe ser un número positivo"] = df["Valor_Venta"].notna() & ~(venta > 0)
+    problemas["El valor de venta debe ser mayor al valor de compra"] = (compra > 0) & (venta > 0) & (venta <= compra)
+    
+    porcentaje = pd.to_numeric(df["Porcentaje_Deposito"], errors="coerce").astype("float64")
+    problemas["Porcentaje_Deposito debe estar entre 0 y 100"] = (
+        df["Porcentaje_Deposito"].notna() & ~((porcentaje > 0) & (porcentaje <= 100))
+    )
+    
+    incoterm = df["INCOTERM"].str.upper()
+    problemas["INCOTERM inválido (DAP, CIF o FOB)"] = (
+        incoterm.notna() & ~incoterm.isin([i.name for i in IncotermVenta])
+    )
+    
+    # Una fila por fecha de cuota; el índice repetido identifica la fila de origen
+    cuotas = df["Fechas_Cuotas"].str.split(";").explode().str.strip()
+    cuotas = cuotas[cuotas.notna() & (cuotas != "")]
+    fechas_cuotas = _fechas(cuotas)
+    problemas["Fechas_Cuotas inválidas"] = (
+        fechas_cuotas.isna().groupby(level=0).any().reindex(df.index, fill_value=False)
+    )
+    cantidad_fechas = fechas_cuotas.groupby(level=0).size().reindex(df.index, fill_value=0)
+    numero_cuotas = pd.to_numeric(df["Numero_Cuotas"], errors="coerce").astype("float64")
+    problemas["Numero_Cuotas debe ser un entero positivo"] = (
+        df["Numero_Cuotas"].notna() & ~((numero_cuotas >= 1) & (numero_cuotas % 1 == 0))
+    )
+    esperadas = numero_cuotas.fillna(cantidad_fechas.where(cantidad_fechas > 0, 1))
+    problemas["Numero_Cuotas no coincide con Fechas_Cuotas"] = (
+        (numero_cuotas >= 1) & (cantidad_fechas != esperadas) & ~((cantidad_fechas == 0) & (esperadas == 1))
+    )
+    
+    mascaras = pd.DataFrame(problemas, index=df.index).fillna(False).astype(bool)
+    con_error = mascaras.any(axis=1)
+    
+    marcados = mascaras[con_error].melt(ignore_index=False, var_name="Error")
+    marcados = marcados[marcados["value"]]
+    errores = pd.DataFrame({
+        "Fila": df.index[con_error] + 2,  # +1 por el encabezado, +1 porque las filas se numeran desde 1
+        "Factura": df.loc[con_error, "Factura"].to_numpy(),
+        "Error": marcados.groupby(level=0, sort=False)["Error"].agg("; ".join).reindex(df.index[con_error]).to_numpy()
+    })
+    
+    ok = ~con_error
+    validas = pd.DataFrame({
+        "fila": df.index[ok] + 2,
+        "factura": df.loc[ok, "Factura"],
+        "fecha": fecha[ok],
+        "proveedor_id": proveedor_id[ok].astype("int64"),
+        "cliente_id": cliente_id[ok].astype("int64"),
+        "codigo_producto": df.loc[ok, "Codigo_Producto"],
+        "incoterm": incoterm[ok].fillna("FOB"),
+        "origen": df.loc[ok, "Origen"],
+        "puerto_origen": df.loc[ok, "Puerto_Origen"],
+        "destino_final": df.loc[ok, "Destino_Final"],
+        "valor_compra": compra[ok],
+        "porcentaje_deposito": porcentaje[ok].fillna(PORCENTAJE_DEPOSITO_DEFECTO),
+        "fecha_deposito": fecha_deposito[ok].fillna(fecha[ok]),
+        "fecha_pago_saldo": fecha_saldo[ok].fillna(fecha[ok]),
+        "valor_venta": venta[ok],
+        "observaciones": df.loc[ok, "Observaciones"]
+    })
+    fechas_por_fila = fechas_cuotas.groupby(level=0).agg(list)
+    validas["fechas_cuotas"] = fechas_por_fila.reindex(validas.index)
+    return validas, errores
+
+def _texto(valor):
+    return None if pd.isna(valor) else str(valor)
+
+def construir_operaciones(validas: pd.DataFrame) -> list:
+    """Convierte las filas válidas al formato de OperacionService.importar_operaciones.
+
+    Los pagos al proveedor son el depósito y el saldo de compra; las cuotas de
+    Fechas_Cuotas se convierten en cobros de igual porcentaje (la última absorbe
+    el redondeo). Sin fechas de cuotas se programa un único cobro en la fecha
+    de pago del saldo.
+    """
+    from models import IncotermCompra, IncotermVenta
+    
+    operaciones = []
+    for fila in validas.itertuples(index=False):
+        fecha = fila.fecha.date()
+        porcentaje = float(fila.porcentaje_deposito)
+        pagos = [{
+            "numero": 1,
+            "descripcion": "Depósito Inicial",
+            "porcentaje": porcentaje,
+            "fecha": fila.fecha_deposito.date(),
+            "tipo": "pago"
+        }]
+        if porcentaje < 100:
+            pagos.append({
+                "numero": 2,
+                "descripcion": "Saldo Compra",
+                "porcentaje": 100 - porcentaje,
+                "fecha": fila.fecha_pago_saldo.date(),
+                "tipo": "pago"
+            })
+        
+        fechas_cuotas = fila.fechas_cuotas if isinstance(fila.fechas_cuotas, list) else [fila.fecha_pago_saldo]
+        cuotas = len(fechas_cuotas)
+        porcentaje_cuota = round(100 / cuotas, 2)
+        for i, fecha_cuota in enumerate(fechas_cuotas):
+            ultima = i == cuotas - 1
+            pagos.append({
+                "numero": len(pagos) + 1,
+                "descripcion": "Cobro final" if ultima else f"Cobro #{i+1}",
+                "porcentaje": round(100 - porcentaje_cuota * (cuotas - 1), 2) if ultima else porcentaje_cuota,
+                "fecha": fecha_cuota.date(),
+                "tipo": "cobro"
+            })
+        
+        observaciones = [
+            f"Puerto de origen: {fila.puerto_origen}" if _texto(fila.puerto_origen) else None,
+            f"Destino final: {fila.destino_final}" if _texto(fila.destino_final) else None,
+            _texto(fila.observaciones)
+        ]
+        operaciones.append({
+            "fila": int(fila.fila),
+            "operacion": {
+                "fecha_creacion": fila.fecha.to_pydatetime(),
+                "proveedor_id": int(fila.proveedor_id),
+                "cliente_id": int(fila.cliente_id),
+                "incoterm_compra": IncotermCompra.FOB,
+                "valor_compra": float(fila.valor_compra),
+                "porcentaje_deposito": porcentaje,
+                "fecha_deposito": fila.fecha_deposito.date(),
+                "fecha_estimada_pago_saldo": fila.fecha_pago_saldo.date(),
+                "incoterm_venta": IncotermVenta[fila.incoterm],
+                "precio_venta": float(fila.valor_venta),
+                "origen_bienes": _texto(fila.origen),
+                "descripcion_venta": _texto(fila.codigo_producto),
+                "observaciones": " | ".join(o for o in observaciones if o) or None
+            },
+            "pagos": pagos,
+            "factura": {
+                "numero": fila.factura,
+                "fecha": fecha,
+                "subtotal_fob": float(fila.valor_compra),
+                "total_incoterm": float(fila.valor_venta),
+                "moneda": "USD",
+                "descripcion": _texto(fila.codigo_producto)
+            }
+        })
+    return operaciones
+
+def importar_plantilla(db, archivo, nombre: str = "", tamano_lote: int = 500) -> tuple:
+    """Importa operaciones desde la plantilla (CSV o Excel) por lotes.
+
+    Cada lote se valida en bloque y se guarda en su propia transacción, de modo
+    que un archivo grande no retiene la base ni se pierde completo por una fila
+    incorrecta. La factura de la plantilla se registra con la operación, lo que
+    también evita duplicar operaciones al volver a subir el mismo archivo.
+    Devuelve (cantidad importada, DataFrame de errores con Fila, Factura y Error).
+    """
+    from models import Factura
+    from database import OperacionService
+    
+    service = OperacionService(db)
+    proveedores, clientes = indice_contactos(db)
+    importadas = 0
+    errores = []
+    vistas = set()
+    
+    for lote in leer_plantilla(archivo, nombre, tamano_lote):
+        faltantes = [c for c in COLUMNAS_OBLIGATORIAS if c not in lote.columns]
+        if faltantes:
+            raise ValueError(f"Faltan columnas obligatorias en la plantilla: {', '.join(faltantes)}")
+        
+        df = _normalizar_lote(lote)
+        numeros = df["Factura"].dropna().unique().tolist()
+        registradas = {numero for (numero,) in db.query(Factura.numero).filter(Factura.numero.in_(numeros))}
+        validas, errores_lote = validar_plantilla(df, proveedores, clientes, registradas | vistas)
+        errores.append(errores_lote)
+        
+        operaciones = construir_operaciones(validas)
+        guardadas, fallidas = service.importar_operaciones(operaciones)
+        importadas += guardadas
+        # Solo las facturas guardadas cuentan como registradas para los lotes siguientes
+        filas_fallidas = {fila for fila, _ in fallidas}
+        vistas.update(op["factura"]["numero"] for op in operaciones if op["fila"] not in filas_fallidas)
+        if fallidas:
+            facturas = {op["fila"]: op["factura"]["numero"] for op in operaciones}
+            errores.append(pd.DataFrame(
+                [(fila, facturas[fila], error) for fila, error in fallidas],
+                columns=["Fila", "Factura", "Error"]
+            ))
+    
+    errores = [e for e in errores if not e.empty]
+    if not errores:
+        return importadas, pd.DataFrame(columns=["Fila", "Factura", "Error"])
+    return importadas, pd.concat(errores, ignore_index=True).sort_values("Fila", ignore_index=True)
+
+COLUMNAS_EXTRACTO = ["Fecha", "Descripcion", "Referencia", "Monto", "Entrada", "Salida", "Tipo", "Operacion"]
+
+def leer_extracto_bancario(archivo, tipo_entrada=None, tipo_salida=None) -> tuple:
+    """Lee un extracto bancario CSV y lo valida con operaciones vectorizadas.
+
+    Acepta un Monto con signo (positivo = entrada) o columnas Entrada y Salida.
+    Tipo (ej. cobro_operacion) y Operacion (ID) son opcionales: sin Tipo, las
+    líneas con operación se toman como cobro o depósito de la operación y el
+    resto como `tipo_entrada` / `tipo_salida`. Devuelve (movimientos, errores)
+    en el formato de MovimientoFinancieroService.importar_movimientos.
+    """
+    from models import TipoMovimiento
+    
+    tipo_entrada = tipo_entrada or TipoMovimiento.ADELANTO
+    tipo_salida = tipo_salida or TipoMovimiento.RETIRO
+    
+    lote = pd.read_csv(archivo, dtype=str)
+    faltantes = [c for c in ["Fecha", "Descripcion"] if c not in lote.columns]
+    if "Monto" not in lote.columns and not {"Entrada", "Salida"} <= set(lote.columns):
+        faltantes.append("Monto (o Entrada y Salida)")
+    if faltantes:
+        raise ValueError(f"Faltan columnas obligatorias en el extracto: {', '.join(faltantes)}")
+    usa_monto = "Monto" in lote.columns
+    
+    df = lote.reindex(columns=COLUMNAS_EXTRACTO).astype("string")
+    df = df.apply(lambda columna: columna.str.strip()).replace("", pd.NA).dropna(how="all")
+    
+    problemas = {
+        "Falta Fecha": df["Fecha"].isna(),
+        "Falta Descripcion": df["Descripcion"].isna()
+    }
+    fecha = _fechas(df["Fecha"])
+    problemas["Fecha inválida"] = df["Fecha"].notna() & fecha.isna()
+    
+    if usa_monto:
+        monto = pd.to_numeric(df["Monto"], errors="coerce").astype("float64")
+        problemas["Monto debe ser un número distinto de cero"] = monto.isna() | (monto == 0)
+        entrada, salida = monto.clip(lower=0), (-monto).clip(lower=0)
+    else:
+        entrada = pd.to_numeric(df["Entrada"].fillna("0"), errors="coerce").astype("float64")
+        salida = pd.to_numeric(df["Salida"].fillna("0"), errors="coerce").astype("float64")
+        problemas["Entrada y Salida deben ser números positivos"] = entrada.isna() | salida.isna() | (entrada < 0) | (salida < 0)
+        problemas["Debe haber entrada o salida, no ambas"] = (entrada > 0) == (salida > 0)
+    
+    operacion = pd.to_numeric(df["Operacion"], errors="coerce")
+    problemas["Operacion debe ser el ID de una operación"] = (
+        df["Operacion"].notna() & ~((operacion >= 1) & (operacion % 1 == 0))
+    )
+    
+    tipos = {clave: tipo for tipo in TipoMovimiento for clave in (tipo.value, tipo.name.casefold())}
+    tipo = df["Tipo"].str.casefold().map(tipos)
+    problemas["Tipo de movimiento inválido"] = df["Tipo"].notna() & tipo.isna()
+    
+    mascaras = pd.DataFrame(problemas, index=df.index).fillna(False).astype(bool)
+    con_error = mascaras.any(axis=1)
+    marcados = mascaras[con_error].melt(ignore_index=False, var_name="Error")
+    marcados = marcados[marcados["value"]]
+    errores = pd.DataFrame({
+        "Fila": df.index[con_error] + 2,
+        "Error": marcados.groupby(level=0, sort=False)["Error"].agg("; ".join).reindex(df.index[con_error]).to_numpy()
+    })
+    
+    ok = ~con_error
+    es_entrada = entrada[ok] > 0
+    con_operacion = operacion[ok].notna()
+    tipo_defecto = pd.Series(
+        [tipo_entrada if e else tipo_salida for e in es_entrada], index=es_entrada.index, dtype=object
+    )
+    tipo_defecto[con_operacion & es_entrada] = TipoMovimiento.COBRO_OPERACION
+    tipo_defecto[con_operacion & ~es_entrada] = TipoMovimiento.DEPOSITO_OPERACION
+    
+    movimientos = pd.DataFrame({
+        "fila": df.index[ok] + 2,
+        "fecha": fecha[ok].dt.date,
+        "tipo": tipo[ok].astype(object).where(tipo[ok].notna(), tipo_defecto),
+        "descripcion": df.loc[ok, "Descripcion"].astype(object),
+        "monto_entrada": entrada[ok],
+        "monto_salida": salida[ok],
+        "referencia": df.loc[ok, "Referencia"].astype(object),
+        "operacion_id": operacion[ok].astype("Int64")
+    })
+    return movimientos, errores
+
+COLUMNAS_NOMENCLATURA = ["Codigo", "Descripcion"]
+
+def importar_nomenclatura(db, archivo, nombre: str = "", tamano_lote: int = 2000) -> tuple:
+    """Carga una nomenclatura arancelaria (CSV o Excel) por lotes.
+
+    Codigo y Descripcion son obligatorias; cada columna adicional es un impuesto
+    cuyo encabezado es el nombre y el valor el porcentaje (vacío = no aplica).
+    Los códigos ya registrados se actualizan y sus impuestos se reemplazan. Cada
+    lote se guarda en su propia transacción. Devuelve (cantidad guardada,
+    DataFrame de errores con Fila, Codigo y Error).
+    """
+    from database import HSCodeService
+    
+    service = HSCodeService(db)
+    guardados = 0
+    errores = []
+    vistos = set()
+    
+    for lote in leer_plantilla(archivo, nombre, tamano_lote):
+        faltantes = [c for c in COLUMNAS_NOMENCLATURA if c not in lote.columns]
+        if faltantes:
+            raise ValueError(f"Faltan columnas obligatorias en la nomenclatura: {', '.join(faltantes)}")
+        
+        df = lote.astype("string").apply(lambda columna: columna.str.strip()).replace("", pd.NA).dropna(how="all")
+        columnas_impuestos = [c for c in df.columns if c not in COLUMNAS_NOMENCLATURA]
+        
+        problemas = {
+            "Falta Codigo": df["Codigo"].isna(),
+            "Falta Descripcion": df["Descripcion"].isna(),
+            "El código debe tener al menos 2 dígitos": (
+                df["Codigo"].notna() & (df["Codigo"].str.replace(r"\D", "", regex=True).str.len() < 2)
+            ),
+            "El código no puede superar 20 caracteres": df["Codigo"].str.len() > 20,
+            "Código repetido en el archivo": (
+                df["Codigo"].notna() & (df["Codigo"].duplicated() | df["Codigo"].astype(object).isin(vistos))
+            )
+        }
+        tasas = df[columnas_impuestos].apply(lambda columna: pd.to_numeric(columna, errors="coerce")).astype("float64")
+        for columna in columnas_impuestos:
+            problemas[f"{columna} debe ser un porcentaje entre 0 y 100"] = (
+                df[columna].notna() & ~((tasas[columna] >= 0) & (tasas[columna] <= 100))
+            )
+        
+        mascaras = pd.DataFrame(problemas, index=df.index).fillna(False).astype(bool)
+        con_error = mascaras.any(axis=1)
+        marcados = mascaras[con_error].melt(ignore_index=False, var_name="Error")
+        marcados = marcados[marcados["value"]]
+        errores.append(pd.DataFrame({
+            "Fila": df.index[con_error] + 2,
+            "Codigo": df.loc[con_error, "Codigo"].to_numpy(),
+            "Error": marcados.groupby(level=0, sort=False)["Error"].agg("; ".join).reindex(df.index[con_error]).to_numpy()
+        }))
+        
+        ok = ~con_error
+        # Una fila (código, impuesto) por tasa informada
+        impuestos_por_fila = {}
+        for (indice, impuesto), porcentaje in tasas[ok].stack().dropna().items():
+            impuestos_por_fila.setdefault(indice, []).append((impuesto, float(porcentaje)))
+        
+        codigos = [
+            {"codigo": codigo, "descripcion": descripcion[:500], "impuestos": impuestos_por_fila.get(indice, [])}
+            for indice, codigo, descripcion in zip(df.index[ok], df.loc[ok, "Codigo"], df.loc[ok, "Descripcion"])
+        ]
+        vistos.update(codigo["codigo"] for codigo in codigos)
+        guardados += service.guardar_nomenclatura(codigos)
+    
+    errores = [e for e in errores if not e.empty]
+    if not errores:
+        return guardados, pd.DataFrame(columns=["Fila", "Codigo", "Error"])
+    return guardados, pd.concat(errores, ignore_index=True).sort_values("Fila", ignore_index=True)
@@ -0,0 +1,113 @@
+# conftest.py - Base de datos descartable y utilidades comunes de las pruebas
+from contextlib import contextmanager
+from datetime import date, timedelta
+import os
+import sys
+import tempfile
+
+# Las pruebas corren contra DATABASE_URL si está definida, por ejemplo
+#   DATABASE_URL=postgresql+psycopg://usuario@localhost/pruebas python -m pytest
+# y si no, contra un SQLite temporal. Cada prueba borra y recrea las tablas:
+# la base debe ser descartable. La URL se fija antes de importar models, que
+# crea el engine al importarse.
+_directorio_pruebas = tempfile.mkdtemp(prefix="comercio_pruebas_")
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(_directorio_pruebas, 'pruebas.db')}")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+from sqlalchemy import event
+
+import models
+from models import TipoContacto, TipoMovimiento, IncotermCompra, IncotermVenta
+
+@pytest.fixture
+def db():
+    """Sesión sobre una base recién creada, vacía en cada prueba"""
+    models.Base.metadata.drop_all(bind=models.engine)
+    models.Base.metadata.create_all(bind=models.engine)
+    # Las conexiones del pool guardan sentencias preparadas sobre las tablas anteriores
+    models.engine.dispose()
+    sesion = models.SessionLocal()
+    try:
+        yield sesion
+    finally:
+        sesion.rollback()
+        sesion.close()
+
+def sembrar_operaciones(db, cantidad: int) -> list:
+    """Carga contactos, capital inicial y `cantidad` operaciones con cronograma y movimientos"""
+    from database import ContactoService, OperacionService, MovimientoFinancieroService
+
+    hoy = date.today()
+    contactos = ContactoService(db)
+    proveedor = contactos.crear_contacto("Proveedor Prueba", TipoContacto.PROVEEDOR)
+    cliente = contactos.crear_contacto("Cliente Prueba", TipoContacto.CLIENTE)
+
+    movimientos = MovimientoFinancieroService(db)
+    movimientos.crear_movimiento(hoy - timedelta(days=120), TipoMovimiento.APORTE_INICIAL,
+                                 "Aporte inicial", monto_entrada=10_000_000)
+
+    operaciones = []
+    for i in range(cantidad):
+        valor_compra = 1000.0 + 100 * i
+        pagos = [
+            {"numero": 1, "descripcion": "Depósito Inicial", "porcentaje": 30.0,
+             "fecha": hoy - timedelta(days=30 - i % 20), "tipo": "pago"},
+            {"numero": 2, "descripcion": "Saldo Compra", "porcentaje": 70.0,
+             "fecha": hoy + timedelta(days=10 + i % 30), "tipo": "pago"},
+            {"numero": 3, "descripcion": "Cobro Final", "porcentaje": 100.0,
+             "fecha": hoy + timedelta(days=40 + i % 30), "tipo": "cobro"}
+        ]
+        operacion = OperacionService(db).crear_operacion(
+            proveedor.id, cliente.id, IncotermCompra.FOB, valor_compra,
+            IncotermVenta.CIF, valor_compra * 1.3, pagos_programados=pagos
+        )
+        movimientos.crear_movimiento(hoy - timedelta(days=20), TipoMovimiento.DEPOSITO_OPERACION,
+                                     f"Depósito operación {operacion.id}",
+                                     monto_salida=valor_compra * 0.3, operacion_id=operacion.id)
+        operaciones.append(operacion)
+    return operaciones
+
+@contextmanager
+def _contar_sentencias(db, maximo: int = None):
+    """Cuenta las sentencias SQL que la sesión ejecuta dentro del bloque.
+
+    Solo se cuentan las conexiones que la propia sesión toma del pool (la actual
+    y las de transacciones que empiece dentro del bloque), así que no se mezclan
+    sentencias de otros hilos que usen el mismo engine. Si se indica `maximo` y
+    el bloque lo supera, lanza AssertionError.
+    """
+    engine = db.get_bind()
+    conexiones = [db.connection()] if db.in_transaction() else []
+    conteo = {"sentencias": 0, "detalle": []}
+
+    def _al_iniciar(session, transaction, connection):
+        conexiones.append(connection)
+
+    def _registrar(conn, cursor, statement, parameters, context, executemany):
+        if any(conn is conexion for conexion in conexiones):
+            conteo["sentencias"] += 1
+            conteo["detalle"].append((statement, parameters))
+
+    event.listen(db, "after_begin", _al_iniciar)
+    event.listen(engine, "before_cursor_execute", _registrar)
+    try:
+        yield conteo
+    finally:
+        event.remove(engine, "before_cursor_execute", _registrar)
+        event.remove(db, "after_begin", _al_iniciar)
+
+    if maximo is not None and conteo["sentencias"] > maximo:
+        detalle = "\n".join(sentencia for sentencia, _ in conteo["detalle"])
+        raise AssertionError(
+            f"Se ejecutaron {conteo['sentencias']} sentencias SQL (máximo permitido: {maximo}):\n{detalle}"
+        )
+
+@pytest.fixture
+def contar_sentencias():
+    """Context manager que cuenta las sentencias de una sesión:
+
+        with contar_sentencias(db, maximo=3) as conteo:
+            MovimientoFinancieroService(db).calcular_saldo()
+    """
+    return _contar_sentencias
@@ -0,0 +1,54 @@
+# test_asignaciones.py - Reparto FIFO de los movimientos de operaciones entre sus pagos programados
+from datetime import date, timedelta
+
+from conftest import sembrar_operaciones
+from database import MovimientoFinancieroService
+from models import PagoProgramado, MovimientoFinanciero, EstadoPago, TipoPago, TipoMovimiento
+
+def _estados(db, operacion_id: int) -> list:
+    db.expire_all()
+    return [
+        pago.estado for pago in db.query(PagoProgramado).filter(
+            PagoProgramado.operacion_id == operacion_id,
+            PagoProgramado.tipo == TipoPago.PAGO
+        ).order_by(PagoProgramado.numero_pago)
+    ]
+
+def test_eliminar_movimiento_reaplica_los_otros_movimientos_a_los_pagos_liberados(db):
+    operacion_id = sembrar_operaciones(db, 1)[0].id
+    servicio = MovimientoFinancieroService(db)
+    deposito_inicial = db.query(MovimientoFinanciero).filter(MovimientoFinanciero.operacion_id == operacion_id).one()
+    primer_pago = db.query(PagoProgramado).filter(
+        PagoProgramado.operacion_id == operacion_id,
+        PagoProgramado.numero_pago == 1
+    ).one()
+
+    # Un segundo depósito que alcanza para el primer pago pero no para el saldo de compra
+    servicio.crear_movimiento(date.today() - timedelta(days=10), TipoMovimiento.DEPOSITO_OPERACION,
+                              "Depósito parcial", monto_salida=primer_pago.monto + 50, operacion_id=operacion_id)
+    assert _estados(db, operacion_id) == [EstadoPago.PAGADO, EstadoPago.PENDIENTE]
+
+    servicio.eliminar_movimiento(deposito_inicial.id)
+
+    # El depósito parcial pasa a cubrir el primer pago en orden FIFO
+    assert _estados(db, operacion_id) == [EstadoPago.PAGADO, EstadoPago.PENDIENTE]
+    db.expire_all()
+    assert primer_pago.fecha_real_pago == date.today() - timedelta(days=10)
+
+def test_eliminar_el_unico_movimiento_libera_sus_pagos(db):
+    operacion_id = sembrar_operaciones(db, 1)[0].id
+    movimiento_id = db.query(MovimientoFinanciero.id).filter(MovimientoFinanciero.operacion_id == operacion_id).scalar()
+    assert _estados(db, operacion_id) == [EstadoPago.PAGADO, EstadoPago.PENDIENTE]
+
+    MovimientoFinancieroService(db).eliminar_movimiento(movimiento_id)
+
+    assert _estados(db, operacion_id) == [EstadoPago.PENDIENTE, EstadoPago.PENDIENTE]
+
+def test_reconciliar_todas_las_operaciones_por_lotes(db):
+    operacion_ids = [operacion.id for operacion in sembrar_operaciones(db, 7)]
+    servicio = MovimientoFinancieroService(db)
+    esperado = {operacion_id: _estados(db, operacion_id) for operacion_id in operacion_ids}
+
+    servicio.reconciliar_estado_pagos(tamano_lote=3)
+
+    assert {operacion_id: _estados(db, operacion_id) for operacion_id in operacion_ids} == esperado
@@ -0,0 +1,30 @@
+# test_contactos.py - Uso de contactos en operaciones
+from database import ContactoService, OperacionService
+from models import IncotermCompra, IncotermVenta, Operacion, TipoContacto
+
+def test_uso_contactos_cuenta_una_vez_la_operacion_con_varios_roles(db):
+    contactos = ContactoService(db)
+    proveedor = contactos.crear_contacto("Proveedor y Flete", TipoContacto.PROVEEDOR)
+    cliente = contactos.crear_contacto("Cliente", TipoContacto.CLIENTE)
+    contactos.crear_contacto("Sin Operaciones", TipoContacto.AGENTE_LOGISTICO)
+    operaciones = OperacionService(db)
+    # El proveedor también hace de agente logístico en la primera operación
+    primera = operaciones.crear_operacion(proveedor.id, cliente.id, IncotermCompra.FOB, 1000.0,
+                                          IncotermVenta.CIF, 1500.0, agente_logistico_id=proveedor.id,
+                                          costo_flete=100.0)
+    segunda = operaciones.crear_operacion(proveedor.id, cliente.id, IncotermCompra.FOB, 2000.0,
+                                          IncotermVenta.CIF, 2600.0)
+    margenes = dict(db.query(Operacion.id, Operacion.margen_calculado))
+
+    uso = contactos.uso_contactos().set_index("Nombre")
+
+    assert uso.at["Proveedor y Flete", "Operaciones"] == 2
+    assert uso.at["Proveedor y Flete", "Volumen"] == 1000.0 + 100.0 + 2000.0
+    assert uso.at["Proveedor y Flete", "Margen"] == margenes[primera.id] + margenes[segunda.id]
+    assert uso.at["Cliente", "Operaciones"] == 2
+    assert uso.at["Cliente", "Volumen"] == 1500.0 + 2600.0
+    assert uso.at["Cliente", "Margen"] == uso.at["Proveedor y Flete", "Margen"]
+    assert (uso.at["Sin Operaciones", "Operaciones"], uso.at["Sin Operaciones", "Volumen"]) == (0, 0.0)
+
+    proveedores = contactos.uso_contactos(TipoContacto.PROVEEDOR)
+    assert proveedores["Nombre"].tolist() == ["Proveedor y Flete"]
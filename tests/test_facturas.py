@@ -0,0 +1,100 @@
+# test_facturas.py - Numeración de facturas y facturación en bloque
+import threading
+from datetime import date
+
+import models
+from conftest import sembrar_operaciones
+from database import FacturaService, OperacionService
+from models import Factura, Operacion, EstadoOperacion
+
+def test_reservar_numeros_es_consecutivo_por_serie(db):
+    servicio = FacturaService(db)
+
+    assert servicio.reservar_numeros("INV", 2026) == ["INV-2026-000001"]
+    assert servicio.reservar_numeros("INV", 2026, cantidad=2) == ["INV-2026-000002", "INV-2026-000003"]
+    assert servicio.reservar_numeros("INV", 2027) == ["INV-2027-000001"]
+    assert servicio.reservar_numeros("NC", 2026) == ["NC-2026-000001"]
+
+def test_reservar_numeros_continua_los_numeros_cargados_a_mano(db):
+    operacion = sembrar_operaciones(db, 1)[0]
+    db.add(Factura(numero="INV-2026-000041", fecha=date(2026, 1, 5), operacion_id=operacion.id,
+                   subtotal_fob=1.0, total_incoterm=1.0, moneda="USD"))
+    db.commit()
+
+    assert FacturaService(db).reservar_numeros("INV", 2026) == ["INV-2026-000042"]
+
+def test_reservar_numeros_libera_los_numeros_si_se_deshace(db):
+    servicio = FacturaService(db)
+    servicio.reservar_numeros("INV", 2026)
+    db.commit()
+
+    servicio.reservar_numeros("INV", 2026)
+    db.rollback()
+
+    assert servicio.reservar_numeros("INV", 2026) == ["INV-2026-000002"]
+
+def test_reservar_numeros_en_paralelo_no_repite(db):
+    numeros, errores = [], []
+
+    def facturar():
+        sesion = models.SessionLocal()
+        try:
+            for _ in range(5):
+                numeros.extend(FacturaService(sesion).reservar_numeros("INV", 2026))
+                sesion.commit()
+        except Exception as e:
+            errores.append(e)
+        finally:
+            sesion.close()
+
+    hilos = [threading.Thread(target=facturar) for _ in range(4)]
+    for hilo in hilos:
+        hilo.start()
+    for hilo in hilos:
+        hilo.join()
+
+    assert errores == []
+    assert sorted(numeros) == [f"INV-2026-{numero:06d}" for numero in range(1, 21)]
+
+def _preparar_facturables(db) -> list:
+    """Seis operaciones: canceladas, completadas, con HBL vencido o ya facturadas no son facturables"""
+    operacion_ids = [operacion.id for operacion in sembrar_operaciones(db, 6)]
+    operaciones = OperacionService(db)
+    operaciones.cambiar_estado(operacion_ids[0], EstadoOperacion.CANCELADA)
+    operaciones.cambiar_estado(operacion_ids[1], EstadoOperacion.COMPLETADA)
+    db.query(Operacion).filter(Operacion.id == operacion_ids[2]).update({"fecha_hbl": date(2026, 2, 15)})
+    db.query(Operacion).filter(Operacion.id == operacion_ids[3]).update({"fecha_hbl": date(2026, 4, 1)})
+    db.commit()
+    FacturaService(db).generar_factura(operacion_ids[4], fecha_factura=date(2026, 1, 10))
+    return operacion_ids
+
+def test_facturar_operaciones_solo_factura_las_elegibles_con_numeros_consecutivos(db):
+    operacion_ids = _preparar_facturables(db)
+    servicio = FacturaService(db)
+
+    assert servicio.contar_facturables(date(2026, 3, 1)) == 2
+    facturadas = servicio.facturar_operaciones(date(2026, 3, 1))
+
+    # La factura individual tomó el primer número; el bloque sigue la serie sin huecos
+    assert facturadas == [(operacion_ids[3], "INV-2026-000002"), (operacion_ids[5], "INV-2026-000003")]
+    db.expire_all()
+    assert dict(db.query(Factura.operacion_id, Factura.numero).all()) == {
+        operacion_ids[3]: "INV-2026-000002",
+        operacion_ids[4]: "INV-2026-000001",
+        operacion_ids[5]: "INV-2026-000003"
+    }
+    factura = db.query(Factura).filter(Factura.operacion_id == operacion_ids[5]).one()
+    operacion = db.get(Operacion, operacion_ids[5])
+    assert (factura.fecha, factura.subtotal_fob, factura.total_incoterm) == (
+        date(2026, 3, 1), operacion.valor_compra, operacion.precio_venta
+    )
+
+def test_facturar_operaciones_dos_veces_no_factura_de_nuevo(db):
+    _preparar_facturables(db)
+    servicio = FacturaService(db)
+    servicio.facturar_operaciones(date(2026, 3, 1))
+
+    assert servicio.contar_facturables(date(2026, 3, 1)) == 0
+    assert servicio.facturar_operaciones(date(2026, 3, 1)) == []
+    assert db.query(Factura).count() == 3
+    assert servicio.reservar_numeros("INV", 2026) == ["INV-2026-000004"]
@@ -0,0 +1,106 @@
+# test_hs_codes.py - Jerarquía, búsqueda por prefijo y carga de la nomenclatura arancelaria
+import io
+
+import pytest
+from sqlalchemy import select
+
+from database import HSCodeService, filtro_prefijo_hs, jerarquia_hs
+from models import HSCode, ImpuestoHS
+from plantilla_movimientos import importar_nomenclatura
+
+def _impuestos(db, codigo: str) -> list:
+    return sorted(
+        (nombre, porcentaje) for nombre, porcentaje in
+        db.query(ImpuestoHS.nombre, ImpuestoHS.porcentaje).join(HSCode).filter(HSCode.codigo == codigo)
+    )
+
+@pytest.mark.parametrize("codigo, esperado", [
+    ("8471.30.00", ("84713000", "84", "8471", "847130")),
+    ("84713000", ("84713000", "84", "8471", "847130")),
+    (" 0901 11 ", ("090111", "09", "0901", "090111")),
+    ("8471", ("8471", "84", "8471", None)),
+    ("84", ("84", "84", None, None)),
+    ("8", ("8", None, None, None)),
+    ("", (None, None, None, None)),
+    (None, (None, None, None, None)),
+])
+def test_jerarquia_hs_con_y_sin_puntos(codigo, esperado):
+    jerarquia = jerarquia_hs(codigo)
+
+    assert (jerarquia["codigo_normalizado"], jerarquia["capitulo"], jerarquia["partida"], jerarquia["subpartida"]) == esperado
+
+@pytest.fixture
+def codigos(db):
+    HSCodeService(db).guardar_nomenclatura([
+        {"codigo": codigo, "descripcion": f"Producto {codigo}", "impuestos": []}
+        for codigo in ["8471.30.00", "847141", "8472.10", "8479.89", "0901.11", "9401"]
+    ])
+
+@pytest.mark.parametrize("prefijo, esperados", [
+    ("8471", ["8471.30.00", "847141"]),
+    ("8471.3", ["8471.30.00"]),
+    ("84", ["8471.30.00", "847141", "8472.10", "8479.89"]),
+    ("847", ["8471.30.00", "847141", "8472.10", "8479.89"]),
+    ("09", ["0901.11"]),
+    ("9", ["9401"]),
+    ("85", []),
+])
+def test_filtro_prefijo_hs(db, codigos, prefijo, esperados):
+    digitos = jerarquia_hs(prefijo)["codigo_normalizado"]
+    consulta = select(HSCode.codigo).where(filtro_prefijo_hs(HSCode.codigo_normalizado, digitos)).order_by(HSCode.codigo)
+    servicio = HSCodeService(db)
+
+    assert db.execute(consulta).scalars().all() == sorted(esperados)
+    assert servicio.contar_hs_codes(prefijo) == len(esperados)
+    assert servicio.pagina_hs_codes(prefijo)[0]["Código"].tolist() == sorted(esperados)
+
+def test_guardar_nomenclatura_reemplaza_los_impuestos_de_los_codigos_existentes(db):
+    servicio = HSCodeService(db)
+    servicio.guardar_nomenclatura([
+        {"codigo": "8471.30.00", "descripcion": "Computadoras", "impuestos": [("DIE", 16.0), ("IVA", 21.0)]},
+        {"codigo": "0901.11", "descripcion": "Café", "impuestos": [("DIE", 10.0)]}
+    ])
+    hs_id = db.query(HSCode.id).filter(HSCode.codigo == "8471.30.00").scalar()
+
+    assert servicio.guardar_nomenclatura([
+        {"codigo": "8471.30.00", "descripcion": "Computadoras portátiles", "impuestos": [("IVA", 10.5)]}
+    ]) == 1
+
+    db.expire_all()
+    hs_code = db.query(HSCode).filter(HSCode.codigo == "8471.30.00").one()
+    assert (hs_code.id, hs_code.descripcion, hs_code.partida) == (hs_id, "Computadoras portátiles", "8471")
+    assert _impuestos(db, "8471.30.00") == [("IVA", 10.5)]
+    assert _impuestos(db, "0901.11") == [("DIE", 10.0)]
+    assert db.query(HSCode).count() == 2
+
+    # Sin impuestos en el archivo, el código queda sin impuestos
+    servicio.guardar_nomenclatura([{"codigo": "8471.30.00", "descripcion": "Computadoras", "impuestos": []}])
+    assert _impuestos(db, "8471.30.00") == []
+
+def test_importar_nomenclatura_informa_filas_repetidas_e_invalidas(db):
+    archivo = io.StringIO(
+        "Codigo,Descripcion,DIE,IVA\n"
+        "8471.30.00,Computadoras portátiles,16,21\n"   # Fila 2
+        "0901.11,Café sin tostar,,10.5\n"              # Fila 3
+        "8471.30.00,Repetida en otro lote,5,5\n"       # Fila 4
+        "A,Sin dígitos,,\n"                            # Fila 5
+        "8472.10,,,\n"                                 # Fila 6
+        "8479.89,Tasa fuera de rango,150,abc\n"        # Fila 7
+        "9401,Asientos,0,\n"                           # Fila 8
+        ",,,\n"                                        # Fila vacía: se ignora
+    )
+
+    guardados, errores = importar_nomenclatura(db, archivo, "nomenclatura.csv", tamano_lote=2)
+
+    assert guardados == 3
+    assert errores.to_dict("records") == [
+        {"Fila": 4, "Codigo": "8471.30.00", "Error": "Código repetido en el archivo"},
+        {"Fila": 5, "Codigo": "A", "Error": "El código debe tener al menos 2 dígitos"},
+        {"Fila": 6, "Codigo": "8472.10", "Error": "Falta Descripcion"},
+        {"Fila": 7, "Codigo": "8479.89",
+         "Error": "DIE debe ser un porcentaje entre 0 y 100; IVA debe ser un porcentaje entre 0 y 100"}
+    ]
+    assert _impuestos(db, "8471.30.00") == [("DIE", 16.0), ("IVA", 21.0)]
+    assert _impuestos(db, "0901.11") == [("IVA", 10.5)]
+    assert _impuestos(db, "9401") == [("DIE", 0.0)]
+    assert db.query(HSCode.descripcion).filter(HSCode.codigo == "8471.30.00").scalar() == "Computadoras portátiles"
@@ -0,0 +1,210 @@
+# test_importacion.py - Importación de extractos bancarios y de la plantilla de operaciones
+from datetime import date, timedelta
+import io
+
+import pandas as pd
+import pytest
+
+import database
+from conftest import sembrar_operaciones
+from database import ContactoService, MovimientoFinancieroService, OperacionService
+from models import Factura, MovimientoFinanciero, Operacion, PagoProgramado, TipoContacto, TipoMovimiento, TipoPago
+from plantilla_movimientos import (
+    COLUMNAS_PLANTILLA, construir_operaciones, importar_plantilla, indice_contactos, validar_plantilla,
+    _normalizar_lote
+)
+
+def _extracto(*lineas) -> pd.DataFrame:
+    """DataFrame en el formato de importar_movimientos a partir de (fecha, tipo, entrada, salida, operacion_id)"""
+    return pd.DataFrame([
+        {"fecha": fecha, "tipo": tipo, "descripcion": f"Línea {i}", "monto_entrada": entrada,
+         "monto_salida": salida, "referencia": f"REF{i}", "operacion_id": operacion_id}
+        for i, (fecha, tipo, entrada, salida, operacion_id) in enumerate(lineas)
+    ])
+
+def test_saldo_se_valida_en_la_fecha_del_extracto(db):
+    sembrar_operaciones(db, 1)  # Aporte inicial hace 120 días
+    servicio = MovimientoFinancieroService(db)
+    hace_200_dias = date.today() - timedelta(days=200)
+
+    with pytest.raises(ValueError, match="Saldo insuficiente"):
+        servicio.importar_movimientos(_extracto((hace_200_dias, TipoMovimiento.RETIRO, 0.0, 100.0, None)))
+
+    resultado = servicio.importar_movimientos(_extracto(
+        (hace_200_dias, TipoMovimiento.ADELANTO, 500.0, 0.0, None),
+        (hace_200_dias + timedelta(days=1), TipoMovimiento.RETIRO, 0.0, 400.0, None)
+    ))
+    assert resultado["importados"] == 2
+
+def test_saldo_considera_los_movimientos_registrados_dentro_del_extracto(db):
+    sembrar_operaciones(db, 1)
+    servicio = MovimientoFinancieroService(db)
+    hace_150_dias = date.today() - timedelta(days=150)
+
+    # El retiro cae después del aporte inicial ya registrado, que lo cubre
+    resultado = servicio.importar_movimientos(_extracto(
+        (hace_150_dias, TipoMovimiento.ADELANTO, 10.0, 0.0, None),
+        (date.today() - timedelta(days=100), TipoMovimiento.RETIRO, 0.0, 1000.0, None)
+    ))
+    assert resultado["importados"] == 2
+
+def test_saldo_considera_los_movimientos_registrados_despues_del_extracto(db):
+    servicio = MovimientoFinancieroService(db)
+    hoy = date.today()
+    servicio.crear_movimiento(hoy - timedelta(days=100), TipoMovimiento.ADELANTO, "Adelanto", monto_entrada=1000.0)
+    servicio.crear_movimiento(hoy - timedelta(days=10), TipoMovimiento.RETIRO, "Retiro", monto_salida=800.0)
+
+    # El retiro del extracto tiene fondos en su fecha, pero deja sin fondos al retiro ya registrado
+    with pytest.raises(ValueError, match=f"-100.00 el {(hoy - timedelta(days=10)).strftime('%d/%m/%Y')}"):
+        servicio.importar_movimientos(_extracto((hoy - timedelta(days=50), TipoMovimiento.RETIRO, 0.0, 300.0, None)))
+
+    resultado = servicio.importar_movimientos(_extracto(
+        (hoy - timedelta(days=50), TipoMovimiento.RETIRO, 0.0, 200.0, None)
+    ))
+    assert resultado["importados"] == 1
+    assert servicio.obtener_saldo_actual() == 0.0
+
+@pytest.mark.parametrize("falla", ["segundo lote", "reconciliación"])
+def test_importacion_fallida_no_guarda_ningun_lote(db, monkeypatch, falla):
+    operacion_id = sembrar_operaciones(db, 1)[0].id
+    servicio = MovimientoFinancieroService(db)
+    saldo_antes = servicio.obtener_saldo_actual()
+    estados_antes = sorted(db.query(PagoProgramado.id, PagoProgramado.estado))
+    aplicar_a_acumulados = servicio.aplicar_a_acumulados
+    reconciliar_estado_pagos = servicio.reconciliar_estado_pagos
+    lotes = []
+
+    def fallar_en_el_segundo_lote(movimientos, signo=1):
+        lotes.append(movimientos)
+        if falla == "segundo lote" and len(lotes) == 2:
+            raise RuntimeError("fallo del segundo lote")
+        return aplicar_a_acumulados(movimientos, signo)
+
+    def fallar_reconciliacion(*args, **kwargs):
+        if falla == "reconciliación":
+            raise RuntimeError("fallo de reconciliación")
+        return reconciliar_estado_pagos(*args, **kwargs)
+
+    monkeypatch.setattr(servicio, "aplicar_a_acumulados", fallar_en_el_segundo_lote)
+    monkeypatch.setattr(servicio, "reconciliar_estado_pagos", fallar_reconciliacion)
+    hace_10_dias = date.today() - timedelta(days=10)
+    extracto = _extracto(
+        (hace_10_dias, TipoMovimiento.DEPOSITO_OPERACION, 0.0, 10.0, operacion_id),
+        (hace_10_dias, TipoMovimiento.DEPOSITO_OPERACION, 0.0, 20.0, operacion_id)
+    )
+
+    with pytest.raises(RuntimeError, match=f"fallo de(l)? {falla}"):
+        servicio.importar_movimientos(extracto, tamano_lote=1)
+
+    # Ni los movimientos ni sus acumulados ni los estados de pago quedan a medias
+    assert db.query(MovimientoFinanciero).filter(MovimientoFinanciero.hash_importacion.isnot(None)).count() == 0
+    assert servicio.obtener_saldo_actual() == saldo_antes
+    assert sorted(db.query(PagoProgramado.id, PagoProgramado.estado)) == estados_antes
+
+    # El mismo extracto se puede volver a importar completo
+    monkeypatch.undo()
+    assert servicio.importar_movimientos(extracto, tamano_lote=1)["importados"] == 2
+
+def _plantilla(*filas) -> pd.DataFrame:
+    """Plantilla de operaciones con valores por defecto para las columnas no indicadas"""
+    base = {"Fecha": "2025-01-15", "Proveedor": "Proveedor Uno", "Cliente": "Cliente Uno",
+            "Valor_Compra_FOB": "1000", "Valor_Venta": "1500"}
+    return pd.DataFrame([{**base, **fila} for fila in filas]).reindex(columns=COLUMNAS_PLANTILLA)
+
+def _csv(df: pd.DataFrame) -> io.StringIO:
+    return io.StringIO(df.to_csv(index=False))
+
+@pytest.fixture
+def contactos(db):
+    servicio = ContactoService(db)
+    servicio.crear_contacto("Proveedor Uno", TipoContacto.PROVEEDOR)
+    servicio.crear_contacto("Cliente Uno", TipoContacto.CLIENTE)
+    return indice_contactos(db)
+
+def test_validar_plantilla_informa_los_errores_de_cada_fila(db, contactos):
+    proveedores, clientes = contactos
+    df = _normalizar_lote(_plantilla(
+        {"Factura": "F-1"},
+        {"Factura": "F-2", "Cliente": "Cliente Desconocido"},
+        {"Factura": "F-3", "Fecha": "2025-13-45", "Fecha_Deposito": "mañana"},
+        {"Factura": "F-1"},
+        {"Factura": "F-9"},
+        {"Factura": "F-4", "Proveedor": " proveedor uno ", "Cliente": "CLIENTE UNO"}
+    ))
+
+    validas, errores = validar_plantilla(df, proveedores, clientes, {"F-9"})
+
+    assert validas["factura"].tolist() == ["F-1", "F-4"]
+    assert validas["fila"].tolist() == [2, 7]
+    assert errores.to_dict("records") == [
+        {"Fila": 3, "Factura": "F-2", "Error": "Cliente no encontrado"},
+        {"Fila": 4, "Factura": "F-3", "Error": "Fecha inválida; Fecha_Deposito inválida"},
+        {"Fila": 5, "Factura": "F-1", "Error": "Factura repetida en el archivo"},
+        {"Fila": 6, "Factura": "F-9", "Error": "La factura ya está registrada"}
+    ]
+
+def test_importar_plantilla_expande_las_cuotas_en_pagos_programados(db, contactos):
+    importadas, errores = importar_plantilla(db, _csv(_plantilla(
+        {"Factura": "F-1", "Porcentaje_Deposito": "40", "Fecha_Deposito": "2025-01-20",
+         "Fecha_Pago_Saldo": "2025-02-20", "Numero_Cuotas": "3",
+         "Fechas_Cuotas": "2025-03-01; 2025-04-01;2025-05-01"},
+        {"Factura": "F-2", "Porcentaje_Deposito": "100", "Fecha_Pago_Saldo": "2025-02-10"}
+    )), "operaciones.csv")
+
+    assert (importadas, errores.empty) == (2, True)
+    pagos = {}
+    for factura, numero, tipo, porcentaje, monto, fecha in db.query(
+        Factura.numero, PagoProgramado.numero_pago, PagoProgramado.tipo, PagoProgramado.porcentaje,
+        PagoProgramado.monto, PagoProgramado.fecha_programada
+    ).join(PagoProgramado, PagoProgramado.operacion_id == Factura.operacion_id).order_by(PagoProgramado.numero_pago):
+        pagos.setdefault(factura, []).append((numero, tipo, porcentaje, round(monto, 2), fecha))
+
+    assert pagos["F-1"] == [
+        (1, TipoPago.PAGO, 40.0, 400.0, date(2025, 1, 20)),
+        (2, TipoPago.PAGO, 60.0, 600.0, date(2025, 2, 20)),
+        (3, TipoPago.COBRO, 33.33, 499.95, date(2025, 3, 1)),
+        (4, TipoPago.COBRO, 33.33, 499.95, date(2025, 4, 1)),
+        (5, TipoPago.COBRO, 33.34, 500.1, date(2025, 5, 1))
+    ]
+    # Depósito total y un único cobro en la fecha del saldo
+    assert pagos["F-2"] == [
+        (1, TipoPago.PAGO, 100.0, 1000.0, date(2025, 1, 15)),
+        (2, TipoPago.COBRO, 100.0, 1500.0, date(2025, 2, 10))
+    ]
+
+def test_importar_operaciones_aisla_la_fila_que_rompe_el_lote(db, contactos):
+    proveedores, clientes = contactos
+    validas, _ = validar_plantilla(
+        _normalizar_lote(_plantilla({"Factura": "F-1"}, {"Factura": "F-2"}, {"Factura": "F-3"})),
+        proveedores, clientes
+    )
+    operaciones = construir_operaciones(validas)
+    operaciones[1]["operacion"]["proveedor_id"] = 999_999  # Viola la clave foránea al insertar
+
+    importadas, fallidas = OperacionService(db).importar_operaciones(operaciones)
+
+    assert importadas == 2
+    assert [fila for fila, _ in fallidas] == [3]
+    assert sorted(numero for (numero,) in db.query(Factura.numero)) == ["F-1", "F-3"]
+    assert db.query(Operacion).count() == 2
+
+def test_factura_de_una_fila_fallida_no_bloquea_los_lotes_siguientes(db, contactos, monkeypatch):
+    importar_operaciones = OperacionService.importar_operaciones
+    llamadas = []
+
+    def fallar_el_primer_lote(self, operaciones):
+        llamadas.append(operaciones)
+        if len(llamadas) == 1:
+            return 0, [(op["fila"], "fallo al guardar") for op in operaciones]
+        return importar_operaciones(self, operaciones)
+
+    monkeypatch.setattr(database.OperacionService, "importar_operaciones", fallar_el_primer_lote)
+
+    # La misma factura en dos lotes: la segunda fila se guarda porque la primera no llegó a la base
+    importadas, errores = importar_plantilla(db, _csv(_plantilla(
+        {"Factura": "F-1"}, {"Factura": "F-1", "Valor_Venta": "1600"}, {"Factura": "F-2"}
+    )), "operaciones.csv", tamano_lote=1)
+
+    assert importadas == 2
+    assert errores.to_dict("records") == [{"Fila": 2, "Factura": "F-1", "Error": "fallo al guardar"}]
+    assert db.query(Operacion.precio_venta).join(Factura).filter(Factura.numero == "F-1").scalar() == 1600.0
@@ -0,0 +1,106 @@
+# test_margenes.py - Análisis de márgenes agrupado en la base contra un cálculo de referencia
+from datetime import date, datetime
+
+import pandas as pd
+import pytest
+
+from database import ContactoService, HSCodeService, OperacionService, DIMENSIONES_MARGEN
+from models import EstadoOperacion, IncotermCompra, IncotermVenta, Operacion, TipoContacto
+
+@pytest.fixture
+def operaciones(db):
+    """Operaciones repartidas entre contactos, códigos HS, incoterms, orígenes y meses; una cancelada"""
+    contactos = ContactoService(db)
+    proveedores = [contactos.crear_contacto(f"Proveedor {i}", TipoContacto.PROVEEDOR).id for i in range(2)]
+    clientes = [contactos.crear_contacto(f"Cliente {i}", TipoContacto.CLIENTE).id for i in range(2)]
+    hs_codes = [HSCodeService(db).crear_hs_code(codigo, "Producto").id
+                for codigo in ["8471.30.00", "8471.41", "0901.11"]] + [None]
+    incoterms = [(IncotermCompra.FOB, IncotermVenta.CIF), (IncotermCompra.EXW, IncotermVenta.DAP),
+                 (IncotermCompra.FOB, IncotermVenta.FOB)]
+    fechas = [datetime(2025, 1, 10, 9, 0), datetime(2025, 1, 31, 23, 59), datetime(2025, 2, 1, 0, 0),
+              datetime(2025, 3, 15, 12, 0)]
+
+    servicio = OperacionService(db)
+    for i in range(12):
+        compra, venta = incoterms[i % 3]
+        operacion = servicio.crear_operacion(
+            proveedores[i % 2], clientes[i // 6], compra, 1000.0 + 250 * i, venta, 1400.0 + 330 * i,
+            hs_code_id=hs_codes[i % 4], costo_flete=10.0 * i,
+            origen_bienes=[None, "China", "Brasil"][i % 3]
+        )
+        db.query(Operacion).filter(Operacion.id == operacion.id).update({"fecha_creacion": fechas[i % 4]})
+    db.commit()
+    servicio.cambiar_estado(operacion.id, EstadoOperacion.CANCELADA)
+
+def _referencia(db, agrupar_por: str, fecha_desde: date = None, fecha_hasta: date = None) -> dict:
+    """Métricas por grupo calculadas en Python sobre los objetos de las operaciones activas"""
+    filas = []
+    for op in db.query(Operacion).filter(Operacion.estado == EstadoOperacion.ACTIVA):
+        if fecha_desde and op.fecha_creacion.date() < fecha_desde:
+            continue
+        if fecha_hasta and op.fecha_creacion.date() > fecha_hasta:
+            continue
+        clave = {
+            "cliente": op.cliente.nombre,
+            "proveedor": op.proveedor.nombre,
+            "hs_code": op.hs_code.codigo if op.hs_code else None,
+            "capitulo_hs": op.hs_code.capitulo if op.hs_code else None,
+            "partida_hs": op.hs_code.partida if op.hs_code else None,
+            "incoterms": f"{op.incoterm_compra.value} → {op.incoterm_venta.value}",
+            "origen": op.origen_bienes,
+            "mes": op.fecha_creacion.strftime("%Y-%m")
+        }[agrupar_por]
+        filas.append({"clave": clave or "Sin datos", "compras": op.valor_compra, "ventas": op.precio_venta,
+                      "margen": op.margen_calculado, "margen_porcentaje": op.margen_porcentaje})
+    df = pd.DataFrame(filas)
+    return {
+        clave: (len(grupo), grupo["compras"].sum(), grupo["ventas"].sum(), grupo["margen"].sum(),
+                grupo["margen_porcentaje"].mean(), grupo["margen"].sum() * 100 / grupo["ventas"].sum())
+        for clave, grupo in df.groupby("clave")
+    }
+
+def _comparar(resultado: dict, referencia: dict):
+    assert resultado.keys() == referencia.keys()
+    for clave, metricas in referencia.items():
+        assert resultado[clave] == pytest.approx(metricas), clave
+
+def _resultado(df: pd.DataFrame) -> dict:
+    return {
+        fila.iloc[0]: (fila["Operaciones"], fila["Compras"], fila["Ventas"], fila["Margen"],
+                       fila["Margen % Promedio"], fila["Margen % Ponderado"])
+        for _, fila in df.iterrows()
+    }
+
+@pytest.mark.parametrize("agrupar_por", list(DIMENSIONES_MARGEN))
+def test_analizar_margenes_por_dimension(db, operaciones, agrupar_por):
+    df = OperacionService(db).analizar_margenes(agrupar_por)
+
+    assert df.columns[0] == DIMENSIONES_MARGEN[agrupar_por]
+    _comparar(_resultado(df), _referencia(db, agrupar_por))
+    if agrupar_por == "mes":
+        assert df["Mes"].tolist() == ["2025-01", "2025-02", "2025-03"]
+    else:
+        assert df["Margen"].is_monotonic_decreasing
+
+@pytest.mark.parametrize("agrupar_por", ["mes", "cliente"])
+def test_analizar_margenes_filtra_por_fecha_incluyendo_el_ultimo_dia(db, operaciones, agrupar_por):
+    desde, hasta = date(2025, 1, 15), date(2025, 1, 31)
+
+    df = OperacionService(db).analizar_margenes(agrupar_por, fecha_desde=desde, fecha_hasta=hasta)
+
+    # Solo entran las operaciones del 31/01 a las 23:59
+    _comparar(_resultado(df), _referencia(db, agrupar_por, desde, hasta))
+    assert df["Operaciones"].sum() == 3
+
+def test_analizar_margenes_sin_agrupar_devuelve_el_total(db, operaciones):
+    df = OperacionService(db).analizar_margenes()
+
+    activas = db.query(Operacion).filter(Operacion.estado == EstadoOperacion.ACTIVA).all()
+    assert len(df) == 1
+    assert df.at[0, "Operaciones"] == len(activas) == 11
+    assert df.at[0, "Margen"] == pytest.approx(sum(op.margen_calculado for op in activas))
+    assert OperacionService(db).analizar_margenes(solo_activas=False).at[0, "Operaciones"] == 12
+
+def test_analizar_margenes_rechaza_dimensiones_desconocidas(db):
+    with pytest.raises(ValueError, match="Dimensión no válida"):
+        OperacionService(db).analizar_margenes("color")
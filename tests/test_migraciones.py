@@ -0,0 +1,79 @@
+# test_migraciones.py - Migraciones sobre una base con el esquema anterior a las reglas ON DELETE
+import pytest
+from sqlalchemy import MetaData, insert, inspect
+from sqlalchemy.exc import IntegrityError
+
+import models
+from conftest import sembrar_operaciones
+from database import OperacionService
+from migraciones import MIGRACIONES, ejecutar_migraciones, _tablas_con_claves_desactualizadas
+from models import Contacto, HSCode, PagoProgramado, MovimientoFinanciero, VersionEsquema
+
+def _esquema_sin_reglas_on_delete() -> MetaData:
+    """Copia del esquema actual con las FOREIGN KEY sin ON DELETE, como en las bases viejas"""
+    copia = MetaData()
+    for tabla in models.Base.metadata.sorted_tables:
+        tabla.to_metadata(copia)
+    for tabla in copia.sorted_tables:
+        for clave in tabla.foreign_key_constraints:
+            clave.ondelete = None
+            for elemento in clave.elements:
+                elemento.ondelete = None
+    return copia
+
+@pytest.fixture
+def db_anterior(db):
+    """Base con claves foráneas sin reglas, datos cargados y ninguna migración registrada"""
+    models.Base.metadata.drop_all(bind=models.engine)
+    _esquema_sin_reglas_on_delete().create_all(bind=models.engine)
+    models.engine.dispose()
+
+    operacion_ids = [operacion.id for operacion in sembrar_operaciones(db, 3)]
+    db.execute(insert(HSCode).values(codigo="8471.30.00", descripcion="Computadoras portátiles"))
+    assert _tablas_con_claves_desactualizadas(db)
+    # Sin transacción abierta: en PostgreSQL ALTER TABLE esperaría los bloqueos de esta sesión
+    db.commit()
+    return db, operacion_ids
+
+def test_ejecutar_migraciones_actualiza_una_base_anterior(db_anterior):
+    db, operacion_ids = db_anterior
+
+    aplicadas = ejecutar_migraciones(forzar=True)
+
+    assert aplicadas == [nombre for _, nombre, _ in MIGRACIONES]
+    assert {version for (version,) in db.query(VersionEsquema.version)} == {version for version, _, _ in MIGRACIONES}
+    assert _tablas_con_claves_desactualizadas(db) == []
+
+    hs_code = db.query(HSCode).one()
+    assert (hs_code.codigo_normalizado, hs_code.capitulo, hs_code.partida, hs_code.subpartida) == \
+        ("84713000", "84", "8471", "847130")
+
+def test_claves_migradas_borran_en_cascada_y_restringen(db_anterior):
+    db, operacion_ids = db_anterior
+    ejecutar_migraciones(forzar=True)
+
+    OperacionService(db).eliminar_operacion(operacion_ids[0])
+    assert db.query(PagoProgramado).filter(PagoProgramado.operacion_id == operacion_ids[0]).count() == 0
+    assert db.query(MovimientoFinanciero).filter(MovimientoFinanciero.operacion_id == operacion_ids[0]).count() == 0
+
+    # Los contactos con operaciones no se pueden borrar (ON DELETE RESTRICT)
+    with pytest.raises(IntegrityError):
+        db.query(Contacto).delete(synchronize_session=False)
+        db.flush()
+    db.rollback()
+
+def test_ejecutar_migraciones_no_repite_las_aplicadas(db_anterior):
+    ejecutar_migraciones(forzar=True)
+
+    assert ejecutar_migraciones(forzar=True) == []
+
+def test_migrar_claves_foraneas_no_altera_el_esquema_del_modelo(db_anterior):
+    ejecutar_migraciones(forzar=True)
+
+    # Una base creada después con create_all conserva sus claves foráneas
+    models.Base.metadata.drop_all(bind=models.engine)
+    models.Base.metadata.create_all(bind=models.engine)
+    claves = inspect(models.engine).get_foreign_keys("movimientos_financieros")
+    assert {(clave["referred_table"], clave["options"].get("ondelete")) for clave in claves} == {
+        ("operaciones", "CASCADE"), ("pagos_programados", "SET NULL")
+    }
@@ -0,0 +1,36 @@
+# test_operaciones.py - Consultas agregadas de operaciones
+import models
+from conftest import sembrar_operaciones
+from database import OperacionService
+from models import EstadoOperacion, EstadoPago, PagoProgramado
+
+def test_contar_por_estado_e_ids_operaciones(db, contar_sentencias):
+    operacion_ids = [operacion.id for operacion in sembrar_operaciones(db, 5)]
+    servicio = OperacionService(db)
+    servicio.cambiar_estado(operacion_ids[0], EstadoOperacion.CANCELADA)
+    servicio.cambiar_estado(operacion_ids[3], EstadoOperacion.CANCELADA)
+    servicio.cambiar_estado(operacion_ids[4], EstadoOperacion.COMPLETADA)
+
+    with contar_sentencias(db, maximo=1):
+        conteo = servicio.contar_por_estado()
+
+    assert conteo == {EstadoOperacion.ACTIVA: 2, EstadoOperacion.CANCELADA: 2, EstadoOperacion.COMPLETADA: 1}
+    assert servicio.ids_operaciones(EstadoOperacion.CANCELADA) == [operacion_ids[0], operacion_ids[3]]
+    assert servicio.ids_operaciones() == operacion_ids
+
+def test_actualizar_costos_recalcula_y_confirma_los_pagos(db):
+    operacion_id = sembrar_operaciones(db, 1)[0].id  # El depósito cubre justo el primer pago
+
+    OperacionService(db).actualizar_costos(operacion_id, costo_flete=100.0)
+
+    # Otra sesión ve los cambios: actualizar_costos confirma su propia transacción
+    otra = models.SessionLocal()
+    try:
+        monto, estado = otra.query(PagoProgramado.monto, PagoProgramado.estado).filter(
+            PagoProgramado.operacion_id == operacion_id,
+            PagoProgramado.numero_pago == 1
+        ).one()
+    finally:
+        otra.close()
+    assert monto == 330.0
+    assert estado == EstadoPago.PENDIENTE
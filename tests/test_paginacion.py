@@ -0,0 +1,83 @@
+# test_paginacion.py - Paginación por keyset de operaciones y movimientos
+from datetime import date, datetime, timedelta
+
+import pytest
+
+from conftest import sembrar_operaciones
+from database import MovimientoFinancieroService, OperacionService
+from models import EstadoOperacion, MovimientoFinanciero, Operacion, TipoMovimiento
+
+def _recorrer(pagina, tamano: int, **filtros) -> list:
+    """IDs de todas las páginas, siguiendo el cursor hasta la última"""
+    ids, cursor, paginas = [], None, 0
+    while True:
+        df, cursor = pagina(despues_de=cursor, tamano=tamano, **filtros)
+        assert len(df) <= tamano
+        ids.extend(int(i) for i in df["ID"])
+        paginas += 1
+        if cursor is None:
+            return ids
+        assert paginas < 100, "La paginación no termina"
+
+@pytest.fixture
+def operaciones_empatadas(db):
+    """Once operaciones en tres grupos con la misma fecha de creación; la mitad canceladas"""
+    operacion_ids = [operacion.id for operacion in sembrar_operaciones(db, 11)]
+    fechas = [datetime(2026, 1, 5, 10, 30, 0, 123456), datetime(2026, 2, 1, 8, 0), datetime(2026, 3, 1, 9, 15, 30, 5)]
+    for i, operacion_id in enumerate(operacion_ids):
+        db.query(Operacion).filter(Operacion.id == operacion_id).update({
+            "fecha_creacion": fechas[i % 3],
+            "estado": EstadoOperacion.CANCELADA if i % 2 else EstadoOperacion.ACTIVA
+        })
+    db.commit()
+    return operacion_ids
+
+def _orden_operaciones(db, estado=None) -> list:
+    filas = db.query(Operacion.fecha_creacion, Operacion.id, Operacion.estado).all()
+    return [op_id for fecha, op_id, op_estado in sorted(filas, reverse=True) if estado in (None, op_estado)]
+
+@pytest.mark.parametrize("tamano", [1, 3, 4, 11, 20])
+def test_pagina_operaciones_recorre_todo_sin_huecos_ni_repetidos(db, operaciones_empatadas, tamano):
+    ids = _recorrer(OperacionService(db).pagina_operaciones, tamano)
+
+    assert ids == _orden_operaciones(db)
+    assert sorted(ids) == sorted(operaciones_empatadas)
+
+@pytest.mark.parametrize("estado", [EstadoOperacion.ACTIVA, EstadoOperacion.CANCELADA, EstadoOperacion.COMPLETADA])
+def test_pagina_operaciones_filtrada_por_estado(db, operaciones_empatadas, estado):
+    ids = _recorrer(OperacionService(db).pagina_operaciones, 2, estado=estado)
+
+    assert ids == _orden_operaciones(db, estado)
+
+def _orden_movimientos(db, fecha_desde=None, fecha_hasta=None) -> list:
+    filas = db.query(MovimientoFinanciero.fecha, MovimientoFinanciero.id).all()
+    return [
+        mov_id for fecha, mov_id in sorted(filas, reverse=True)
+        if (fecha_desde is None or fecha >= fecha_desde) and (fecha_hasta is None or fecha <= fecha_hasta)
+    ]
+
+@pytest.mark.parametrize("tamano", [1, 3, 4, 20])
+def test_pagina_movimientos_recorre_todo_con_fechas_empatadas(db, tamano):
+    # Los depósitos de todas las operaciones caen el mismo día
+    sembrar_operaciones(db, 9)
+
+    ids = _recorrer(MovimientoFinancieroService(db).pagina_movimientos, tamano)
+
+    assert ids == _orden_movimientos(db)
+    assert len(set(ids)) == db.query(MovimientoFinanciero).count() == 10
+
+def test_pagina_movimientos_filtrada_por_fechas(db):
+    sembrar_operaciones(db, 9)
+    hoy = date.today()
+    servicio = MovimientoFinancieroService(db)
+    servicio.crear_movimiento(hoy - timedelta(days=5), TipoMovimiento.RETIRO, "Retiro", monto_salida=10.0)
+
+    desde = _recorrer(servicio.pagina_movimientos, 4, fecha_desde=hoy - timedelta(days=30))
+    hasta = _recorrer(servicio.pagina_movimientos, 4, fecha_hasta=hoy - timedelta(days=10))
+    rango = _recorrer(servicio.pagina_movimientos, 2, fecha_desde=hoy - timedelta(days=20),
+                      fecha_hasta=hoy - timedelta(days=20))
+
+    assert desde == _orden_movimientos(db, fecha_desde=hoy - timedelta(days=30))
+    assert hasta == _orden_movimientos(db, fecha_hasta=hoy - timedelta(days=10))
+    assert rango == _orden_movimientos(db, hoy - timedelta(days=20), hoy - timedelta(days=20))
+    assert len(desde) == 10 and len(hasta) == 10 and len(rango) == 9
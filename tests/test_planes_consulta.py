@@ -0,0 +1,65 @@
+# test_planes_consulta.py - Las consultas de los servicios usan los índices declarados en los modelos
+from datetime import date, timedelta
+
+import pytest
+
+from conftest import sembrar_operaciones
+from database import OperacionService, MovimientoFinancieroService, FacturaService
+from models import EstadoOperacion, MovimientoFinanciero
+
+def _plan(conexion, sentencia: str, parametros) -> list:
+    """Pasos del plan de una sentencia y los que recorren una tabla completa"""
+    if conexion.dialect.name == "sqlite":
+        plan = [fila[-1] for fila in conexion.exec_driver_sql(f"EXPLAIN QUERY PLAN {sentencia}", parametros)]
+        escaneos = [paso for paso in plan if paso.startswith("SCAN") and "USING" not in paso]
+    else:
+        plan = [fila[0] for fila in conexion.exec_driver_sql(f"EXPLAIN {sentencia}", parametros)]
+        escaneos = [paso for paso in plan if "Seq Scan" in paso]
+    return plan, escaneos
+
+def _consultas_de(db, contar_sentencias, servicio) -> list:
+    """SELECT que ejecuta una llamada a un servicio, con sus parámetros"""
+    with contar_sentencias(db) as conteo:
+        servicio()
+    return [
+        (sentencia, parametros) for sentencia, parametros in conteo["detalle"]
+        if sentencia.lstrip().upper().startswith("SELECT")
+    ]
+
+SERVICIOS = {
+    "obtener_saldos_acumulados": lambda db, ids: MovimientoFinancieroService(db).obtener_saldos_acumulados(date.today()),
+    "cronograma_pendiente": lambda db, ids: MovimientoFinancieroService(db)._cargar_cronograma_pendiente(),
+    "obtener_movimientos": lambda db, ids: MovimientoFinancieroService(db).obtener_movimientos(
+        date.today() - timedelta(days=30), date.today()),
+    "obtener_movimientos_por_operacion": lambda db, ids: MovimientoFinancieroService(db).obtener_movimientos_por_operacion(ids["operacion"]),
+    "obtener_operaciones_activas": lambda db, ids: OperacionService(db).obtener_operaciones(EstadoOperacion.ACTIVA),
+    "obtener_resumen_margenes": lambda db, ids: OperacionService(db).obtener_resumen_margenes(
+        date.today() - timedelta(days=30), date.today()),
+    "obtener_factura_por_operacion": lambda db, ids: FacturaService(db).obtener_factura_por_operacion(ids["operacion"]),
+    "reconciliar_estado_pagos": lambda db, ids: MovimientoFinancieroService(db).reconciliar_estado_pagos(
+        [ids["operacion"]], confirmar=False),
+    "eliminar_movimiento": lambda db, ids: MovimientoFinancieroService(db).eliminar_movimiento(ids["movimiento"]),
+}
+
+@pytest.mark.parametrize("nombre", list(SERVICIOS))
+def test_consultas_del_servicio_usan_indices(db, contar_sentencias, nombre):
+    operaciones = sembrar_operaciones(db, 5)
+    ids = {
+        "operacion": operaciones[0].id,
+        "movimiento": db.query(MovimientoFinanciero.id).filter(
+            MovimientoFinanciero.operacion_id == operaciones[0].id
+        ).scalar()
+    }
+    db.commit()
+
+    consultas = _consultas_de(db, contar_sentencias, lambda: SERVICIOS[nombre](db, ids))
+    db.rollback()
+    assert consultas
+
+    with db.get_bind().connect() as conexion:
+        if conexion.dialect.name == "postgresql":
+            # Con tablas chicas PostgreSQL prefiere recorrerlas: forzar el índice si existe uno útil
+            conexion.exec_driver_sql("SET enable_seqscan = off")
+        for sentencia, parametros in consultas:
+            plan, escaneos = _plan(conexion, sentencia, parametros)
+            assert not escaneos, f"{nombre} recorre tablas completas:\n{sentencia}\n" + "\n".join(plan)
@@ -0,0 +1,63 @@
+# test_resumen_mensual.py - Resúmenes mensuales incrementales contra su reconstrucción completa
+from datetime import date, timedelta
+
+from conftest import sembrar_operaciones
+from database import ContactoService, MovimientoFinancieroService, OperacionService
+from models import (
+    EstadoOperacion, IncotermCompra, IncotermVenta, MovimientoFinanciero, ResumenMensualMovimiento,
+    ResumenMensualOperacion, TipoContacto, TipoMovimiento
+)
+
+def _filas(db, modelo) -> list:
+    columnas = modelo.__table__.columns
+    return sorted(
+        (tuple(round(valor, 6) if isinstance(valor, float) else valor for valor in fila)
+         for fila in db.query(*columnas).all()),
+        key=repr
+    )
+
+def _comparar_con_reconstruccion(db):
+    """Los totales mantenidos en cada escritura son los mismos que los de una reconstrucción"""
+    incremental = (_filas(db, ResumenMensualOperacion), _filas(db, ResumenMensualMovimiento))
+    OperacionService(db).reconstruir_resumen_mensual(confirmar=False)
+    MovimientoFinancieroService(db).reconstruir_resumen_mensual(confirmar=False)
+    reconstruido = (_filas(db, ResumenMensualOperacion), _filas(db, ResumenMensualMovimiento))
+    db.rollback()
+
+    assert incremental == reconstruido
+    assert incremental[0] and incremental[1]
+
+def test_resumenes_incrementales_coinciden_con_la_reconstruccion(db):
+    sembradas = sembrar_operaciones(db, 4)
+    operacion_ids = [operacion.id for operacion in sembradas]
+    operaciones = OperacionService(db)
+    movimientos = MovimientoFinancieroService(db)
+    _comparar_con_reconstruccion(db)
+
+    # Alta de una operación con otro cliente y de movimientos en otro mes
+    cliente = ContactoService(db).crear_contacto("Otro Cliente", TipoContacto.CLIENTE)
+    nueva = operaciones.crear_operacion(sembradas[0].proveedor_id, cliente.id, IncotermCompra.EXW, 5000.0,
+                                        IncotermVenta.DAP, 6500.0, costo_flete=120.0)
+    movimientos.crear_movimiento(date.today() - timedelta(days=60), TipoMovimiento.RETIRO, "Retiro",
+                                 monto_salida=250.0)
+    movimientos.crear_movimiento(date.today() - timedelta(days=5), TipoMovimiento.DEPOSITO_OPERACION,
+                                 "Depósito", monto_salida=1000.0, operacion_id=nueva.id)
+    _comparar_con_reconstruccion(db)
+
+    # Cambios de estado, incluido volver al estado original
+    operaciones.cambiar_estado(operacion_ids[1], EstadoOperacion.CANCELADA)
+    operaciones.cambiar_estado(operacion_ids[2], EstadoOperacion.COMPLETADA)
+    operaciones.cambiar_estado(operacion_ids[2], EstadoOperacion.ACTIVA)
+    _comparar_con_reconstruccion(db)
+
+    # Cambio de costos y precio: cambian compras, ventas y márgenes
+    operaciones.actualizar_costos(nueva.id, valor_compra=5200.0, costo_flete=80.0, precio_venta=7000.0)
+    operaciones.actualizar_costos(operacion_ids[1], costo_despachante=45.0)
+    _comparar_con_reconstruccion(db)
+
+    # Bajas de movimientos y de operaciones con sus movimientos en cascada
+    retiro_id = db.query(MovimientoFinanciero.id).filter(MovimientoFinanciero.tipo == TipoMovimiento.RETIRO).scalar()
+    movimientos.eliminar_movimiento(retiro_id)
+    operaciones.eliminar_operacion(operacion_ids[3])
+    operaciones.eliminar_operaciones([operacion_ids[1], nueva.id])
+    _comparar_con_reconstruccion(db)
@@ -0,0 +1,110 @@
+# test_saldos.py - Checkpoints diarios, saldo actual y proyección de cash flow contra un cálculo directo
+from datetime import date, timedelta
+
+import pytest
+from dateutil.relativedelta import relativedelta
+
+from conftest import sembrar_operaciones
+from database import MovimientoFinancieroService
+from models import EstadoPago, MovimientoFinanciero, PagoProgramado, SaldoDiario, TipoMovimiento, TipoPago
+
+def _saldo_directo(db, fecha_hasta: date) -> float:
+    """Entradas menos salidas de los movimientos hasta la fecha, sin checkpoints"""
+    return sum(
+        (entrada or 0.0) - (salida or 0.0) for entrada, salida in
+        db.query(MovimientoFinanciero.monto_entrada, MovimientoFinanciero.monto_salida)
+        .filter(MovimientoFinanciero.fecha <= fecha_hasta)
+    )
+
+def _cortes(fecha_hasta: date, dias: int, granularidad: str) -> list:
+    fin = fecha_hasta + timedelta(days=dias)
+    if granularidad == "mensual":
+        cortes = []
+        while fecha_hasta + relativedelta(months=len(cortes)) <= fin:
+            cortes.append(fecha_hasta + relativedelta(months=len(cortes)))
+        return cortes
+    paso = {"diaria": 1, "semanal": 7}[granularidad]
+    return [fecha_hasta + timedelta(days=d) for d in range(0, dias + 1, paso)]
+
+def _proyeccion_directa(db, fecha_hasta: date, dias: int, granularidad: str) -> dict:
+    """Saldo en cada corte: saldo actual más los pagos pendientes posteriores a la fecha de corte"""
+    saldo_actual = _saldo_directo(db, fecha_hasta)
+    pendientes = db.query(PagoProgramado.tipo, PagoProgramado.fecha_programada, PagoProgramado.monto).filter(
+        PagoProgramado.estado == EstadoPago.PENDIENTE
+    ).all()
+    proyeccion = {}
+    for corte in _cortes(fecha_hasta, dias, granularidad):
+        en_rango = [(tipo, monto) for tipo, fecha, monto in pendientes if fecha_hasta < fecha <= corte]
+        ingresos = sum(monto for tipo, monto in en_rango if tipo == TipoPago.COBRO)
+        egresos = sum(monto for tipo, monto in en_rango if tipo == TipoPago.PAGO)
+        proyeccion[corte.strftime("%Y-%m-%d")] = {
+            "saldo": saldo_actual + ingresos - egresos, "ingresos": ingresos, "egresos": egresos
+        }
+    return proyeccion
+
+@pytest.mark.parametrize("granularidad", ["diaria", "semanal", "mensual"])
+@pytest.mark.parametrize("dias_atras", [0, 25])
+def test_proyeccion_coincide_con_el_calculo_directo(db, granularidad, dias_atras):
+    sembrar_operaciones(db, 12)
+    fecha_hasta = date.today() - timedelta(days=dias_atras)
+
+    saldo = MovimientoFinancieroService(db).calcular_saldo(fecha_hasta, dias_proyeccion=75, granularidad=granularidad)
+
+    esperada = _proyeccion_directa(db, fecha_hasta, 75, granularidad)
+    assert list(saldo["proyeccion_saldos"]) == list(esperada)
+    for corte, valores in esperada.items():
+        assert saldo["proyeccion_saldos"][corte] == pytest.approx(valores), corte
+    assert saldo["saldo_actual"] == pytest.approx(_saldo_directo(db, fecha_hasta))
+
+    # Los pagos que caen después del último corte quedan fuera de la proyección pero no del saldo proyectado
+    pendientes = db.query(PagoProgramado.tipo, PagoProgramado.monto).filter(
+        PagoProgramado.estado == EstadoPago.PENDIENTE
+    ).all()
+    neto_pendiente = sum(monto if tipo == TipoPago.COBRO else -monto for tipo, monto in pendientes)
+    assert saldo["saldo_proyectado"] == pytest.approx(saldo["saldo_actual"] + neto_pendiente)
+
+def _comparar_checkpoints(db, desde: date, hasta: date):
+    """Los acumulados leídos de los checkpoints coinciden día a día con la suma de los movimientos"""
+    servicio = MovimientoFinancieroService(db)
+    for dia in range((hasta - desde).days + 1):
+        fecha = desde + timedelta(days=dia)
+        filas = db.query(MovimientoFinanciero).filter(MovimientoFinanciero.fecha <= fecha).all()
+        acumulados = servicio.obtener_saldos_acumulados(fecha)
+        assert acumulados == pytest.approx({
+            "total_entradas": sum(m.monto_entrada or 0.0 for m in filas),
+            "total_salidas": sum(m.monto_salida or 0.0 for m in filas),
+            "depositos_operaciones": sum(m.monto_salida or 0.0 for m in filas
+                                         if m.tipo == TipoMovimiento.DEPOSITO_OPERACION),
+            "cobros_operaciones": sum(m.monto_entrada or 0.0 for m in filas
+                                      if m.tipo == TipoMovimiento.COBRO_OPERACION),
+            "cantidad_movimientos": len(filas)
+        }), fecha
+
+def test_checkpoints_diarios_tras_altas_y_bajas_con_fecha_pasada(db):
+    operacion_id = sembrar_operaciones(db, 3)[0].id
+    servicio = MovimientoFinancieroService(db)
+    hoy = date.today()
+    desde, hasta = hoy - timedelta(days=130), hoy + timedelta(days=1)
+    _comparar_checkpoints(db, desde, hasta)
+
+    # Altas en el pasado: un día sin checkpoint, un día que ya lo tiene y un día anterior a todos
+    adelanto = servicio.crear_movimiento(hoy - timedelta(days=75), TipoMovimiento.ADELANTO, "Adelanto",
+                                         monto_entrada=500.0)
+    servicio.crear_movimiento(hoy - timedelta(days=20), TipoMovimiento.DEPOSITO_OPERACION, "Depósito",
+                              monto_salida=50.0, operacion_id=operacion_id)
+    servicio.crear_movimiento(hoy - timedelta(days=125), TipoMovimiento.APORTE_INICIAL, "Aporte previo",
+                              monto_entrada=1000.0)
+    _comparar_checkpoints(db, desde, hasta)
+    assert db.query(SaldoDiario).filter(SaldoDiario.fecha == hoy - timedelta(days=75)).count() == 1
+
+    # Bajas en el pasado: el único movimiento de un día y uno de un día con varios
+    servicio.eliminar_movimiento(adelanto.id)
+    deposito_id = db.query(MovimientoFinanciero.id).filter(
+        MovimientoFinanciero.fecha == hoy - timedelta(days=20)
+    ).order_by(MovimientoFinanciero.id).first()[0]
+    servicio.eliminar_movimiento(deposito_id)
+    _comparar_checkpoints(db, desde, hasta)
+
+    # Una reconstrucción completa da los mismos saldos
+    servicio.reconstruir_saldos_diarios()
+    _comparar_checkpoints(db, desde, hasta)
@@ -0,0 +1,55 @@
+# test_sentencias.py - Presupuesto de sentencias SQL de los servicios de saldo y pagos
+import pytest
+
+from conftest import sembrar_operaciones
+from database import MovimientoFinancieroService
+
+# Máximo de sentencias por llamada, sin importar cuántas operaciones o pagos haya
+PRESUPUESTO_SALDO = 2            # acumulados + cronograma pendiente
+PRESUPUESTO_RECONCILIAR = 6      # por lote: borrado, pagos, movimientos, inserción, estados, versiones de datos
+
+@pytest.mark.parametrize("cantidad", [3, 30])
+def test_calcular_saldo_no_depende_de_la_cantidad_de_pagos(db, contar_sentencias, cantidad):
+    sembrar_operaciones(db, cantidad)
+    servicio = MovimientoFinancieroService(db)
+
+    with contar_sentencias(db, maximo=PRESUPUESTO_SALDO):
+        saldo = servicio.calcular_saldo()
+
+    assert saldo["cobros_futuros"] > 0
+
+@pytest.mark.parametrize("cantidad", [3, 30])
+def test_actualizar_estado_pagos_no_depende_de_la_cantidad_de_pagos(db, contar_sentencias, cantidad):
+    operacion_id = sembrar_operaciones(db, cantidad)[-1].id
+    servicio = MovimientoFinancieroService(db)
+
+    with contar_sentencias(db, maximo=PRESUPUESTO_RECONCILIAR):
+        servicio.actualizar_estado_pagos(operacion_id)
+
+def test_reconciliar_estado_pagos_usa_un_juego_de_consultas_por_lote(db, contar_sentencias):
+    operacion_ids = [operacion.id for operacion in sembrar_operaciones(db, 30)]
+    servicio = MovimientoFinancieroService(db)
+
+    # Sin ids: una consulta más para listar las operaciones
+    with contar_sentencias(db, maximo=PRESUPUESTO_RECONCILIAR + 1):
+        servicio.reconciliar_estado_pagos()
+
+    with contar_sentencias(db, maximo=PRESUPUESTO_RECONCILIAR):
+        servicio.reconciliar_estado_pagos(operacion_ids)
+
+    # Tres lotes de 10 operaciones: las consultas por lote se repiten, no por operación
+    with contar_sentencias(db, maximo=3 * (PRESUPUESTO_RECONCILIAR - 1) + 1):
+        servicio.reconciliar_estado_pagos(operacion_ids, tamano_lote=10)
+
+def test_contar_sentencias_ignora_otras_sesiones(db, contar_sentencias):
+    import models
+    from models import Operacion
+
+    with contar_sentencias(db) as conteo:
+        otra = models.SessionLocal()
+        try:
+            otra.query(Operacion).count()
+        finally:
+            otra.close()
+
+    assert conteo["sentencias"] == 0
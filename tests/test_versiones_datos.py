@@ -0,0 +1,111 @@
+# test_versiones_datos.py - Versiones de datos que invalidan los loaders cacheados
+from datetime import date, timedelta
+
+from sqlalchemy import insert
+
+from conftest import sembrar_operaciones
+from database import MovimientoFinancieroService
+from models import (
+    Contacto, HSCode, Operacion, TipoContacto, TipoMovimiento, VersionDatos,
+    _insert_dialecto, obtener_versiones_datos, incrementar_versiones_datos
+)
+
+def _incrementadas(db, antes: dict) -> set:
+    """Tablas cuya versión subió respecto de `antes`"""
+    despues = dict(zip(antes, obtener_versiones_datos(db, *antes)))
+    return {tabla for tabla in antes if despues[tabla] > antes[tabla]}
+
+def _versiones(db, *tablas: str) -> dict:
+    return dict(zip(tablas, obtener_versiones_datos(db, *tablas)))
+
+def test_insert_dialecto_corresponde_al_backend(db):
+    insert_dialecto = _insert_dialecto(db)
+
+    assert insert_dialecto.__module__.split(".")[-2] == db.get_bind().dialect.name
+    assert _insert_dialecto(db.connection()) is insert_dialecto
+
+def test_versiones_de_datos_se_incrementan_con_upsert(db):
+    assert obtener_versiones_datos(db, "operaciones", "facturas") == (0, 0)
+
+    incrementar_versiones_datos(db.connection(), {"operaciones"})
+    incrementar_versiones_datos(db.connection(), {"operaciones", "facturas"})
+    db.commit()
+
+    assert obtener_versiones_datos(db, "operaciones", "facturas") == (2, 1)
+    assert db.query(VersionDatos).count() == 2
+
+def test_commit_incrementa_la_version_de_las_tablas_escritas(db):
+    antes = obtener_versiones_datos(db, "contactos", "operaciones")
+    sembrar_operaciones(db, 1)
+
+    contactos, operaciones = obtener_versiones_datos(db, "contactos", "operaciones")
+    assert contactos > antes[0] and operaciones > antes[1]
+
+def test_flush_de_objetos_incrementa_altas_y_cambios(db):
+    antes = _versiones(db, "contactos", "hs_codes")
+    contacto = Contacto(nombre="Cliente", tipo=TipoContacto.CLIENTE)
+    db.add(contacto)
+    db.commit()
+    assert _incrementadas(db, antes) == {"contactos"}
+
+    antes = _versiones(db, "contactos", "hs_codes")
+    contacto.pais = "Chile"
+    db.commit()
+    assert _incrementadas(db, antes) == {"contactos"}
+
+    # Un commit sin cambios no incrementa nada
+    antes = _versiones(db, "contactos", "hs_codes")
+    db.commit()
+    assert _incrementadas(db, antes) == set()
+
+def test_rollback_descarta_las_tablas_registradas(db):
+    antes = _versiones(db, "contactos")
+    db.add(Contacto(nombre="Cliente", tipo=TipoContacto.CLIENTE))
+    db.flush()
+    db.rollback()
+    db.commit()
+
+    assert _incrementadas(db, antes) == set()
+
+def test_insert_core_desde_la_sesion_incrementa_la_version(db):
+    antes = _versiones(db, "hs_codes", "contactos")
+
+    db.execute(insert(HSCode.__table__), [
+        {"codigo": "0101.21", "descripcion": "Caballos reproductores"},
+        {"codigo": "0101.29", "descripcion": "Los demás caballos"}
+    ])
+    db.commit()
+
+    assert _incrementadas(db, antes) == {"hs_codes"}
+
+def test_borrado_masivo_incrementa_la_tabla_y_sus_cascadas(db):
+    operacion_id = sembrar_operaciones(db, 2)[0].id
+    tablas = ("operaciones", "pagos_programados", "movimientos_financieros", "asignaciones_pago",
+              "facturas", "contactos", "hs_codes")
+    antes = _versiones(db, *tablas)
+
+    db.query(Operacion).filter(Operacion.id == operacion_id).delete(synchronize_session=False)
+    db.commit()
+
+    assert _incrementadas(db, antes) == {
+        "operaciones", "pagos_programados", "movimientos_financieros", "asignaciones_pago", "facturas"
+    }
+
+def test_asignaciones_y_saldos_diarios_incrementan_su_version(db):
+    operacion_id = sembrar_operaciones(db, 1)[0].id
+    servicio = MovimientoFinancieroService(db)
+
+    # Asignación FIFO de un movimiento nuevo
+    antes = _versiones(db, "asignaciones_pago", "pagos_programados")
+    servicio.crear_movimiento(date.today() - timedelta(days=5), TipoMovimiento.DEPOSITO_OPERACION,
+                              "Segundo depósito", monto_salida=100.0, operacion_id=operacion_id)
+    assert "asignaciones_pago" in _incrementadas(db, antes)
+
+    # Reconciliación completa: borra y vuelve a insertar las asignaciones
+    antes = _versiones(db, "asignaciones_pago")
+    servicio.reconciliar_estado_pagos([operacion_id])
+    assert _incrementadas(db, antes) == {"asignaciones_pago"}
+
+    antes = _versiones(db, "saldos_diarios")
+    servicio.reconstruir_saldos_diarios()
+    assert _incrementadas(db, antes) == {"saldos_diarios"}